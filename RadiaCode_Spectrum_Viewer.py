@@ -1,21 +1,48 @@
+import csv
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 import typing
 from configparser import ConfigParser
 import os.path
 import sys
-import xml.etree.ElementTree as ET
 from datetime import datetime
 from typing import TextIO
 import numpy as np
 import pyqtgraph as pg
-from PySide6.QtCore import Qt, QStandardPaths
-from PySide6.QtGui import QGuiApplication, QIcon
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QStandardPaths, QFileSystemWatcher, QTimer, Signal
+from PySide6.QtGui import QFontMetrics, QGuiApplication, QIcon
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-                               QLabel, QPushButton, QCheckBox, QMessageBox, QSlider, QFrame, QFileDialog)
-from scipy.signal import find_peaks
+                               QLabel, QPushButton, QCheckBox, QMessageBox, QSlider, QFrame, QFileDialog,
+                               QTableWidget, QTableWidgetItem, QHeaderView, QComboBox, QInputDialog,
+                               QProgressDialog, QListWidget, QListWidgetItem, QStyle, QTableView)
+from scipy.signal import peak_prominences, peak_widths
+
+from rsv_archive import ARCHIVE_EXTENSION, SpectrumArchive
+from rsv_calibration import fit_calibration, load_overrides, match_peaks, reference_energies, \
+    remove_override, set_override
+from rsv_decomposition import BACKGROUND_COMPONENT, MixtureModel, grid_rates, load_references, \
+    remove_reference, set_reference
+from rsv_diagnostics import ERROR, INFO, WARNING, diagnostic
+from rsv_dose import dose_rate, load_functions as load_dose_functions, model_for_device as dose_model_for_device
+from rsv_efficiency import clear_cache as clear_efficiency_cache, compensate_counts, curve_diagnostics, load_curves, \
+    model_for_device, read_curve, set_curve
+from rsv_export import FORMATS, export_files, export_spectrum
+from rsv_labels import declutter, in_view
+from rsv_library import METRICS, SpectrumLibrary, library_edges, settings_from_config
+from rsv_parser import parse_spectrum
+from rsv_peak_fit import fit_peaks
+from rsv_pipeline import background_peak_flags, detect_peak_indices, load_settings, process_spectrum
+from rsv_roi import RoiIndex
+from rsv_render import RENDER_FORMATS, load_render_options, render_files
+from rsv_session import SESSION_EXTENSION, read_session, write_session
+from rsv_store import SpectrumStore
+from rsv_sum import SpectrumAccumulator, accumulate_files
+from rsv_tuning import declared_lines, detection_source, slider_ranges, split_counts, tune
+from rsv_theme import compile_stylesheet, plot_palette
+from rsv_watch import FolderScanner
+from rsv_processing import SMOOTHING_FILTERS, currie_limits, energy_axis, fwhm_channels, kev_per_channel, \
+    nearest_channel, normalize, parse_fwhm_model, smooth, smoothing_half_windows, snip_continuum, window_sums
 
 # TODO: Plot legend for plot only screenshots
-# TODO: Warn if 103G -> wrong compensation
-# TODO: Peak detection on background
 # TODO: Unload file / clear plot button
 # TODO: Error logging into file
 
@@ -33,7 +60,552 @@ if typing.TYPE_CHECKING:
     from _typeshed import SupportsWrite
 
 
+class PeakTableWindow(QWidget):
+    columns = ["Energy (keV)", "± (keV)", "FWHM (keV)", "Net Counts", "± Counts", "Net CPS", "Chi² / ndf"]
+
+    def __init__(self, parent):
+        super().__init__(parent, Qt.WindowType.Window)
+        self.results = None
+        self.title = ""
+
+        self.setWindowTitle("Peak Analysis")
+        self.resize(700, 400)
+        self.layout = QVBoxLayout(self)
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setObjectName("peak_table")
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.layout.addWidget(self.table)
+
+        self.export_button = QPushButton("Export CSV")
+        self.export_button.setObjectName("peak_export_button")
+        self.export_button.clicked.connect(self.export_csv)
+        self.layout.addWidget(self.export_button)
+
+    def set_results(self, results, title):
+        self.results = results
+        self.title = title
+        rows = zip(results["energy"], results["energy_err"], results["fwhm"], results["net_counts"],
+                   results["net_counts_err"], results["cps"], results["reduced_chi2"])
+
+        self.table.setRowCount(len(results["energy"]))
+        for row, values in enumerate(rows):
+            texts = [f"{values[0]:.1f}", f"{values[1]:.2f}", f"{values[2]:.1f}", f"{values[3]:.0f}",
+                     f"{values[4]:.0f}", f"{values[5]:.3f}", f"{values[6]:.2f}"]
+            for column, text in enumerate(texts):
+                item = QTableWidgetItem(text)
+                item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.table.setItem(row, column, item)
+
+    def export_csv(self):
+        if self.results is None:
+            return
+
+        suggested_name = f"{self.title}_peaks_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
+        save_dir = config.get("Paths", "last_save_directory")
+        if not save_dir:
+            save_dir = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DesktopLocation)
+        else:
+            save_dir = os.path.abspath(save_dir)
+
+        save_name = os.path.join(save_dir, suggested_name)
+        save_dialog, _ = QFileDialog.getSaveFileName(self, "Export Peaks", save_name, "CSV Files (*.csv)")
+        if save_dialog:
+            if not save_dialog.endswith(".csv"):
+                save_dialog += ".csv"
+
+            keys = ["energy", "energy_err", "fwhm", "channel", "channel_err", "fwhm_channels",
+                    "net_counts", "net_counts_err", "cps", "reduced_chi2"]
+            with open(save_dialog, "w", newline="", encoding="utf8") as f:
+                writer = csv.writer(f)
+                writer.writerow(keys)
+                writer.writerows(zip(*(self.results[key] for key in keys)))
+
+            new_save_dir = os.path.dirname(save_dialog)
+            config.set("Paths", "last_save_directory", new_save_dir)
+            with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+                config.write(f)
+
+
+class SimilarityWindow(QWidget):
+    columns = ["Sample", "Device", "Start Time", "Score"]
+
+    def __init__(self, parent):
+        super().__init__(parent, Qt.WindowType.Window)
+        self.viewer = parent
+        self.results = []
+
+        self.setWindowTitle("Similar Spectra")
+        self.resize(700, 400)
+        self.layout = QVBoxLayout(self)
+
+        self.metric_combobox = QComboBox()
+        self.metric_combobox.setObjectName("similarity_metric_combobox")
+        for metric, name in METRICS.items():
+            self.metric_combobox.addItem(name, metric)
+        self.metric_combobox.currentIndexChanged.connect(self.search)
+        self.layout.addWidget(self.metric_combobox)
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setObjectName("similarity_table")
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        # Double click opens the spectrum in the viewer
+        self.table.cellDoubleClicked.connect(self.open_result)
+        self.layout.addWidget(self.table)
+
+        self.status_label = QLabel("")
+        self.status_label.setObjectName("similarity_status_label")
+        self.layout.addWidget(self.status_label)
+
+        self.add_files_button = QPushButton("Add Files to Library")
+        self.add_files_button.setObjectName("library_add_button")
+        self.add_files_button.clicked.connect(self.add_files)
+        self.layout.addWidget(self.add_files_button)
+
+    def search(self):
+        library = self.viewer.get_library()
+        if library is None:
+            return
+        try:
+            self.results = library.query(self.viewer.current_spectrum(), config.getint("Settings", "library_results"),
+                                         self.metric_combobox.currentData())
+            self.status_label.setText(f"{len(library)} spectra in the library")
+        except ValueError as e:
+            self.results = []
+            self.status_label.setText(str(e))
+
+        self.table.setRowCount(len(self.results))
+        for row, result in enumerate(self.results):
+            texts = [result["sample_name"], result["device"], result["start_time"], f"{result['score']:.4f}"]
+            for column, text in enumerate(texts):
+                item = QTableWidgetItem(text)
+                if column == 3:
+                    item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.table.setItem(row, column, item)
+
+    def open_result(self, row, _column):
+        path = self.results[row]["path"]
+        if path and self.viewer.open_button.isEnabled():
+            self.viewer.parse_xml(path)
+
+    def add_files(self):
+        library = self.viewer.get_library()
+        if library is None:
+            return
+        xml_files, _ = QFileDialog.getOpenFileNames(self, "Add Spectra to Library",
+                                                    config.get("Paths", "last_open_directory"), "XML Files (*.xml)")
+        if not xml_files:
+            return
+
+        progress = QProgressDialog("Adding spectra...", "Cancel", 0, len(xml_files), self)
+        progress.setWindowTitle("Spectrum Library")
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+
+        errors = []
+        additions = library.add_files(xml_files, config.getboolean("Settings", "include_channel_1023"),
+                                      load_overrides(config))
+        for i, (xml_file, error) in enumerate(additions):
+            if error:
+                errors.append(f"{os.path.basename(xml_file)}: {error}")
+            progress.setValue(i + 1)
+            QApplication.processEvents()
+            if progress.wasCanceled():
+                additions.close()
+                break
+        progress.close()
+
+        self.viewer.save_library()
+        self.search()
+        if errors:
+            msg_box = QMessageBox()
+            msg_box.setIcon(QMessageBox.Icon.Warning)
+            msg_box.setWindowTitle("Warning")
+            msg_box.setText(f"{len(errors)} files could not be added.\n" + "\n".join(errors[:20]))
+            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            msg_box.exec()
+
+
+class ArchiveTableModel(QAbstractTableModel):
+    columns = ["Sample", "Serial Number", "Start Time", "Live Time (s)"]
+
+    def __init__(self):
+        super().__init__()
+        self.archive = None
+
+    def set_archive(self, archive):
+        self.beginResetModel()
+        self.archive = archive
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if self.archive is None or parent.isValid() else len(self.archive)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.columns)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        # Only the visible rows are read from the archive
+        if role != Qt.ItemDataRole.DisplayRole or not index.isValid():
+            return None
+        entry = self.archive.metadata[index.row()]
+        column = index.column()
+        if column == 0:
+            return entry["sample_name"].decode("utf8")
+        if column == 1:
+            return entry["serial_number"].decode("utf8")
+        if column == 2:
+            return str(entry["start_time"].item())
+        return f"{entry['seconds']:.0f}"
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.columns[section]
+        return None
+
+
+class ArchiveWindow(QWidget):
+    def __init__(self, parent):
+        super().__init__(parent, Qt.WindowType.Window)
+        self.viewer = parent
+        self.archive = None
+
+        self.setWindowTitle("Spectrum Archive")
+        self.resize(700, 500)
+        self.layout = QVBoxLayout(self)
+
+        # A table model instead of table items, an archive can hold many thousand spectra
+        self.model = ArchiveTableModel()
+        self.table = QTableView()
+        self.table.setObjectName("archive_table")
+        self.table.setModel(self.model)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.table.setEditTriggers(QTableView.EditTrigger.NoEditTriggers)
+        # Double click opens the spectrum in the viewer
+        self.table.doubleClicked.connect(self.open_row)
+        self.layout.addWidget(self.table)
+
+        self.status_label = QLabel("No archive")
+        self.status_label.setObjectName("archive_status_label")
+        self.layout.addWidget(self.status_label)
+
+        self.button_row = QHBoxLayout()
+        self.layout.addLayout(self.button_row)
+
+        self.open_archive_button = QPushButton("Open Archive")
+        self.open_archive_button.setObjectName("archive_open_button")
+        self.open_archive_button.clicked.connect(self.select_archive)
+        self.button_row.addWidget(self.open_archive_button)
+
+        self.new_archive_button = QPushButton("New Archive")
+        self.new_archive_button.setObjectName("archive_new_button")
+        self.new_archive_button.clicked.connect(self.new_archive)
+        self.button_row.addWidget(self.new_archive_button)
+
+        self.add_files_button = QPushButton("Add Files to Archive")
+        self.add_files_button.setObjectName("archive_add_button")
+        self.add_files_button.setDisabled(True)
+        self.add_files_button.clicked.connect(self.add_files)
+        self.button_row.addWidget(self.add_files_button)
+
+        path = config.get("Paths", "archive_file")
+        if path and os.path.exists(path):
+            self.open_archive(path)
+
+    def set_archive(self, archive):
+        self.archive = archive
+        self.model.set_archive(archive)
+        self.add_files_button.setDisabled(archive is None)
+        self.update_status()
+        config.set("Paths", "archive_file", archive.path if archive is not None else "")
+        with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+            config.write(f)
+
+    def update_status(self):
+        if self.archive is None:
+            self.status_label.setText("No archive")
+        else:
+            self.status_label.setText(f"{os.path.basename(self.archive.path)}: {len(self.archive)} spectra, "
+                                      f"{self.archive.n_channels} channels")
+
+    def open_archive(self, path):
+        try:
+            self.set_archive(SpectrumArchive(path))
+        except (ValueError, OSError) as e:
+            self.set_archive(None)
+            self.status_label.setText(str(e))
+
+    def select_archive(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Open Spectrum Archive", config.get("Paths", "last_open_directory"),
+                                              f"Spectrum Archives (*{ARCHIVE_EXTENSION})")
+        if path:
+            self.open_archive(path)
+
+    def new_archive(self):
+        path, _ = QFileDialog.getSaveFileName(self, "New Spectrum Archive", config.get("Paths", "last_save_directory"),
+                                              f"Spectrum Archives (*{ARCHIVE_EXTENSION})")
+        if not path:
+            return
+        if not path.endswith(ARCHIVE_EXTENSION):
+            path += ARCHIVE_EXTENSION
+        n_channels = 1024 if config.getboolean("Settings", "include_channel_1023") else 1023
+        try:
+            self.set_archive(SpectrumArchive.create(path, n_channels))
+        except OSError as e:
+            self.status_label.setText(str(e))
+
+    def open_row(self, index):
+        if self.archive is None or not self.viewer.open_button.isEnabled():
+            return
+        self.viewer.load_spectrum(self.archive.spectrum(index.row(), load_overrides(config)))
+
+    def add_files(self):
+        if self.archive is None:
+            return
+        xml_files, _ = QFileDialog.getOpenFileNames(self, "Add Spectra to Archive",
+                                                    config.get("Paths", "last_open_directory"), "XML Files (*.xml)")
+        if not xml_files:
+            return
+
+        progress = QProgressDialog("Adding spectra...", "Cancel", 0, len(xml_files), self)
+        progress.setWindowTitle("Spectrum Archive")
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+
+        errors = []
+        additions = self.archive.append_files(xml_files, config.getboolean("Settings", "include_channel_1023"))
+        try:
+            for i, (xml_file, error) in enumerate(additions):
+                if error:
+                    errors.append(f"{os.path.basename(xml_file)}: {error}")
+                progress.setValue(i + 1)
+                QApplication.processEvents()
+                if progress.wasCanceled():
+                    break
+        except OSError as e:
+            errors.append(str(e))
+        finally:
+            # The spectra parsed so far are still appended
+            additions.close()
+        progress.close()
+
+        self.model.set_archive(self.archive)
+        self.update_status()
+        if errors:
+            msg_box = QMessageBox()
+            msg_box.setIcon(QMessageBox.Icon.Warning)
+            msg_box.setWindowTitle("Warning")
+            msg_box.setText(f"{len(errors)} files could not be added.\n" + "\n".join(errors[:20]))
+            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            msg_box.exec()
+
+
+class DecompositionWindow(QWidget):
+    columns = ["Component", "Weight", "± Weight", "Share of Counts"]
+
+    def __init__(self, parent):
+        super().__init__(parent, Qt.WindowType.Window)
+        self.viewer = parent
+        self.result = None
+
+        self.setWindowTitle("Decomposition")
+        self.resize(600, 350)
+        self.layout = QVBoxLayout(self)
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setObjectName("decomposition_table")
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.layout.addWidget(self.table)
+
+        self.status_label = QLabel("")
+        self.status_label.setObjectName("decomposition_status_label")
+        self.layout.addWidget(self.status_label)
+
+        self.button_row = QHBoxLayout()
+        self.layout.addLayout(self.button_row)
+
+        self.fit_button = QPushButton("Fit View Range")
+        self.fit_button.setObjectName("decomposition_fit_button")
+        self.fit_button.clicked.connect(self.fit)
+        self.button_row.addWidget(self.fit_button)
+
+        self.add_button = QPushButton("Add Reference")
+        self.add_button.setObjectName("decomposition_add_button")
+        self.add_button.clicked.connect(self.add_reference)
+        self.button_row.addWidget(self.add_button)
+
+        self.remove_button = QPushButton("Remove Reference")
+        self.remove_button.setObjectName("decomposition_remove_button")
+        self.remove_button.clicked.connect(self.remove_reference)
+        self.button_row.addWidget(self.remove_button)
+
+    def fit(self):
+        try:
+            self.result = self.viewer.decompose()
+        except ValueError as e:
+            self.result = None
+            self.table.setRowCount(0)
+            self.status_label.setText(str(e))
+            return
+
+        result = self.result
+        self.status_label.setText(f"{result['low_energy']:.0f} - {result['high_energy']:.0f} keV, "
+                                  f"{result['residual_fraction'] * 100:.1f} % of the counts not explained")
+        rows = zip(result["names"], result["weights"], result["errors"], result["fractions"])
+        self.table.setRowCount(len(result["names"]))
+        for row, (name, weight, error, fraction) in enumerate(rows):
+            texts = [name, f"{weight:.4f}", f"{error:.4f}", f"{fraction * 100:.1f} %"]
+            for column, text in enumerate(texts):
+                item = QTableWidgetItem(text)
+                if column:
+                    item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.table.setItem(row, column, item)
+
+    def add_reference(self):
+        xml_file, _ = QFileDialog.getOpenFileName(self, "Reference Spectrum",
+                                                  config.get("Paths", "last_open_directory"), "XML Files (*.xml)")
+        if not xml_file:
+            return
+        name, ok = QInputDialog.getText(self, "Reference Spectrum", "Isotope or source:",
+                                        text=os.path.splitext(os.path.basename(xml_file))[0])
+        if not ok or not name.strip():
+            return
+
+        set_reference(config, name.strip(), xml_file)
+        with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+            config.write(f)
+        self.fit()
+
+    def remove_reference(self):
+        row = self.table.currentRow()
+        if self.result is None or row < 0 or self.result["names"][row] == BACKGROUND_COMPONENT:
+            return
+        remove_reference(config, self.result["names"][row])
+        with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+            config.write(f)
+        self.fit()
+
+
+class CalibrationWindow(QWidget):
+    columns = ["Channel", "Energy (keV)", "Reference (keV)", "Source", "Residual (keV)"]
+
+    def __init__(self, parent):
+        super().__init__(parent, Qt.WindowType.Window)
+        self.main_window = parent
+        self.channels = []
+        self.channel_errors = []
+        self.references = []
+        self.new_coeffs = None
+
+        self.setWindowTitle("Energy Recalibration")
+        self.resize(650, 400)
+        self.layout = QVBoxLayout(self)
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setObjectName("calibration_table")
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.layout.addWidget(self.table)
+
+        self.coeffs_label = QLabel("")
+        self.coeffs_label.setObjectName("calibration_coeffs_label")
+        self.coeffs_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.layout.addWidget(self.coeffs_label)
+
+        self.button_row = QHBoxLayout()
+        self.layout.addLayout(self.button_row)
+
+        self.order_combobox = QComboBox()
+        self.order_combobox.setObjectName("calibration_order_combobox")
+        self.order_combobox.addItem("Quadratic", 2)
+        self.order_combobox.addItem("Cubic", 3)
+        self.button_row.addWidget(self.order_combobox)
+
+        self.fit_button = QPushButton("Fit")
+        self.fit_button.setObjectName("calibration_fit_button")
+        self.fit_button.clicked.connect(self.fit)
+        self.button_row.addWidget(self.fit_button)
+
+        self.apply_button = QPushButton("Apply")
+        self.apply_button.setObjectName("calibration_apply_button")
+        self.apply_button.setDisabled(True)
+        self.apply_button.clicked.connect(self.apply)
+        self.button_row.addWidget(self.apply_button)
+
+        self.remove_button = QPushButton("Remove Override")
+        self.remove_button.setObjectName("calibration_remove_button")
+        self.remove_button.clicked.connect(self.main_window.remove_calibration)
+        self.button_row.addWidget(self.remove_button)
+
+    def set_peaks(self, channels, channel_errors, energies, references, sources):
+        self.channels = channels
+        self.channel_errors = channel_errors
+        self.references = references
+        self.new_coeffs = None
+        self.apply_button.setDisabled(True)
+        self.coeffs_label.setText("Uncheck peaks that are matched to the wrong line, then fit.")
+
+        self.table.setRowCount(len(channels))
+        for row in range(len(channels)):
+            channel_item = QTableWidgetItem(f"{channels[row]:.2f}")
+            channel_item.setFlags(channel_item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            channel_item.setCheckState(Qt.CheckState.Checked)
+            self.table.setItem(row, 0, channel_item)
+            self.table.setItem(row, 1, QTableWidgetItem(f"{energies[row]:.1f}"))
+            self.table.setItem(row, 2, QTableWidgetItem(f"{references[row]:.1f}"))
+            self.table.setItem(row, 3, QTableWidgetItem(sources[row]))
+            self.table.setItem(row, 4, QTableWidgetItem(""))
+
+    def fit(self):
+        rows = [row for row in range(self.table.rowCount())
+                if self.table.item(row, 0).checkState() == Qt.CheckState.Checked]
+        channels = np.array(self.channels)[rows]
+        energy_errors = (np.abs(kev_per_channel(channels, self.main_window.coeffs))
+                         * np.array(self.channel_errors)[rows])
+
+        try:
+            coeffs, residuals = fit_calibration(channels, np.array(self.references)[rows], energy_errors,
+                                                self.order_combobox.currentData())
+        except ValueError as e:
+            msg_box = QMessageBox()
+            msg_box.setIcon(QMessageBox.Icon.Warning)
+            msg_box.setWindowTitle("Warning")
+            msg_box.setText(str(e))
+            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            msg_box.exec()
+            return
+
+        for row in range(self.table.rowCount()):
+            self.table.item(row, 4).setText("")
+        for row, residual in zip(rows, residuals):
+            self.table.item(row, 4).setText(f"{residual:.2f}")
+
+        self.new_coeffs = coeffs
+        self.coeffs_label.setText("New coefficients: " + ", ".join(f"{c:.6g}" for c in coeffs))
+        self.apply_button.setDisabled(False)
+
+    def apply(self):
+        if self.new_coeffs is not None:
+            self.main_window.apply_calibration(self.new_coeffs)
+            self.close()
+
+
 class MainWindow(QMainWindow):
+    # Emitted from the parser thread of the watched folder: path, parsed spectrum or None, error
+    spectrum_parsed = Signal(str, object, str)
+
     def __init__(self):
         super().__init__()
 
@@ -43,10 +615,10 @@ class MainWindow(QMainWindow):
         self.intern_bg_energies = None
         self.intern_bg_dps = None
         self.intern_bg_coeffs = None
+        self.intern_bg_seconds = None
         self.contains_bg_data = None
         self.show_original_result_plot = False
         self.show_compensated_result_plot = False
-        self.black_white_plot = None
         self.result_dps = None
         self.original_normalized_bg_dp = None
         self.original_normalized_dp = None
@@ -57,16 +629,42 @@ class MainWindow(QMainWindow):
         self.show_original_bg_plot = False
         self.show_compensated_bg_plot = False
         self.bg_loaded = False
+        self.bg_source = ""
+        # Device the background was measured with, it selects the efficiency curve of its compensation
+        self.bg_device = ""
+        self.efficiency_curves = load_curves(config)
         self.bg_energies = []
         self.bg_coeffs = []
         self.bg_dps = []
+        # Live time of the background, None for a continuum of the spectrum itself
+        self.bg_seconds = None
         self.parsed_bg_data = {}
         self.plot_bg_data = {}
         self.parsed_data = {}
         self.log_x = False
         self.log_y = False
         self.peak_energy = []
+        self.peak_indices = []
+        self.peak_fit_results = None
+        self.peak_table_window = None
+        self.calibration_window = None
+        self.similarity_window = None
+        self.decomposition_window = None
+        self.mixture_model = None
+        self.archive_window = None
+        # Loaded with the first search, spectra of the watched folder are added to it from then on
+        self.library = None
         self.peak_dp_source = []
+        # Processed series by name as (parameters, result), reused until the data or a slider changes
+        self.series_cache = {}
+        # ROIs as energy windows, their items are made again with every plot
+        self.rois = []
+        self.roi_index = None
+        self.watch_scanner = None
+        self.watch_executor = None
+        # Parsed spectra of the watched folder, newest first as (store key, path)
+        self.recent_store = SpectrumStore(efficiency_curves=self.efficiency_curves)
+        self.recent_spectra = []
         self.plot_title = ""
         self.last_open_directory = ""
         self.last_save_directory = ""
@@ -132,6 +730,21 @@ class MainWindow(QMainWindow):
         self.line.setFixedWidth(150)
         self.left_row.addWidget(self.line)
 
+        self.dose_value_label = QLabel("")
+        self.dose_value_label.setObjectName("dose_value_label")
+        self.dose_value_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.left_row.addWidget(self.dose_value_label)
+
+        self.dose_label = QLabel("Dose Rate µSv/h (Estimate)")
+        self.dose_label.setObjectName("dose_label")
+        self.dose_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.left_row.addWidget(self.dose_label)
+
+        self.line = QFrame()
+        self.line.setFrameShape(QFrame.Shape.HLine)
+        self.line.setFixedWidth(150)
+        self.left_row.addWidget(self.line)
+
         self.duration_value_label = QLabel("")
         self.duration_value_label.setObjectName("duration_value_label")
         self.duration_value_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -222,6 +835,38 @@ class MainWindow(QMainWindow):
         self.open_button.clicked.connect(self.open_file)
         self.left_row.addWidget(self.open_button)
 
+        self.archive_button = QPushButton("Spectrum Archive")
+        self.archive_button.setObjectName("archive_button")
+        self.archive_button.clicked.connect(self.show_archive)
+        self.left_row.addWidget(self.archive_button)
+
+        self.watch_folder_checkbox = QCheckBox("Watch Folder")
+        self.watch_folder_checkbox.setObjectName("watch_folder_checkbox")
+        self.watch_folder_checkbox.checkStateChanged.connect(self.toggle_watch_folder)
+        self.left_row.addWidget(self.watch_folder_checkbox)
+
+        self.show_newest_checkbox = QCheckBox("Show Newest")
+        self.show_newest_checkbox.setObjectName("show_newest_checkbox")
+        self.show_newest_checkbox.setChecked(config.getboolean("Dynamic", "watch_show_newest"))
+        self.show_newest_checkbox.checkStateChanged.connect(self.toggle_show_newest)
+        self.left_row.addWidget(self.show_newest_checkbox)
+
+        self.recent_combobox = QComboBox()
+        self.recent_combobox.setObjectName("recent_combobox")
+        self.recent_combobox.setDisabled(True)
+        self.recent_combobox.activated.connect(self.show_recent)
+        self.left_row.addWidget(self.recent_combobox)
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.watch_folder_changed)
+        self.watcher.fileChanged.connect(self.watch_folder_changed)
+        # A burst of changes in the folder leads to one scan
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setSingleShot(True)
+        self.watch_timer.setInterval(config.getint("Settings", "watch_debounce_ms"))
+        self.watch_timer.timeout.connect(self.scan_watch_folder)
+        self.spectrum_parsed.connect(self.add_recent_spectrum)
+
         self.reset_plot_button = QPushButton("Reset Plot")
         self.reset_plot_button.setObjectName("reset_plot_button")
         self.reset_plot_button.clicked.connect(self.reset_plot)
@@ -238,28 +883,77 @@ class MainWindow(QMainWindow):
         self.screenshot_plot_button.clicked.connect(self.screenshot_plot)
         self.left_row.addWidget(self.screenshot_plot_button)
 
+        self.export_data_button = QPushButton("Export Data")
+        self.export_data_button.setObjectName("export_data_button")
+        self.export_data_button.setDisabled(True)
+        self.export_data_button.clicked.connect(self.export_data)
+        self.left_row.addWidget(self.export_data_button)
+
+        self.batch_export_button = QPushButton("Batch Export")
+        self.batch_export_button.setObjectName("batch_export_button")
+        self.batch_export_button.clicked.connect(self.batch_export)
+        self.left_row.addWidget(self.batch_export_button)
+
+        self.batch_render_button = QPushButton("Batch Render")
+        self.batch_render_button.setObjectName("batch_render_button")
+        self.batch_render_button.clicked.connect(self.batch_render)
+        self.left_row.addWidget(self.batch_render_button)
+
+        self.sum_files_button = QPushButton("Sum Files")
+        self.sum_files_button.setObjectName("sum_files_button")
+        self.sum_files_button.clicked.connect(self.sum_files)
+        self.left_row.addWidget(self.sum_files_button)
+
+        self.open_session_button = QPushButton("Open Session")
+        self.open_session_button.setObjectName("open_session_button")
+        self.open_session_button.clicked.connect(self.open_session)
+        self.left_row.addWidget(self.open_session_button)
+
+        self.save_session_button = QPushButton("Save Session")
+        self.save_session_button.setObjectName("save_session_button")
+        self.save_session_button.setDisabled(True)
+        self.save_session_button.clicked.connect(self.save_session)
+        self.left_row.addWidget(self.save_session_button)
+
         self.about_button = QPushButton("About")
         self.about_button.setObjectName("about_button")
         self.about_button.clicked.connect(self.about)
         self.left_row.addWidget(self.about_button)
 
         self.plot = pg.PlotWidget()
-        self.plot_bg_color = ""
-        self.plot_title_color = ""
-        self.plot_line_color = ""
         self.plot_line_width = config.getint("Settings", "plt_line_width")
-        self.plot_background_color = ""
-        self.plot_x_label_color = ""
-        self.plot_y_label_color = ""
-        self.original_plot_color = ""
-        self.compensated_plot_color = ""
-        self.compensated_bg_plot_color = ""
-        self.original_result_plot_color = ""
-        self.compensated_result_plot_color = ""
-        self.original_bg_plot_color = ""
-        self.annotation_color = ""
-        self.annotation_bg_color = ""
-        self.layout.addWidget(self.plot)
+        self.plot_colors = {}
+        # Curves as (item, color key) and annotations as (line, text), so they can be restyled without a redraw
+        self.plot_items = []
+        self.annotation_items = []
+        self.significance_item = None
+        # Every detected peak, labels are only made for the ones in view that don't overlap
+        self.annotation_peaks = []
+        self.annotation_timer = QTimer(self)
+        self.annotation_timer.setSingleShot(True)
+        self.annotation_timer.setInterval(config.getint("Settings", "annotation_update_ms"))
+        self.annotation_timer.timeout.connect(self.update_annotations)
+        self.plot.getViewBox().sigRangeChanged.connect(self.view_range_changed)
+        self.plot.getViewBox().sigResized.connect(self.view_range_changed)
+        # Made once, the readout of the channel under the mouse only moves and changes its text
+        self.crosshair_lines = (pg.InfiniteLine(angle=90, movable=False), pg.InfiniteLine(angle=0, movable=False))
+        self.crosshair_label = pg.TextItem("", anchor=(0, 1))
+        self.crosshair_position = None
+        self.crosshair_timer = QTimer(self)
+        self.crosshair_timer.setSingleShot(True)
+        self.crosshair_timer.setInterval(config.getint("Settings", "crosshair_update_ms"))
+        self.crosshair_timer.timeout.connect(self.update_crosshair)
+        self.plot.scene().sigMouseMoved.connect(self.mouse_moved)
+        # Problems of the loaded files, shown below the plot without blocking
+        self.diagnostics_list = QListWidget()
+        self.diagnostics_list.setObjectName("diagnostics_list")
+        self.diagnostics_list.setMaximumHeight(90)
+        self.diagnostics_list.setVisible(False)
+
+        self.plot_column = QVBoxLayout()
+        self.plot_column.addWidget(self.plot)
+        self.plot_column.addWidget(self.diagnostics_list)
+        self.layout.addLayout(self.plot_column)
         self.show()
 
         self.line = QFrame()
@@ -322,6 +1016,13 @@ class MainWindow(QMainWindow):
         self.log_y_checkbox.checkStateChanged.connect(self.toggle_log_y)
         self.right_row.addWidget(self.log_y_checkbox)
 
+        self.crosshair_checkbox = QCheckBox("Crosshair")
+        self.crosshair_checkbox.setObjectName("crosshair_checkbox")
+        self.crosshair_checkbox.setChecked(config.getboolean("Dynamic", "show_crosshair"))
+        self.crosshair_checkbox.setDisabled(True)
+        self.crosshair_checkbox.checkStateChanged.connect(self.toggle_crosshair)
+        self.right_row.addWidget(self.crosshair_checkbox)
+
         self.line = QFrame()
         self.line.setFrameShape(QFrame.Shape.HLine)
         self.line.setFixedWidth(150)
@@ -359,6 +1060,16 @@ class MainWindow(QMainWindow):
         self.high_smooth_slider.valueChanged.connect(self.high_smooth_slider_changed)
         self.right_row.addWidget(self.high_smooth_slider)
 
+        self.smoothing_filter_combobox = QComboBox()
+        self.smoothing_filter_combobox.setObjectName("smoothing_filter_combobox")
+        for smoothing_filter, name in SMOOTHING_FILTERS.items():
+            self.smoothing_filter_combobox.addItem(name, smoothing_filter)
+        self.smoothing_filter_combobox.setCurrentIndex(
+            max(self.smoothing_filter_combobox.findData(config.get("Dynamic", "smoothing_filter")), 0))
+        self.smoothing_filter_combobox.setMaximumWidth(150)
+        self.smoothing_filter_combobox.currentIndexChanged.connect(self.smoothing_filter_changed)
+        self.right_row.addWidget(self.smoothing_filter_combobox)
+
         self.line = QFrame()
         self.line.setFrameShape(QFrame.Shape.HLine)
         self.line.setFixedWidth(150)
@@ -376,6 +1087,27 @@ class MainWindow(QMainWindow):
         else:
             self.peak_detection_checkbox.setChecked(False)
 
+        self.snip_peak_detection_checkbox = QCheckBox("Subtract Continuum")
+        self.snip_peak_detection_checkbox.setObjectName("snip_peak_detection_checkbox")
+        self.snip_peak_detection_checkbox.setChecked(config.getboolean("Dynamic", "snip_peak_detection"))
+        self.snip_peak_detection_checkbox.checkStateChanged.connect(self.toggle_snip_peak_detection)
+        self.snip_peak_detection_checkbox.setDisabled(True)
+        self.right_row.addWidget(self.snip_peak_detection_checkbox)
+
+        self.significance_checkbox = QCheckBox("Show Significance")
+        self.significance_checkbox.setObjectName("significance_checkbox")
+        self.significance_checkbox.setChecked(config.getboolean("Dynamic", "show_significance"))
+        self.significance_checkbox.checkStateChanged.connect(self.toggle_significance)
+        self.significance_checkbox.setDisabled(True)
+        self.right_row.addWidget(self.significance_checkbox)
+
+        self.significant_peaks_checkbox = QCheckBox("Significant Peaks Only")
+        self.significant_peaks_checkbox.setObjectName("significant_peaks_checkbox")
+        self.significant_peaks_checkbox.setChecked(config.getboolean("Dynamic", "significant_peaks_only"))
+        self.significant_peaks_checkbox.checkStateChanged.connect(self.toggle_significant_peaks)
+        self.significant_peaks_checkbox.setDisabled(True)
+        self.right_row.addWidget(self.significant_peaks_checkbox)
+
         self.min_height_label = QLabel("Minimal Peak Height")
         self.min_height_label.setObjectName("peak_height_label")
         self.min_height_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -421,6 +1153,54 @@ class MainWindow(QMainWindow):
         self.distance_slider.valueChanged.connect(self.peak_distance_slider_changed)
         self.right_row.addWidget(self.distance_slider)
 
+        self.peak_table_button = QPushButton("Peak Table")
+        self.peak_table_button.setObjectName("peak_table_button")
+        self.peak_table_button.setDisabled(True)
+        self.peak_table_button.clicked.connect(self.show_peak_table)
+        self.right_row.addWidget(self.peak_table_button)
+
+        self.calibration_button = QPushButton("Recalibrate")
+        self.calibration_button.setObjectName("calibration_button")
+        self.calibration_button.setDisabled(True)
+        self.calibration_button.clicked.connect(self.show_calibration)
+        self.right_row.addWidget(self.calibration_button)
+
+        self.efficiency_curve_button = QPushButton("Efficiency Curve")
+        self.efficiency_curve_button.setObjectName("efficiency_curve_button")
+        self.efficiency_curve_button.setDisabled(True)
+        self.efficiency_curve_button.clicked.connect(self.open_efficiency_curve)
+        self.right_row.addWidget(self.efficiency_curve_button)
+
+        self.add_roi_button = QPushButton("Add ROI")
+        self.add_roi_button.setObjectName("add_roi_button")
+        self.add_roi_button.setDisabled(True)
+        self.add_roi_button.clicked.connect(self.add_roi)
+        self.right_row.addWidget(self.add_roi_button)
+
+        self.clear_rois_button = QPushButton("Clear ROIs")
+        self.clear_rois_button.setObjectName("clear_rois_button")
+        self.clear_rois_button.setDisabled(True)
+        self.clear_rois_button.clicked.connect(self.clear_rois)
+        self.right_row.addWidget(self.clear_rois_button)
+
+        self.similar_spectra_button = QPushButton("Similar Spectra")
+        self.similar_spectra_button.setObjectName("similar_spectra_button")
+        self.similar_spectra_button.setDisabled(True)
+        self.similar_spectra_button.clicked.connect(self.show_similar_spectra)
+        self.right_row.addWidget(self.similar_spectra_button)
+
+        self.decompose_button = QPushButton("Decompose")
+        self.decompose_button.setObjectName("decompose_button")
+        self.decompose_button.setDisabled(True)
+        self.decompose_button.clicked.connect(self.show_decomposition)
+        self.right_row.addWidget(self.decompose_button)
+
+        self.auto_tune_button = QPushButton("Auto-Tune")
+        self.auto_tune_button.setObjectName("auto_tune_button")
+        self.auto_tune_button.setDisabled(True)
+        self.auto_tune_button.clicked.connect(self.auto_tune)
+        self.right_row.addWidget(self.auto_tune_button)
+
         self.line = QFrame()
         self.line.setFrameShape(QFrame.Shape.HLine)
         self.line.setFixedWidth(150)
@@ -439,6 +1219,12 @@ class MainWindow(QMainWindow):
         self.load_bg_button.clicked.connect(self.open_bg_file)
         self.right_row.addWidget(self.load_bg_button)
 
+        self.snip_bg_button = QPushButton("SNIP Continuum")
+        self.snip_bg_button.setObjectName("snip_bg_button")
+        self.snip_bg_button.setDisabled(True)
+        self.snip_bg_button.clicked.connect(self.show_snip_bg)
+        self.right_row.addWidget(self.snip_bg_button)
+
         self.subtract_bg_button = QPushButton("Subtract Background")
         self.subtract_bg_button.setObjectName("subtract_bg_button")
         self.subtract_bg_button.clicked.connect(self.subtract_bg)
@@ -452,17 +1238,44 @@ class MainWindow(QMainWindow):
 
         self.right_row.setAlignment(Qt.AlignmentFlag.AlignTop)
 
-        check_theme = config.get("Dynamic", "theme")
-        if check_theme == "light":
-            self.theme_setting_checkbox.setChecked(False)
-        elif check_theme == "dark":
-            self.theme_setting_checkbox.setChecked(True)
+    def get_snip_continuum(self, data_points):
+        return snip_continuum(data_points, self.coeffs,
+                              config.getint("Settings", "snip_iterations"),
+                              config.getfloat("Settings", "snip_fwhm_662_percent"))
+
+    def show_snip_bg(self):
+        self.bg_loaded = False
+        self.bg_source = "snip"
+        self.bg_device = self.parsed_data.get("device", "")
+        self.clear_series_cache("original_bg", "compensated_bg")
+        self.bg_coeffs = self.coeffs.copy()
+        self.bg_seconds = None
+        self.bg_dps = self.get_snip_continuum(self.data_points).astype(np.float32)
+        self.plot_bg_dps = self.bg_dps
+        self.bg_energies = self.get_energies(self.bg_coeffs, self.bg_dps)
+
+        self.show_original_bg_plot = True
+        self.show_compensated_bg_plot = True
+        self.subtract_bg_button.setDisabled(False)
+
+        self.bg_loaded = True
+        self.original_bg_plot_checkbox.setDisabled(False)
+        self.compensated_bg_plot_checkbox.setDisabled(False)
+        self.original_bg_plot_checkbox.setChecked(True)
+        self.compensated_bg_plot_checkbox.setChecked(True)
+
+        self.plot_data()
 
     def show_included_bg(self):
         self.bg_loaded = False
+        self.bg_source = "included"
+        self.bg_device = self.parsed_data.get("device", "")
+        self.clear_series_cache("original_bg", "compensated_bg")
         self.bg_coeffs = self.intern_bg_coeffs.copy()
-        self.bg_dps = self.intern_bg_dps.copy()
-        self.plot_bg_dps = self.bg_dps.copy()
+        self.bg_seconds = self.intern_bg_seconds
+        # Counts are read-only arrays, so the background shares them instead of copying
+        self.bg_dps = self.intern_bg_dps
+        self.plot_bg_dps = self.bg_dps
         self.bg_energies = self.get_energies(self.bg_coeffs, self.bg_dps)
 
         self.show_original_bg_plot = True
@@ -489,64 +1302,58 @@ class MainWindow(QMainWindow):
         self.compensated_bg_plot_checkbox.setChecked(False)
 
         self.result_dps = []
-        result_dp_list = []
         orig_dps = self.original_normalized_dp
         dps_to_subtract = self.original_normalized_bg_dp
 
+        # The continuum is estimated from the spectrum itself, so it has to be subtracted in counts
+        if self.bg_source == "snip":
+            orig_dps = self.plot_data_points
+            dps_to_subtract = self.plot_bg_dps
+
         if orig_dps is None or dps_to_subtract is None:
-            msg_box = QMessageBox()
-            msg_box.setIcon(QMessageBox.Icon.Critical)
-            msg_box.setWindowTitle("Error")
-            msg_box.setText("Something went wrong, please restart the app.\n"
-                            "Original Data and/or Subtract data can't be found.")
-            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-            msg_box.exec()
+            self.show_diagnostics([diagnostic(ERROR, "no_data",
+                                              "Something went wrong, please restart the app. "
+                                              "Original Data and/or Subtract data can't be found.",
+                                              "background")], self.plot_title, clear=False)
             return
 
         if len(orig_dps) != len(dps_to_subtract):
-            msg_box = QMessageBox()
-            msg_box.setIcon(QMessageBox.Icon.Critical)
-            msg_box.setWindowTitle("Error")
-            msg_box.setText("Foreground and background spectra\n"
-                            "don't have the same number of datapoints.")
-            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-            msg_box.exec()
+            self.show_diagnostics([diagnostic(ERROR, "channel_mismatch",
+                                              "Foreground and background spectra don't have the same number of "
+                                              "datapoints.", "background")], self.plot_title, clear=False)
             return
         else:
-            for i in range(len(orig_dps)):
-                dps = orig_dps[i] - dps_to_subtract[i]
-                result_dp_list.append(dps)
-
             # Make negative values 0
-            result_dp_list = [i if i > 0 else 0 for i in result_dp_list]
+            result_dp_list = np.maximum(np.asarray(orig_dps, dtype=float) - np.asarray(dps_to_subtract, dtype=float), 0)
 
             # Get the biggest number in the list
-            maximum_value = max(result_dp_list)
+            maximum_value = result_dp_list.max()
 
             # Normalize the list so that the maximum value is 1
-            try:
-                self.result_dps = [x / maximum_value for x in result_dp_list]
-            except ZeroDivisionError:
-                msg_box = QMessageBox()
-                msg_box.setIcon(QMessageBox.Icon.Critical)
-                msg_box.setWindowTitle("Error")
-                msg_box.setText("Division by zero error!\n"
-                                " Probably identical fore- and background?")
-                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-                msg_box.exec()
+            if maximum_value > 0:
+                self.result_dps = (result_dp_list / maximum_value).astype(np.float32)
+            else:
+                self.show_diagnostics([diagnostic(ERROR, "identical_spectra",
+                                                  "Division by zero error! Probably identical fore- and background?",
+                                                  "background")], self.plot_title, clear=False)
                 return
 
             self.show_original_result_plot = True
             self.show_compensated_result_plot = True
+            self.clear_series_cache("compensated_result")
+            self.set_subtract_mode(True)
 
-            self.load_bg_button.setDisabled(True)
-            self.open_button.setDisabled(True)
+            self.plot_data()
 
-            self.subtract_bg_button.setText("Back")
-            self.subtract_bg_button.clicked.disconnect()
-            self.subtract_bg_button.clicked.connect(self.previous_plots)
+    def set_subtract_mode(self, subtracted):
+        self.load_bg_button.setDisabled(subtracted)
+        self.snip_bg_button.setDisabled(subtracted)
+        self.open_button.setDisabled(subtracted)
+        self.sum_files_button.setDisabled(subtracted)
 
-            self.plot_data()
+        self.subtract_bg_button.setText("Back" if subtracted else "Subtract Background")
+        self.subtract_bg_button.clicked.disconnect()
+        self.subtract_bg_button.clicked.connect(self.previous_plots if subtracted else self.subtract_bg)
 
     def previous_plots(self):
         self.show_original_plot = True
@@ -560,13 +1367,7 @@ class MainWindow(QMainWindow):
         self.compensated_plot_checkbox.setChecked(True)
         self.original_bg_plot_checkbox.setChecked(True)
         self.compensated_bg_plot_checkbox.setChecked(True)
-
-        self.load_bg_button.setDisabled(False)
-        self.open_button.setDisabled(False)
-
-        self.subtract_bg_button.setText("Subtract Background")
-        self.subtract_bg_button.clicked.disconnect()
-        self.subtract_bg_button.clicked.connect(self.subtract_bg)
+        self.set_subtract_mode(False)
 
         self.plot_data()
 
@@ -609,111 +1410,32 @@ class MainWindow(QMainWindow):
         self.parse_bg(bg_xml_file)
 
     def parse_bg(self, bg_xml_file):
-        root = None
-        result_data = None
-        if bg_xml_file is not None:
-            tree = ET.parse(bg_xml_file)
-            root = tree.getroot()
-        try:
-            result_data = root.find("ResultDataList/ResultData")
-        except (Exception,):
-            msg_box = QMessageBox()
-            msg_box.setIcon(QMessageBox.Icon.Critical)
-            msg_box.setWindowTitle("Error")
-            msg_box.setText("The selected file is not a valid XML file.")
-            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-            msg_box.exec()
         try:
-            serial_number = result_data.find("EnergySpectrum/SerialNumber").text
-        except (Exception,):
-            serial_number = None
-
-        if serial_number is not None and serial_number.startswith("RC"):
-            try:
-                if serial_number[6] == "G":
-                    device = "RC-103G"
-                else:
-                    device = serial_number[:6]
-            except (Exception,):
-                device = "Unknown"
-        else:
-            device = "Unknown"
-
-        coeffs = [float(C.text) for C in result_data.find("EnergySpectrum/EnergyCalibration/Coefficients")]
-        if len(coeffs) < 3:
-            msg_box = QMessageBox()
-            msg_box.setIcon(QMessageBox.Icon.Critical)
-            msg_box.setWindowTitle("Error")
-            msg_box.setText("The selected file has less than 3 coefficients.")
-            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-            msg_box.exec()
+            spectrum = parse_spectrum(bg_xml_file, config.getboolean("Settings", "include_channel_1023"),
+                                      load_overrides(config))
+        except (ValueError, OSError) as e:
+            self.show_diagnostics([diagnostic(ERROR, "invalid_file", str(e), "background")],
+                                  os.path.basename(bg_xml_file), clear=False)
+            # The previous background stays
+            self.bg_loaded = bool(self.bg_source)
+            self.original_bg_plot_checkbox.setDisabled(not self.bg_loaded)
+            self.compensated_bg_plot_checkbox.setDisabled(not self.bg_loaded)
             return
-        if len(coeffs) > 3:
-            coeffs = coeffs[:3]
-            msg_box = QMessageBox()
-            msg_box.setIcon(QMessageBox.Icon.Information)
-            msg_box.setWindowTitle("Information")
-            msg_box.setText("XML has more than 3 coefficients.\n"
-                            "Only the first 3 will be used.")
-            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-            msg_box.exec()
-
-        if device == "RC-103G":
-            if coeffs[0] < 0:
-                msg_box = QMessageBox()
-                msg_box.setIcon(QMessageBox.Icon.Warning)
-                msg_box.setWindowTitle("Warning")
-                msg_box.setText("The selected file has a negative coefficient a0.\n"
-                                "This is no value a proper calibrated RC-103G would have.\n"
-                                "Data is still displayed, but the results might be incorrect.")
-                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-                msg_box.exec()
-        else:
-            if coeffs[0] < -20:
-                msg_box = QMessageBox()
-                msg_box.setIcon(QMessageBox.Icon.Warning)
-                msg_box.setWindowTitle("Warning")
-                msg_box.setText("The selected file has coefficient a0  < -20\n"
-                                "This is no value a proper calibrated device would have.\n"
-                                "Data is still displayed, but the results might be incorrect.")
-                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-                msg_box.exec()
 
-        if coeffs[0] > 30:
-            msg_box = QMessageBox()
-            msg_box.setIcon(QMessageBox.Icon.Warning)
-            msg_box.setWindowTitle("Warning")
-            msg_box.setText("The selected file has coefficient a0 > 30\n"
-                            "This is no value a proper calibrated device would have.\n"
-                            "Data is still displayed, but the results might be incorrect.")
-            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-            msg_box.exec()
-
-        data_points = [int(DP.text) for DP in result_data.find("EnergySpectrum/Spectrum")]
-
-        if not config.getboolean("Settings", "include_channel_1023"):
-            data_points = data_points[:-1]
-
-        # self.parsed_bg_data = {
-        #     "serial_number": serial_number,
-        #     "coeffs": coeffs,
-        #     "data_points": data_points,
-        # }
-
-        for coeff in self.coeffs:
-            if coeff == 0:
-                msg_box = QMessageBox()
-                msg_box.setIcon(QMessageBox.Icon.Critical)
-                msg_box.setWindowTitle("Error")
-                msg_box.setText("The selected file has one or more coefficients with a value of 0.\n"
-                                "Please check the coefficients in the file.")
-                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-                msg_box.exec()
-                return
+        # Only the measured spectrum of the file is the background, not its internal one
+        device = spectrum["device"]
+        coeffs = spectrum["coeffs"]
+        data_points = spectrum["data_points"]
+        self.show_diagnostics([d for d in spectrum["diagnostics"] if d["part"] == "spectrum"],
+                              os.path.basename(bg_xml_file), clear=False)
 
+        self.bg_source = "file"
+        self.bg_device = device
+        self.clear_series_cache("original_bg", "compensated_bg")
         self.bg_coeffs = coeffs.copy()
+        self.bg_seconds = spectrum["seconds"]
         self.bg_dps = data_points
-        self.plot_bg_dps = self.bg_dps.copy()
+        self.plot_bg_dps = self.bg_dps
         self.bg_energies = self.get_energies(self.bg_coeffs, self.bg_dps)
 
         self.show_original_bg_plot = True
@@ -757,172 +1479,209 @@ class MainWindow(QMainWindow):
         else:
             self.file_loaded = True
             self.peak_detection_checkbox.setDisabled(False)
+            self.snip_peak_detection_checkbox.setDisabled(False)
+            self.significance_checkbox.setDisabled(False)
+            self.significant_peaks_checkbox.setDisabled(False)
+            self.peak_table_button.setDisabled(False)
+            self.calibration_button.setDisabled(False)
+            self.efficiency_curve_button.setDisabled(False)
+            self.add_roi_button.setDisabled(False)
+            self.clear_rois_button.setDisabled(False)
+            self.similar_spectra_button.setDisabled(False)
+            self.decompose_button.setDisabled(False)
+            self.auto_tune_button.setDisabled(False)
 
         self.parse_xml(xml_file)
 
-    def parse_xml(self, xml_file):
-        root = None
-        result_data = None
-        if xml_file is not None:
-            tree = ET.parse(xml_file)
-            root = tree.getroot()
-        try:
-            result_data = root.find("ResultDataList/ResultData")
-        except (Exception,):
-            msg_box = QMessageBox()
-            msg_box.setIcon(QMessageBox.Icon.Critical)
-            msg_box.setWindowTitle("Error")
-            msg_box.setText("The selected file is not a valid XML file.")
-            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-            msg_box.exec()
-
-        self.show_included_bg_button.setVisible(False)
-
-        background_data = root.find("ResultDataList/ResultData/BackgroundEnergySpectrum")
-        if background_data is not None:
-            self.contains_bg_data = True
+    def toggle_watch_folder(self):
+        if not self.watch_folder_checkbox.isChecked():
+            self.stop_watch_folder()
+            return
 
-            bg_coeffs = [float(i.text) for i in background_data.find("EnergyCalibration/Coefficients")]
+        watch_directory = config.get("Paths", "watch_directory", fallback="")
+        if not watch_directory:
+            watch_directory = config.get("Paths", "last_open_directory")
+        folder = QFileDialog.getExistingDirectory(self, "Watch Folder", watch_directory)
+        if not folder:
+            self.watch_folder_checkbox.blockSignals(True)
+            self.watch_folder_checkbox.setChecked(False)
+            self.watch_folder_checkbox.blockSignals(False)
+            return
 
-            if len(bg_coeffs) < 3:
-                msg_box = QMessageBox()
-                msg_box.setIcon(QMessageBox.Icon.Critical)
-                msg_box.setWindowTitle("Error")
-                msg_box.setText("The internal background has less than 3 coefficients.")
-                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-                msg_box.exec()
-                return
-            if len(bg_coeffs) > 3:
-                bg_coeffs = bg_coeffs[:3]
-                msg_box = QMessageBox()
-                msg_box.setIcon(QMessageBox.Icon.Information)
-                msg_box.setWindowTitle("Information")
-                msg_box.setText("The background has more than 3 coefficients.\n"
-                                "Only the first 3 will be used.")
-                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-                msg_box.exec()
+        # Saved when the viewer is closed
+        config.set("Paths", "watch_directory", folder)
+        self.watch_scanner = FolderScanner(folder)
+        self.watch_scanner.prime()
+        self.watch_executor = ThreadPoolExecutor(max_workers=1)
+        self.watcher.addPath(folder)
+        self.watch_folder_checkbox.setToolTip(folder)
+
+    def stop_watch_folder(self):
+        self.watch_timer.stop()
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+        if self.watcher.files():
+            self.watcher.removePaths(self.watcher.files())
+        if self.watch_executor is not None:
+            self.watch_executor.shutdown(wait=False, cancel_futures=True)
+        self.watch_executor = None
+        self.watch_scanner = None
+
+    def toggle_show_newest(self):
+        config.set("Dynamic", "watch_show_newest", str(self.show_newest_checkbox.isChecked()))
+
+    def watch_folder_changed(self):
+        self.watch_timer.start()
+
+    def scan_watch_folder(self):
+        if self.watch_scanner is None:
+            return
 
-            if config.getboolean("Settings", "include_channel_1023"):
-                bg_dps = [int(DP.text) for DP in background_data.find("Spectrum")]
-            else:
-                bg_dps = [int(DP.text) for DP in background_data.find("Spectrum")[:-1]]
+        try:
+            ready = self.watch_scanner.scan()
+        except OSError as e:
+            self.watch_folder_checkbox.setToolTip(f"Folder can't be read: {e}")
+            self.watch_folder_checkbox.setChecked(False)
+            return
 
-            self.intern_bg_coeffs = bg_coeffs.copy()
-            self.intern_bg_dps = bg_dps.copy()
-            self.show_included_bg_button.setVisible(True)
+        include_channel_1023 = config.getboolean("Settings", "include_channel_1023")
+        overrides = load_overrides(config)
+        for xml_file in ready:
+            future = self.watch_executor.submit(parse_spectrum, xml_file, include_channel_1023, overrides)
+            future.add_done_callback(lambda f, path=xml_file: self.emit_parsed(path, f))
 
-            self.intern_bg_energies = self.get_energies(self.intern_bg_coeffs, self.intern_bg_dps)
-        else:
-            self.contains_bg_data = False
+        # Files that are still being written are checked again
+        if self.watch_scanner.has_pending():
+            self.watch_timer.start()
 
+    def emit_parsed(self, xml_file, future):
+        # Runs in the parser thread, the signal hands the result to the GUI thread
         try:
-            serial_number = result_data.find("EnergySpectrum/SerialNumber").text
-        except (Exception,):
-            serial_number = None
+            self.spectrum_parsed.emit(xml_file, future.result(), "")
+        except CancelledError:
+            pass
+        except (ValueError, OSError) as e:
+            self.spectrum_parsed.emit(xml_file, None, str(e))
+
+    def add_recent_spectrum(self, xml_file, spectrum, error):
+        # Only the folder itself reports new files, changes inside a file are only seen for watched files.
+        # These are the recent ones and the ones that couldn't be parsed yet
+        if self.watch_scanner is not None and xml_file not in self.watcher.files():
+            self.watcher.addPath(xml_file)
+        if error:
+            self.watch_folder_checkbox.setToolTip(f"{os.path.basename(xml_file)}: {error}")
+            self.show_diagnostics([diagnostic(ERROR, "invalid_file", error)], os.path.basename(xml_file), clear=False)
+            return
 
-        file_name = os.path.basename(xml_file)
-        sample_name = os.path.splitext(file_name)[0]
+        # A changed file replaces its older version
+        for key, path in [entry for entry in self.recent_spectra if entry[1] == xml_file]:
+            self.recent_store.remove(key)
+            self.recent_spectra.remove((key, path))
 
-        if serial_number is not None and serial_number.startswith("RC"):
+        self.recent_spectra.insert(0, (self.recent_store.add(spectrum), xml_file))
+        if self.library is not None:
             try:
-                if serial_number[6] == "G":
-                    device = "RC-103G"
-                else:
-                    device = serial_number[:6]
-            except (Exception,):
-                device = "Unknown"
-        else:
-            device = "Unknown"
-
-        coeffs = [float(C.text) for C in result_data.find("EnergySpectrum/EnergyCalibration/Coefficients")]
-        if len(coeffs) < 3:
-            msg_box = QMessageBox()
-            msg_box.setIcon(QMessageBox.Icon.Critical)
-            msg_box.setWindowTitle("Error")
-            msg_box.setText("The selected file has less than 3 coefficients.")
-            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-            msg_box.exec()
+                self.library.add(spectrum, os.path.abspath(xml_file))
+            except ValueError:
+                pass
+        while len(self.recent_spectra) > config.getint("Settings", "recent_spectra"):
+            key, path = self.recent_spectra.pop()
+            self.recent_store.remove(key)
+            if path in self.watcher.files():
+                self.watcher.removePath(path)
+
+        self.recent_combobox.clear()
+        self.recent_combobox.addItems([self.recent_store.metadata(key)["sample_name"]
+                                       for key, _ in self.recent_spectra])
+        self.recent_combobox.setToolTip(self.recent_store.memory_report())
+        self.recent_combobox.setDisabled(False)
+
+        # Not while a subtraction is shown, loading another file is blocked there
+        if self.show_newest_checkbox.isChecked() and self.open_button.isEnabled():
+            self.show_recent(0)
+
+    def show_recent(self, index):
+        if not 0 <= index < len(self.recent_spectra) or not self.open_button.isEnabled():
             return
-        if len(coeffs) > 3:
-            coeffs = coeffs[:3]
-            msg_box = QMessageBox()
-            msg_box.setIcon(QMessageBox.Icon.Information)
-            msg_box.setWindowTitle("Information")
-            msg_box.setText("XML has more than 3 coefficients.\n"
-                            "Only the first 3 will be used.")
-            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-            msg_box.exec()
-
-        if device == "RC-103G":
-            if coeffs[0] < 0:
-                msg_box = QMessageBox()
-                msg_box.setIcon(QMessageBox.Icon.Warning)
-                msg_box.setWindowTitle("Warning")
-                msg_box.setText("The selected file has a negative coefficient a0.\n"
-                                "This is no value a proper calibrated RC-103G would have.\n"
-                                "Data is still displayed, but the results might be incorrect.")
-                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-                msg_box.exec()
-        else:
-            if coeffs[0] < -20:
-                msg_box = QMessageBox()
-                msg_box.setIcon(QMessageBox.Icon.Warning)
-                msg_box.setWindowTitle("Warning")
-                msg_box.setText("The selected file has coefficient a0  < -20\n"
-                                "This is no value a proper calibrated device would have.\n"
-                                "Data is still displayed, but the results might be incorrect.")
-                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-                msg_box.exec()
-
-        if coeffs[0] > 30:
-            msg_box = QMessageBox()
-            msg_box.setIcon(QMessageBox.Icon.Warning)
-            msg_box.setWindowTitle("Warning")
-            msg_box.setText("The selected file has coefficient a0 > 30\n"
-                            "This is no value a proper calibrated device would have.\n"
-                            "Data is still displayed, but the results might be incorrect.")
-            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-            msg_box.exec()
-
-        data_points = [int(DP.text) for DP in result_data.find("EnergySpectrum/Spectrum")]
-        start_time = result_data.find('StartTime').text[:19]
-        end_time = result_data.find('EndTime').text[:19]
-        start_dt = datetime.strptime(start_time, '%Y-%m-%dT%H:%M:%S')
-        end_dt = datetime.strptime(end_time, '%Y-%m-%dT%H:%M:%S')
-        duration = end_dt - start_dt
-        duration_txt = str(duration)
-        time_seconds = duration.total_seconds()
-        start_time_formatted = start_time.replace("T", " ")
-        end_time_formatted = end_time.replace("T", " ")
-
-        if not config.getboolean("Settings", "include_channel_1023"):
-            data_points = data_points[:-1]
-
-        self.parsed_data = {
-            "sample_name": sample_name,
-            "serial_number": serial_number,
-            "device": device,
-            "coeffs": coeffs,
-            "data_points": data_points,
-            "seconds": time_seconds,
-            "duration": duration_txt,
-            "start_time": start_time_formatted,
-            "end_time": end_time_formatted
+        self.recent_combobox.setCurrentIndex(index)
+        self.load_spectrum(self.recent_store.spectrum(self.recent_spectra[index][0]))
+
+    def show_diagnostics(self, diagnostics, source, clear=True):
+        if clear:
+            self.diagnostics_list.clear()
+        icons = {
+            ERROR: QStyle.StandardPixmap.SP_MessageBoxCritical,
+            WARNING: QStyle.StandardPixmap.SP_MessageBoxWarning,
+            INFO: QStyle.StandardPixmap.SP_MessageBoxInformation,
         }
+        for entry in diagnostics:
+            item = QListWidgetItem(self.style().standardIcon(icons[entry["severity"]]),
+                                   f"{source}: {entry['message']}")
+            self.diagnostics_list.addItem(item)
+        self.diagnostics_list.setVisible(self.diagnostics_list.count() > 0)
+
+    def load_spectrum(self, spectrum):
+        # Spectra parsed by rsv_parser, already checked and with the calibration override applied
+        self.clear_series_cache()
+        self.contains_bg_data = spectrum.get("bg_data_points") is not None
+        self.show_included_bg_button.setVisible(self.contains_bg_data)
+        if self.contains_bg_data:
+            self.intern_bg_coeffs = list(spectrum["bg_coeffs"])
+            self.intern_bg_dps = spectrum["bg_data_points"]
+            self.intern_bg_seconds = spectrum.get("bg_seconds")
+            self.intern_bg_energies = self.get_energies(self.intern_bg_coeffs, self.intern_bg_dps)
 
+        self.file_loaded = True
+        self.peak_detection_checkbox.setDisabled(False)
+        self.snip_peak_detection_checkbox.setDisabled(False)
+        self.significance_checkbox.setDisabled(False)
+        self.significant_peaks_checkbox.setDisabled(False)
+        self.peak_table_button.setDisabled(False)
+        self.calibration_button.setDisabled(False)
+        self.efficiency_curve_button.setDisabled(False)
+        self.add_roi_button.setDisabled(False)
+        self.clear_rois_button.setDisabled(False)
+        self.similar_spectra_button.setDisabled(False)
+        self.decompose_button.setDisabled(False)
+        self.auto_tune_button.setDisabled(False)
+
+        self.parsed_data = {key: spectrum[key] for key in ("sample_name", "serial_number", "device", "coeffs",
+                                                           "file_coeffs", "data_points", "seconds", "duration",
+                                                           "start_time", "end_time")}
+        self.parsed_data["coeffs"] = list(self.parsed_data["coeffs"])
+
+        diagnostics = list(spectrum.get("diagnostics", []))
+        diagnostics.extend(curve_diagnostics(self.efficiency_curves, spectrum["device"]))
+        self.show_diagnostics(diagnostics, spectrum["sample_name"])
         self.fill_data(self.parsed_data)
 
+    def parse_xml(self, xml_file):
+        try:
+            spectrum = parse_spectrum(xml_file, config.getboolean("Settings", "include_channel_1023"),
+                                      load_overrides(config))
+        except (ValueError, OSError) as e:
+            self.show_diagnostics([diagnostic(ERROR, "invalid_file", str(e))], os.path.basename(xml_file))
+            # The previous spectrum stays
+            self.file_loaded = bool(self.parsed_data)
+            return
+
+        self.load_spectrum(spectrum)
+
     def fill_data(self, parsed_xml):
 
         self.original_plot_checkbox.setDisabled(False)
         self.compensated_plot_checkbox.setDisabled(False)
         self.black_on_white_plot_checkbox.setDisabled(False)
         self.screenshot_plot_button.setDisabled(False)
+        self.export_data_button.setDisabled(False)
+        self.save_session_button.setDisabled(False)
 
         self.load_bg_button.setDisabled(False)
+        self.snip_bg_button.setDisabled(False)
 
         self.log_y_checkbox.setDisabled(False)
         self.log_x_checkbox.setDisabled(False)
+        self.crosshair_checkbox.setDisabled(False)
 
         self.data_points = parsed_xml["data_points"]
         self.coeffs = parsed_xml["coeffs"]
@@ -933,20 +1692,18 @@ class MainWindow(QMainWindow):
         self.start_value_label.setText(parsed_xml["start_time"])
         self.end_value_label.setText(parsed_xml["end_time"])
         self.duration_value_label.setText(parsed_xml["duration"])
-        self.counts_value_label.setText(f"{sum(self.data_points): ,}".replace(',', ' '))
-        self.cps_value_label.setText(str(round(sum(self.data_points) / int(self.time_seconds), 2)))
+        total_counts = int(np.sum(self.data_points, dtype=np.int64))
+        self.counts_value_label.setText(f"{total_counts: ,}".replace(',', ' '))
+        self.cps_value_label.setText(str(round(total_counts / int(self.time_seconds), 2)))
+        self.update_dose_rate()
 
-        # Copy the data points and the coefficients for the plot calculations
-        self.plot_data_points = self.data_points.copy()
+        # The counts are never changed in place, the plot calculations share them
+        self.plot_data_points = self.data_points
         for coeff in self.coeffs:
             if coeff == 0:
-                msg_box = QMessageBox()
-                msg_box.setIcon(QMessageBox.Icon.Critical)
-                msg_box.setWindowTitle("Error")
-                msg_box.setText("The selected file has one or more coefficients with a value of 0.\n"
-                                "Please check the coefficients in the file.")
-                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-                msg_box.exec()
+                self.show_diagnostics([diagnostic(ERROR, "zero_coefficient",
+                                                  "The calibration has one or more coefficients with a value of 0.")],
+                                      parsed_xml["sample_name"], clear=False)
                 return
 
         self.coeffs = self.coeffs.copy()
@@ -956,161 +1713,455 @@ class MainWindow(QMainWindow):
 
     @staticmethod
     def get_energies(coeffs, data_points):
-        energies = []
-        for point in range(len(data_points)):
-            energy = coeffs[0] + coeffs[1] * point + coeffs[2] * point ** 2
-            energies.append(energy)
-        return energies
-
-    def get_compensated_dp(self, coeffs, data_points):
-        energies = self.get_energies(coeffs, data_points)
-
-        if energies[0] <= 0:
-            energy_offset = abs(energies[0]) + 0.1
-            energies = [(x + energy_offset) / 1000 for x in self.energies]
-        else:
-            energies = [x / 1000 for x in self.energies]
-
-        efficiency = [
-            np.exp(
-                -4.09527
-                - 2.34638 * np.log(E)
-                + 0.228436 * np.log(E) ** 2
-                + 0.31551 * np.log(E) ** 3
-                + 0.0383176 * np.log(E) ** 4
-            )
-            for E in energies
-        ]
-        return [data_point / eff for data_point, eff in zip(data_points, efficiency)]
+        # Cached and read-only, recalibrated spectra don't recompute their energy axis
+        return energy_axis(coeffs, len(data_points))
+
+    def cached_series(self, name, params, compute):
+        entry = self.series_cache.get(name)
+        if entry is None or entry[0] != params:
+            value = compute()
+            # Half the memory, single precision is more than enough for a normalized series
+            if isinstance(value, np.ndarray) and value.dtype == np.float64:
+                value = value.astype(np.float32)
+            entry = (params, value)
+            self.series_cache[name] = entry
+        return entry[1]
+
+    def clear_series_cache(self, *names):
+        if not names:
+            self.series_cache = {}
+        for name in names:
+            self.series_cache.pop(name, None)
+
+    def get_compensated_normalized(self, coeffs, energies, data_points, background=False):
+        compensated_dp = self.get_compensated_dp(coeffs, data_points, background)
+        smoothed_dp = self.get_smoothed_data(coeffs, energies, compensated_dp, self.low_smooth_slider.value(),
+                                             self.high_smooth_slider.value())
+        return self.normalize_data(smoothed_dp)
+
+    def get_compensated_dp(self, coeffs, data_points, background=False):
+        # Efficiency curve of the device, the background may be measured with another one
+        device = self.bg_device if background else self.parsed_data.get("device")
+        return compensate_counts(data_points, coeffs, model_for_device(self.efficiency_curves, device))
+
+    def get_smoothed_data(self, coeffs, energies, compensated_dp, low_smooth, high_smooth):
+        return smooth(energies, compensated_dp, low_smooth, high_smooth, self.smoothing_filter_combobox.currentData(),
+                      coeffs, self.get_fwhm_model())
 
     @staticmethod
-    def get_smoothed_data(energies, compensated_dp, low_smooth, high_smooth):
-        smoothed_dp = []
-        min_energy = min(energies)
-        max_energy = max(energies)
-
-        # Energy list has the same length as the data points
-        for i in range(len(energies)):
-            # Normalize the energy values
-            normalized_energy = (energies[i] - min_energy) / (max_energy - min_energy)
-            # Interpolate the smoothing value between min_smoothing and max_smoothing
-            # Calculate the moving average centered on the current point
-            smooth_value = int(low_smooth + (high_smooth - low_smooth) * normalized_energy)
-            half_window = smooth_value // 2
-            start_index = max(0, i - half_window)
-            end_index = min(len(compensated_dp), i + half_window + 1)
-            smoothed_dp.append(np.mean(compensated_dp[start_index:end_index]))
-        return smoothed_dp
+    def get_fwhm_model():
+        return parse_fwhm_model(config.get("Settings", "smoothing_fwhm_model"))
+
+    def get_smoothing(self):
+        # Everything the smoothed series depend on, part of their cache keys
+        return (self.low_smooth_slider.value(), self.high_smooth_slider.value(),
+                self.smoothing_filter_combobox.currentData(), *self.get_fwhm_model())
 
     @staticmethod
     def normalize_data(data):
-        min_data = min(data)
-        max_data = max(data)
-        return [(x - min_data) / (max_data - min_data) for x in data]
+        return normalize(data)
 
     @staticmethod
-    def detect_peaks(data, energies, height_slider, prominence_slider, distance_slider):
-        height_slider /= 100
-        prominence_slider /= 100
-        distance_slider = int(distance_slider)
-        peaks, _ = find_peaks(data, height=height_slider, prominence=prominence_slider, distance=distance_slider)
-        peak_energies = [round(energies[i], 1) for i in np.array(peaks)]
+    def detect_peak_indices(data, height_slider, prominence_slider, distance_slider):
+        return detect_peak_indices(data, height_slider, prominence_slider, distance_slider)
+
+    def detect_peaks(self, data, energies, height_slider, prominence_slider, distance_slider):
+        self.peak_indices = self.significant_peaks(
+            self.detect_peak_indices(data, height_slider, prominence_slider, distance_slider))
+        peak_energies = [round(float(energies[i]), 1) for i in np.array(self.peak_indices)]
         return peak_energies
 
-    def plot_data(self):
-        self.plot.clear()
+    def get_significance(self):
+        # Currie limits in a window of about one FWHM around every channel, or the smoothing window if
+        # that is wider, against the SNIP continuum of the spectrum itself. The continuum is clipped from the
+        # averaged counts, on the raw counts it follows the lower edge of the noise and everything is significant
+        smoothing = (self.low_smooth_slider.value(), self.high_smooth_slider.value())
+        window_fwhm = config.getfloat("Settings", "significance_window_fwhm")
+        fwhm_662_percent = config.getfloat("Settings", "snip_fwhm_662_percent")
+
+        def significance():
+            counts = np.asarray(self.data_points, dtype=float)
+            fwhm_half_windows = np.maximum(
+                np.rint(window_fwhm * fwhm_channels(self.coeffs, counts.size, fwhm_662_percent) / 2).astype(int), 1)
+            sums, widths = window_sums(counts, fwhm_half_windows)
+            continuum = self.get_snip_continuum(sums / widths)
+            half_windows = np.maximum(fwhm_half_windows, smoothing_half_windows(self.energies, *smoothing))
+            return currie_limits(counts, continuum, half_windows)
+
+        return self.cached_series("significance", (*smoothing, window_fwhm, fwhm_662_percent), significance)
+
+    def significant_peaks(self, peak_indices):
+        if not self.significant_peaks_checkbox.isChecked() or len(peak_indices) == 0:
+            return peak_indices
+        significance = self.get_significance()["significance"]
+        return peak_indices[significance[peak_indices] >= config.getfloat("Settings", "significance_threshold")]
+
+    def fit_detected_peaks(self):
+        if len(self.peak_indices) == 0:
+            self.peak_fit_results = fit_peaks([], [], [], self.coeffs)
+            return
+
+        def fit():
+            # The FWHM of the smoothed detection source is only the start value of the fit
+            widths = peak_widths(self.peak_dp_source, self.peak_indices, rel_height=0.5)[0]
+            return fit_peaks(self.plot_data_points, self.peak_indices, widths, self.coeffs, self.time_seconds)
+
+        params = (*self.get_smoothing(), self.snip_peak_detection_checkbox.isChecked(),
+                  *(int(i) for i in self.peak_indices))
+        self.peak_fit_results = self.cached_series("peak_fit", params, fit)
+
+    def auto_tune(self):
+        # Grid search over the smoothing and peak sliders for the settings that find the lines of the sample,
+        # the compensated counts are the same for all of them
+        nuclides, ok = QInputDialog.getText(self, "Auto-Tune", "Nuclides in the sample (empty for all known lines):",
+                                            text=config.get("Settings", "tuning_nuclides"))
+        if not ok:
+            return
+        try:
+            lines = declared_lines(nuclides)
+        except ValueError as e:
+            msg_box = QMessageBox()
+            msg_box.setIcon(QMessageBox.Icon.Critical)
+            msg_box.setWindowTitle("Error")
+            msg_box.setText(str(e))
+            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            msg_box.exec()
+            return
+        config.set("Settings", "tuning_nuclides", nuclides.strip())
+        with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+            config.write(f)
+
+        counts = np.asarray(self.data_points, dtype=float)
+        if self.snip_peak_detection_checkbox.isChecked():
+            counts = np.maximum(counts - self.get_snip_continuum(self.data_points), 0)
+        sources = [(list(self.coeffs), self.get_compensated_dp(self.coeffs, counts))]
+        # The counts split into parts stand in for repeated measurements, a line has to be found in all of them
+        repeats = []
+        if config.getint("Settings", "tuning_repeats") > 1:
+            model = model_for_device(self.efficiency_curves, self.parsed_data.get("device"))
+            repeats = [detection_source(part, self.coeffs, model, self.snip_peak_detection_checkbox.isChecked(),
+                                        config.getint("Settings", "snip_iterations"),
+                                        config.getfloat("Settings", "snip_fwhm_662_percent"))
+                       for part in split_counts(self.data_points, config.getint("Settings", "tuning_repeats"))]
+
+        rounds = config.getint("Settings", "tuning_rounds")
+        progress = QProgressDialog("Tuning the peak detection...", "Cancel", 0, rounds * 100, self)
+        progress.setWindowTitle("Auto-Tune")
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+
+        best = None
+        search = tune(sources, slider_ranges(config), self.smoothing_filter_combobox.currentData(),
+                      self.get_fwhm_model(), config.getint("Settings", "tuning_steps"), rounds, lines,
+                      config.getfloat("Settings", "tuning_match_fwhm"),
+                      config.getfloat("Settings", "tuning_false_peak_penalty"), repeats)
+        for search_round, done, total, best in search:
+            progress.setValue(search_round * 100 + done * 100 // total)
+            QApplication.processEvents()
+            if progress.wasCanceled():
+                search.close()
+                best = None
+                break
+        progress.close()
+        if best is None:
+            return
+
+        if best["score"] <= 0:
+            msg_box = QMessageBox()
+            msg_box.setIcon(QMessageBox.Icon.Information)
+            msg_box.setWindowTitle("Information")
+            msg_box.setText("No settings find more lines of the sample than other peaks, the sliders are not changed.")
+            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            msg_box.exec()
+            return
 
-        if self.black_on_white_plot_checkbox.isChecked():
-            self.original_plot_color = "black"
-            self.compensated_plot_color = "black"
-            self.original_bg_plot_color = "black"
-            self.compensated_bg_plot_color = "black"
-            self.original_result_plot_color = "black"
-            self.compensated_result_plot_color = "black"
-            self.annotation_color = "black"
-            self.annotation_bg_color = "white"
-            self.plot_title_color = "black"
-            self.plot_background_color = "white"
-            self.plot_x_label_color = "black"
-            self.plot_y_label_color = "black"
-            self.plot.setBackground(self.plot_background_color)
+        # One plot for all sliders
+        sliders = {"low_smooth": self.low_smooth_slider, "high_smooth": self.high_smooth_slider,
+                   "min_height": self.min_height_slider, "prominence": self.prominence_slider,
+                   "distance": self.distance_slider}
+        for name, slider in sliders.items():
+            slider.blockSignals(True)
+            slider.setValue(best[name])
+            slider.blockSignals(False)
+        self.plot_data()
 
+    def show_calibration(self):
+        if self.calibration_window is None:
+            self.calibration_window = CalibrationWindow(self)
+
+        self.peak_energy = self.detect_peaks(self.peak_dp_source,
+                                             self.energies,
+                                             self.min_height_slider.value(),
+                                             self.prominence_slider.value(),
+                                             self.distance_slider.value())
+        self.fit_detected_peaks()
+
+        tolerance = config.getfloat("Settings", "calibration_match_tolerance")
+        peak_idx, ref_idx = match_peaks(self.peak_fit_results["energy"], tolerance)
+        ref_energies, ref_names = reference_energies()
+        self.calibration_window.set_peaks(self.peak_fit_results["channel"][peak_idx],
+                                          self.peak_fit_results["channel_err"][peak_idx],
+                                          self.peak_fit_results["energy"][peak_idx],
+                                          ref_energies[ref_idx],
+                                          [ref_names[i] for i in ref_idx])
+        self.calibration_window.show()
+        self.calibration_window.raise_()
+
+    def apply_calibration(self, coeffs):
+        serial_number = self.parsed_data.get("serial_number")
+        if serial_number:
+            set_override(config, serial_number, coeffs)
+            with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+                config.write(f)
         else:
-            if self.theme == "light":
-                self.apply_light_stylesheet()
-                config.set("Dynamic", "theme", "light")
-                with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
-                    config.write(f)
-
-            elif self.theme == "dark":
-                self.apply_dark_stylesheet()
-                config.set("Dynamic", "theme", "dark")
-                with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
-                    config.write(f)
-
-        max_plot_title_length = config.getint("Settings", "max_plot_title_length")
-        self.plot.setTitle(self.plot_title[:max_plot_title_length], color=self.plot_title_color)
-        self.plot.setLabel("left", "Normalized Data", color=self.plot_y_label_color)
-        self.plot.setLabel("bottom", "Energy (keV)", color=self.plot_x_label_color)
+            msg_box = QMessageBox()
+            msg_box.setIcon(QMessageBox.Icon.Information)
+            msg_box.setWindowTitle("Information")
+            msg_box.setText("The spectrum has no serial number.\n"
+                            "The calibration is only used for this spectrum and not saved.")
+            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            msg_box.exec()
+
+        self.set_calibration(coeffs)
+
+    def remove_calibration(self):
+        serial_number = self.parsed_data.get("serial_number")
+        if serial_number:
+            remove_override(config, serial_number)
+            with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+                config.write(f)
+        if self.calibration_window is not None:
+            self.calibration_window.close()
+
+        if "file_coeffs" in self.parsed_data:
+            self.set_calibration(self.parsed_data["file_coeffs"])
+
+    def open_efficiency_curve(self):
+        device = self.parsed_data.get("device") or "Unknown"
+        load_dir = config.get("Paths", "last_open_directory")
+        curve_file, _ = QFileDialog.getOpenFileName(self, f"Efficiency curve for {device}", load_dir,
+                                                    "CSV Files (*.csv)")
+        if not curve_file:
+            return
+        try:
+            # The file may have been changed since it was read
+            clear_efficiency_cache()
+            read_curve(curve_file)
+        except (ValueError, OSError) as e:
+            msg_box = QMessageBox()
+            msg_box.setIcon(QMessageBox.Icon.Critical)
+            msg_box.setWindowTitle("Error")
+            msg_box.setText(f"The efficiency curve can't be used.\n{e}")
+            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            msg_box.exec()
+            return
+
+        set_curve(config, device, curve_file)
+        with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+            config.write(f)
+        self.efficiency_curves = load_curves(config)
+        self.recent_store.set_efficiency_curves(self.efficiency_curves)
+        self.clear_series_cache()
+        self.plot_data()
+
+    def set_calibration(self, coeffs):
+        self.clear_series_cache()
+        self.coeffs = list(coeffs)
+        self.parsed_data["coeffs"] = self.coeffs.copy()
+        self.energies = self.get_energies(self.coeffs, self.plot_data_points)
+
+        # Backgrounds derived from the spectrum itself share its calibration
+        if self.bg_source in ("included", "snip"):
+            self.bg_coeffs = self.coeffs.copy()
+            self.bg_energies = self.get_energies(self.bg_coeffs, self.bg_dps)
+        if self.contains_bg_data:
+            self.intern_bg_coeffs = self.coeffs.copy()
+            self.intern_bg_energies = self.get_energies(self.intern_bg_coeffs, self.intern_bg_dps)
+
+        self.update_dose_rate()
+        self.plot_data()
+
+    def update_dose_rate(self):
+        # G(E) of the device, per calibration only evaluated once
+        model = dose_model_for_device(load_dose_functions(config), self.parsed_data.get("device"))
+        try:
+            rate = dose_rate(self.data_points, self.time_seconds, self.coeffs, model,
+                             config.getfloat("Settings", "dose_cps_per_usvh"))
+        except (ValueError, OSError) as e:
+            self.dose_value_label.setText("")
+            self.show_diagnostics([diagnostic(ERROR, "invalid_dose_function", str(e))], self.plot_title, clear=False)
+            return
+        self.dose_value_label.setText(f"{rate:.3f}")
+
+    def show_peak_table(self):
+        if self.peak_table_window is None:
+            self.peak_table_window = PeakTableWindow(self)
+
+        self.peak_energy = self.detect_peaks(self.peak_dp_source,
+                                             self.energies,
+                                             self.min_height_slider.value(),
+                                             self.prominence_slider.value(),
+                                             self.distance_slider.value())
+        self.fit_detected_peaks()
+        self.peak_table_window.set_results(self.peak_fit_results, self.plot_title)
+        self.peak_table_window.show()
+        self.peak_table_window.raise_()
+
+    def add_curve(self, x, y, color_key):
+        item = self.plot.plot(x, y, pen=pg.mkPen(color=self.plot_colors[color_key], width=self.plot_line_width))
+        self.plot_items.append((item, color_key))
+        return item
+
+    def add_annotation(self, line_x, line_y, label, position, line_key="annotation_line",
+                       text_key="annotation_text", dashed=False):
+        colors = self.plot_colors
+        line = pg.PlotDataItem(line_x, line_y, pen=self.annotation_pen(colors[line_key], dashed))
+        self.plot.addItem(line)
+
+        text = pg.TextItem(label, anchor=(0.5, 0.5), color=colors[text_key],
+                           fill=colors["annotation_bg"],
+                           border=colors[text_key])
+        text.setPos(*position)
+        self.plot.addItem(text)
+        self.annotation_items.append((line, text, line_key, text_key, dashed))
+        return line, text
+
+    def significance_pen(self):
+        # Wide and translucent, behind the plots
+        color = pg.mkColor(self.plot_colors["significance"])
+        color.setAlpha(110)
+        return pg.mkPen(color=color, width=self.plot_line_width + 6)
+
+    @staticmethod
+    def annotation_pen(color, dashed=False):
+        style = Qt.PenStyle.DashLine if dashed else Qt.PenStyle.SolidLine
+        return pg.mkPen(color=color, width=config.getint("Settings", "plt_annotation_line_width"), style=style)
+
+    def style_plot_frame(self):
+        colors = self.plot_colors
+        self.plot.setBackground(colors["bg"])
+        if self.file_loaded:
+            max_plot_title_length = config.getint("Settings", "max_plot_title_length")
+            self.plot.setTitle(self.plot_title[:max_plot_title_length], color=colors["title"])
+            self.plot.setLabel("left", "Normalized Data", color=colors["y_label"])
+            self.plot.setLabel("bottom", "Energy (keV)", color=colors["x_label"])
+
+    def restyle_plot(self):
+        # Only pens and brushes change, nothing is recalculated
+        colors = self.plot_colors
+        self.style_plot_frame()
+        for item, color_key in self.plot_items:
+            item.setPen(pg.mkPen(color=colors[color_key], width=self.plot_line_width))
+
+        if self.significance_item is not None:
+            self.significance_item.setPen(self.significance_pen())
+
+        for roi in self.rois:
+            if roi["region"] is not None:
+                self.style_roi(roi)
+
+        for line in self.crosshair_lines:
+            line.setPen(pg.mkPen(color=colors["annotation_line"], width=1, style=Qt.PenStyle.DotLine))
+        self.crosshair_label.setColor(colors["annotation_text"])
+        self.crosshair_label.fill = pg.mkBrush(colors["annotation_bg"])
+        self.crosshair_label.border = pg.mkPen(colors["annotation_text"])
+        self.crosshair_label.update()
+
+        for line, text, line_key, text_key, dashed in self.annotation_items:
+            line.setPen(self.annotation_pen(colors[line_key], dashed))
+            text.setColor(colors[text_key])
+            text.fill = pg.mkBrush(colors["annotation_bg"])
+            text.border = pg.mkPen(colors[text_key])
+            text.update()
+
+    def set_plot_colors(self):
+        self.plot_colors = plot_palette(config, self.theme, self.black_on_white_plot_checkbox.isChecked())
+
+    def plot_data(self):
+        self.plot.clear()
+        self.plot_items = []
+        self.annotation_items = []
+        self.annotation_peaks = []
+        self.significance_item = None
+        self.style_plot_frame()
 
         self.plot.showGrid(x=True, y=True, alpha=0.4)
 
         # Not in compensated plot, because it is needed for the peak detection
         # even when the compensated plot is not active
-        compensated_dp = self.get_compensated_dp(self.coeffs, self.data_points)
-        smoothed_dp = self.get_smoothed_data(self.energies, compensated_dp, self.low_smooth_slider.value(),
-                                             self.high_smooth_slider.value())
-        compensated_normalized_dp = self.normalize_data(smoothed_dp)
+        smoothing = self.get_smoothing()
+        compensated_normalized_dp = self.cached_series(
+            "compensated", smoothing,
+            lambda: self.get_compensated_normalized(self.coeffs, self.energies, self.data_points))
         self.peak_dp_source = compensated_normalized_dp
 
+        if self.snip_peak_detection_checkbox.isChecked():
+            def snip_net():
+                net_dp = np.maximum(np.array(self.data_points) - self.get_snip_continuum(self.data_points), 0)
+                return self.get_compensated_normalized(self.coeffs, self.energies, net_dp)
+
+            self.peak_dp_source = self.cached_series("snip_net", smoothing, snip_net)
+
         compensated_normalized_bg_dp = []
 
         if self.show_compensated_bg_plot:
-            compensated_bg_dp = self.get_compensated_dp(self.bg_coeffs, self.bg_dps)
-            smoothed_bg_dp = self.get_smoothed_data(self.bg_energies, compensated_bg_dp, self.low_smooth_slider.value(),
-                                                    self.high_smooth_slider.value())
-            compensated_normalized_bg_dp = self.normalize_data(smoothed_bg_dp)
+            compensated_normalized_bg_dp = self.cached_series(
+                "compensated_bg", smoothing,
+                lambda: self.get_compensated_normalized(self.bg_coeffs, self.bg_energies, self.bg_dps,
+                                                        background=True))
 
         if self.show_compensated_result_plot:
-            compensated_result_dp = self.get_compensated_dp(self.coeffs, self.result_dps)
-            smoothed_result_dp = self.get_smoothed_data(self.energies, compensated_result_dp,
-                                                        self.low_smooth_slider.value(),
-                                                        self.high_smooth_slider.value())
-            compensated_normalized_result_dp = self.normalize_data(smoothed_result_dp)
+            compensated_normalized_result_dp = self.cached_series(
+                "compensated_result", smoothing,
+                lambda: self.get_compensated_normalized(self.coeffs, self.energies, self.result_dps))
         else:
             compensated_normalized_result_dp = []
 
         # ORIGINAL PLOT
         if self.show_original_plot:
-            self.original_normalized_dp = self.normalize_data(self.plot_data_points)
-            self.plot.plot(self.energies, self.original_normalized_dp,
-                           pen=pg.mkPen(color=self.original_plot_color, width=self.plot_line_width))
+            self.original_normalized_dp = self.cached_series("original", (),
+                                                             lambda: self.normalize_data(self.plot_data_points))
+            self.add_curve(self.energies, self.original_normalized_dp, "original")
 
         # COMPENSATED PLOT
         if self.show_compensated_plot:
-            self.plot.plot(self.energies, compensated_normalized_dp,
-                           pen=pg.mkPen(color=self.compensated_plot_color, width=self.plot_line_width))
+            self.add_curve(self.energies, compensated_normalized_dp, "compensated")
 
         # ORIGINAL BG PLOT
         if self.show_original_bg_plot:
-            self.original_normalized_bg_dp = self.normalize_data(self.plot_bg_dps)
-            self.plot.plot(self.bg_energies, self.original_normalized_bg_dp,
-                           pen=pg.mkPen(color=self.original_bg_plot_color, width=self.plot_line_width))
+            self.original_normalized_bg_dp = self.cached_series("original_bg", (),
+                                                                lambda: self.normalize_data(self.plot_bg_dps))
+            self.add_curve(self.bg_energies, self.original_normalized_bg_dp, "original_bg")
 
         # BACKGROUND COMPENSATED PLOT
         if self.show_compensated_bg_plot:
-            self.plot.plot(self.bg_energies, compensated_normalized_bg_dp,
-                           pen=pg.mkPen(color=self.compensated_bg_plot_color, width=self.plot_line_width))
+            self.add_curve(self.bg_energies, compensated_normalized_bg_dp, "compensated_bg")
 
         # ORIGINAL RESULT PLOT (SUBTRACTED)
         if self.show_original_result_plot:
-            self.plot.plot(self.energies, self.result_dps,
-                           pen=pg.mkPen(color=self.original_result_plot_color, width=self.plot_line_width))
+            self.add_curve(self.energies, self.result_dps, "original_result")
 
         # COMPENSATED RESULT PLOT (SUBTRACTED)
         if self.show_compensated_result_plot:
-            self.plot.plot(self.energies, compensated_normalized_result_dp,
-                           pen=pg.mkPen(color=self.compensated_result_plot_color, width=self.plot_line_width))
+            self.add_curve(self.energies, compensated_normalized_result_dp, "compensated_result")
+
+        # SIGNIFICANCE OVERLAY
+        if self.significance_checkbox.isChecked():
+            if self.show_compensated_plot or self.show_original_plot:
+                overlay_dp = compensated_normalized_dp if self.show_compensated_plot else self.original_normalized_dp
+            elif self.show_compensated_result_plot:
+                overlay_dp = compensated_normalized_result_dp
+            elif self.show_original_result_plot:
+                overlay_dp = self.result_dps
+            else:
+                overlay_dp = None
+            if overlay_dp is not None:
+                significant = (self.get_significance()["significance"] >=
+                               config.getfloat("Settings", "significance_threshold"))
+                # Gaps where the net counts are not significant
+                overlay_y = np.where(significant, np.asarray(overlay_dp, dtype=float), np.nan)
+                self.significance_item = self.plot.plot(self.energies, overlay_y, connect="finite",
+                                                        pen=self.significance_pen())
+                self.significance_item.setZValue(-1)
 
         # ANNOTATIONS
         if config.getboolean("Dynamic", "activate_peak_detection"):
@@ -1121,64 +2172,259 @@ class MainWindow(QMainWindow):
                                                  self.prominence_slider.value(),
                                                  self.distance_slider.value())
 
-            if self.black_on_white_plot_checkbox.isChecked():
-                ann_line_color = "black"
-                ann_text_color = "black"
-                app_bg_color = "white"
+            if self.peak_table_window is not None and self.peak_table_window.isVisible():
+                self.fit_detected_peaks()
+                self.peak_table_window.set_results(self.peak_fit_results, self.plot_title)
+
+            # Every visible series gets its own peaks, all of them are found in the cached smoothed arrays
+            min_height = self.min_height_slider.value()
+            prominence = self.prominence_slider.value()
+            distance = self.distance_slider.value()
+
+            # The background peaks are also needed to flag background lines in the foreground
+            bg_peak_indices = []
+            if self.bg_loaded and not self.show_compensated_result_plot and not self.show_original_result_plot:
+                compensated_normalized_bg_dp = self.cached_series(
+                    "compensated_bg", smoothing,
+                    lambda: self.get_compensated_normalized(self.bg_coeffs, self.bg_energies, self.bg_dps,
+                                                        background=True))
+                bg_peak_indices = self.detect_peak_indices(compensated_normalized_bg_dp, min_height, prominence,
+                                                           distance)
+
+            # FOREGROUND PEAKS
+            if self.show_compensated_plot or self.show_original_plot:
+                peak_values = compensated_normalized_dp if self.show_compensated_plot else self.original_normalized_dp
+                flags = background_peak_flags(self.energies[self.peak_indices],
+                                              self.bg_energies[bg_peak_indices] if len(bg_peak_indices) else [],
+                                              config.getfloat("Settings", "snip_fwhm_662_percent"))
+                self.annotate_peaks(self.peak_indices, self.energies, peak_values, 1.1,
+                                    "annotation_line", "annotation_text", flags, self.peak_dp_source)
+
+            # BACKGROUND PEAKS
+            if self.show_compensated_bg_plot or self.show_original_bg_plot:
+                peak_values = (compensated_normalized_bg_dp if self.show_compensated_bg_plot
+                               else self.original_normalized_bg_dp)
+                self.annotate_peaks(bg_peak_indices, self.bg_energies, peak_values, 1.25,
+                                    "compensated_bg", "compensated_bg", source=compensated_normalized_bg_dp)
+
+            # NET PEAKS (SUBTRACTED)
+            if self.show_compensated_result_plot or self.show_original_result_plot:
+                net_source = (compensated_normalized_result_dp if self.show_compensated_result_plot
+                              else self.result_dps)
+                net_peak_indices = self.significant_peaks(
+                    self.detect_peak_indices(net_source, min_height, prominence, distance))
+                self.annotate_peaks(net_peak_indices, self.energies, net_source, 1.1,
+                                    "compensated_result", "compensated_result")
+
+        for roi in self.rois:
+            self.draw_roi(roi)
+        for item in (*self.crosshair_lines, self.crosshair_label):
+            item.setVisible(False)
+            self.plot.addItem(item, ignoreBounds=True)
+        self.update_annotations()
+
+    def annotate_peaks(self, peak_indices, energies, peak_values, level, line_key, text_key, flags=None,
+                       source=None):
+        # Only collected here, the labels are made by update_annotations for the current view
+        font_metrics = QFontMetrics(self.plot.font())
+        prominences = peak_prominences(peak_values if source is None else source, peak_indices)[0]
+        for i, index in enumerate(peak_indices):
+            peak_energy = round(float(energies[index]), 1)
+            peak_value = peak_values[index]
+            background_line = flags is not None and bool(flags[i])
+            label = f"{peak_energy} BG" if background_line else f"{peak_energy}"
+
+            if self.log_x_checkbox.isChecked():
+                peak_energy_log = np.log10(peak_energy)
             else:
-                ann_line_color = config.get(f"{self.theme.title()}Theme", "plt_annotation_line_color")
-                ann_text_color = config.get(f"{self.theme.title()}Theme", "plt_annotation_text_color")
-                app_bg_color = config.get(f"{self.theme.title()}Theme", "app_bg_color")
-
-            ann_line_width = config.getint("Settings", "plt_annotation_line_width")
-
-            # PEAK DETECTION ANNOTATION
-            for i, peak_energy in enumerate(self.peak_energy):
-                energy_index = np.argmin(np.abs(np.array(self.energies) - peak_energy))
-
-                # Get the corresponding data point value at the peak energy
-                if self.show_compensated_plot and self.show_original_plot:
-                    peak_value = compensated_normalized_dp[energy_index]
-                elif self.show_compensated_plot and not self.show_original_plot:
-                    peak_value = compensated_normalized_dp[energy_index]
-                elif not self.show_compensated_plot and self.show_original_plot:
-                    peak_value = self.original_normalized_dp[energy_index]
-                elif self.show_original_result_plot and self.show_compensated_result_plot:
-                    peak_value = compensated_normalized_result_dp[energy_index]
-                else:
-                    return
+                peak_energy_log = peak_energy
 
-                if self.log_x_checkbox.isChecked():
-                    peak_energy_log = np.log10(peak_energy)
-                else:
-                    peak_energy_log = peak_energy
+            if self.log_y:
+                line_y = [peak_value, level + 0.4]
+                text_y = np.log10(level) + 0.2
+            else:
+                line_y = [peak_value, level]
+                text_y = level
+
+            self.annotation_peaks.append({
+                "x": peak_energy_log,
+                "y": text_y,
+                "line_x": [peak_energy, peak_energy],
+                "line_y": line_y,
+                "label": label,
+                "line_key": line_key,
+                "text_key": text_key,
+                "dashed": background_line,
+                "prominence": prominences[i],
+                "width": font_metrics.horizontalAdvance(label) + 8,
+                "height": font_metrics.height() + 4,
+                "items": None,
+            })
+
+    def view_range_changed(self):
+        # Throttled, while panning or zooming the labels are updated at most once per interval
+        if self.annotation_peaks and not self.annotation_timer.isActive():
+            self.annotation_timer.start()
+
+    def update_annotations(self):
+        if not self.annotation_peaks:
+            return
 
-                if self.log_y_checkbox.isChecked():
-                    y_upper_limit = np.log10(1.1)
-                else:
-                    y_upper_limit = 1.1
-
-                if self.log_y:
-                    line = pg.PlotDataItem([peak_energy, peak_energy], [peak_value, 1.5],
-                                           pen=pg.mkPen(color=ann_line_color, width=ann_line_width))
-                    self.plot.addItem(line)
-
-                    text = pg.TextItem(f"{peak_energy}", anchor=(0.5, 0.5), color=ann_text_color,
-                                       fill=app_bg_color,
-                                       border=ann_text_color)
-                    text.setPos(peak_energy_log, y_upper_limit + 0.2)
-                    self.plot.addItem(text)
-                else:
-                    line = pg.PlotDataItem([peak_energy, peak_energy], [peak_value, 1.1],
-                                           pen=pg.mkPen(color=ann_line_color, width=ann_line_width))
-                    self.plot.addItem(line)
+        view_box = self.plot.getViewBox()
+        (x_min, x_max), (y_min, y_max) = view_box.viewRange()
+        peaks = self.annotation_peaks
+        x = np.array([peak["x"] for peak in peaks])
+        visible = np.flatnonzero(in_view(x, (x_min, x_max)))
+
+        # Label positions in pixels, the collisions depend on the zoom
+        x_scale = view_box.width() / max(x_max - x_min, 1e-12)
+        y_scale = view_box.height() / max(y_max - y_min, 1e-12)
+        y = np.array([peak["y"] for peak in peaks])
+        widths = np.array([peak["width"] for peak in peaks])
+        heights = np.array([peak["height"] for peak in peaks])
+        prominences = np.array([peak["prominence"] for peak in peaks])
+        kept = declutter(x[visible] * x_scale, y[visible] * y_scale, widths[visible], heights[visible],
+                         prominences[visible])
+        shown = set(visible[kept].tolist())
+
+        # Labels are made the first time they are shown and hidden afterwards, never removed
+        for i, peak in enumerate(peaks):
+            if peak["items"] is None:
+                if i not in shown:
+                    continue
+                peak["items"] = self.add_annotation(peak["line_x"], peak["line_y"], peak["label"],
+                                                    (peak["x"], peak["y"]), peak["line_key"], peak["text_key"],
+                                                    peak["dashed"])
+            for item in peak["items"]:
+                item.setVisible(i in shown)
+
+    def mouse_moved(self, position):
+        # Throttled like the labels, the readout follows the mouse at most once per interval
+        if not self.file_loaded or not self.crosshair_checkbox.isChecked():
+            return
+        self.crosshair_position = position
+        if not self.crosshair_timer.isActive():
+            self.crosshair_timer.start()
+
+    def update_crosshair(self):
+        items = (*self.crosshair_lines, self.crosshair_label)
+        view_box = self.plot.getViewBox()
+        position = self.crosshair_position
+        if position is None or not len(self.energies) or not view_box.sceneBoundingRect().contains(position) or \
+                not self.crosshair_checkbox.isChecked():
+            for item in items:
+                item.setVisible(False)
+            return
 
-                    # Display the daughter nuclide instead of the energy value
-                    text = pg.TextItem(f"{peak_energy}", anchor=(0.5, 0.5), color=ann_text_color,
-                                       fill=app_bg_color,
-                                       border=ann_text_color)
-                    text.setPos(peak_energy_log, y_upper_limit)
-                    self.plot.addItem(text)
+        point = view_box.mapSceneToView(position)
+        x, y = point.x(), point.y()
+        energy = 10 ** x if self.log_x else x
+        channel = nearest_channel(self.energies, energy)
+        lines = [f"Channel: {channel}",
+                 f"Energy: {self.energies[channel]:.1f} keV",
+                 f"Counts: {self.plot_data_points[channel]:.0f}"]
+        compensated = self.series_cache.get("compensated")
+        if compensated is not None:
+            lines.append(f"Compensated: {compensated[1][channel]:.4f}")
+        if self.bg_loaded and len(self.bg_energies):
+            # The background has its own calibration
+            lines.append(f"Background: {self.plot_bg_dps[nearest_channel(self.bg_energies, energy)]:.1f}")
+
+        self.crosshair_label.setText("\n".join(lines))
+        self.crosshair_label.setPos(x, y)
+        self.crosshair_lines[0].setPos(x)
+        self.crosshair_lines[1].setPos(y)
+        for item in items:
+            item.setVisible(True)
+
+    def toggle_crosshair(self):
+        # Saved when the viewer is closed
+        config.set("Dynamic", "show_crosshair", str(self.crosshair_checkbox.isChecked()))
+        if not self.crosshair_checkbox.isChecked():
+            for item in (*self.crosshair_lines, self.crosshair_label):
+                item.setVisible(False)
+
+    def get_roi_index(self):
+        # Rebuilt when the spectrum, its calibration or the background is replaced, they are never changed in place
+        background = self.plot_bg_dps if self.bg_loaded else None
+        arrays = (self.energies, self.plot_data_points, background)
+        live_times = (self.time_seconds, self.bg_seconds)
+        if self.roi_index is None or self.roi_index[1] != live_times or \
+                any(a is not b for a, b in zip(self.roi_index[0], arrays)):
+            index = RoiIndex(self.energies, self.plot_data_points, self.time_seconds, background, self.bg_seconds,
+                             config.getint("Settings", "roi_edge_channels"))
+            self.roi_index = (arrays, live_times, index)
+        return self.roi_index[2]
+
+    def add_roi(self):
+        # In the middle of the view and a tenth of its width
+        (x_min, x_max), _ = self.plot.getViewBox().viewRange()
+        low = x_min + (x_max - x_min) * 0.45
+        high = x_min + (x_max - x_min) * 0.55
+        if self.log_x:
+            low, high = 10 ** low, 10 ** high
+        roi = {"low": low, "high": high, "region": None, "label": None}
+        self.rois.append(roi)
+        self.draw_roi(roi)
+
+    def clear_rois(self):
+        for roi in self.rois:
+            if roi["region"] is not None:
+                self.plot.removeItem(roi["region"])
+        self.rois = []
+
+    def draw_roi(self, roi):
+        # The region is made once, a redraw only puts it back into the cleared plot
+        values = [roi["low"], roi["high"]]
+        if self.log_x:
+            values = list(np.log10(np.maximum(values, 1e-3)))
+        if roi["region"] is None:
+            roi["region"] = pg.LinearRegionItem(values=values)
+            roi["label"] = pg.InfLineLabel(roi["region"].lines[0], "", position=0.95, anchors=[(0, 0), (0, 0)])
+            # Every frame of a drag, only the label text changes
+            roi["region"].sigRegionChanged.connect(lambda _, changed=roi: self.update_roi(changed))
+        else:
+            roi["region"].blockSignals(True)
+            roi["region"].setRegion(values)
+            roi["region"].blockSignals(False)
+        self.style_roi(roi)
+        self.plot.addItem(roi["region"])
+        self.update_roi(roi)
+
+    def style_roi(self, roi):
+        colors = self.plot_colors
+        color = pg.mkColor(colors["roi"])
+        brush = pg.mkColor(color)
+        brush.setAlpha(40)
+        hover_brush = pg.mkColor(color)
+        hover_brush.setAlpha(80)
+        roi["region"].setBrush(brush)
+        roi["region"].setHoverBrush(hover_brush)
+        for line in roi["region"].lines:
+            line.setPen(pg.mkPen(color=color, width=self.plot_line_width))
+        label = roi["label"]
+        label.setColor(color)
+        label.fill = pg.mkBrush(colors["annotation_bg"])
+        label.border = pg.mkPen(color)
+        label.update()
+
+    def update_roi(self, roi):
+        low, high = roi["region"].getRegion()
+        if self.log_x:
+            low, high = 10 ** low, 10 ** high
+        roi["low"] = low
+        roi["high"] = high
+        result = self.get_roi_index().integrate(low, high)
+
+        def counts_text(counts, rate):
+            return f"{counts:.0f}" if rate is None else f"{counts:.0f} ({rate:.2f} cps)"
+
+        lines = [f"{result['low_energy']:.1f} - {result['high_energy']:.1f} keV",
+                 f"Gross: {counts_text(result['gross'], result['gross_cps'])}",
+                 f"Net: {counts_text(result['net'], result['net_cps'])}"]
+        if result["subtracted"] is not None:
+            lines.append(f"BG subtracted: {counts_text(result['subtracted'], result['subtracted_cps'])}")
+        roi["label"].setText("\n".join(lines))
 
     def toggle_log_y(self):
         if self.file_loaded:
@@ -1250,6 +2496,512 @@ class MainWindow(QMainWindow):
             with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
                 config.write(f)
 
+    def get_processing_settings(self):
+        settings = load_settings(config)
+        settings["low_smooth"] = self.low_smooth_slider.value()
+        settings["high_smooth"] = self.high_smooth_slider.value()
+        settings["smoothing_filter"] = self.smoothing_filter_combobox.currentData()
+        settings["min_height"] = self.min_height_slider.value()
+        settings["prominence"] = self.prominence_slider.value()
+        settings["distance"] = self.distance_slider.value()
+        settings["snip_peak_detection"] = self.snip_peak_detection_checkbox.isChecked()
+        return settings
+
+    def current_spectrum(self):
+        # As parsed, with the current calibration
+        spectrum = dict(self.parsed_data)
+        spectrum["coeffs"] = self.coeffs
+        spectrum["data_points"] = self.plot_data_points
+        return spectrum
+
+    def get_library(self):
+        if self.library is None:
+            path = config.get("Paths", "library_file")
+            try:
+                if os.path.exists(path):
+                    self.library = SpectrumLibrary.load(path, self.efficiency_curves)
+                else:
+                    self.library = SpectrumLibrary(efficiency_curves=self.efficiency_curves,
+                                                   **settings_from_config(config))
+            except (ValueError, OSError) as e:
+                self.show_diagnostics([diagnostic(ERROR, "invalid_library", str(e), "library")],
+                                      os.path.basename(path), clear=False)
+        return self.library
+
+    def save_library(self):
+        if self.library is None or not self.library.modified:
+            return
+        path = config.get("Paths", "library_file")
+        try:
+            self.library.save(path)
+        except OSError as e:
+            self.show_diagnostics([diagnostic(ERROR, "library_not_saved", str(e), "library")],
+                                  os.path.basename(path), clear=False)
+
+    def show_archive(self):
+        if self.archive_window is None:
+            self.archive_window = ArchiveWindow(self)
+        self.archive_window.show()
+        self.archive_window.raise_()
+
+    def show_similar_spectra(self):
+        if self.get_library() is None:
+            return
+        if self.similarity_window is None:
+            self.similarity_window = SimilarityWindow(self)
+        self.similarity_window.search()
+        self.similarity_window.show()
+        self.similarity_window.raise_()
+
+    def get_mixture_model(self):
+        # The references, the background and the energy grid make the design matrix, it is only built again
+        # when one of them changes. Its factorizations are kept for every energy range that was fitted
+        references = tuple(sorted(load_references(config).items()))
+        background = self.plot_bg_dps if self.bg_loaded else None
+        key = (references, self.bg_seconds, self.time_seconds, tuple(settings_from_config(config).values()),
+               config.getboolean("Settings", "include_channel_1023"))
+        if self.mixture_model is not None and self.mixture_model[0] == key and self.mixture_model[1] is background:
+            return self.mixture_model[2]
+
+        edges = library_edges(**settings_from_config(config))
+        names = []
+        components = []
+        overrides = load_overrides(config)
+        for name, path in references:
+            try:
+                spectrum = parse_spectrum(path, config.getboolean("Settings", "include_channel_1023"), overrides)
+                components.append(grid_rates(spectrum["data_points"], spectrum["coeffs"], spectrum["seconds"], edges))
+            except (ValueError, OSError) as e:
+                raise ValueError(f"Reference {name}: {e}")
+            names.append(name)
+        if not names:
+            raise ValueError("There are no reference spectra, add one with \"Add Reference\".")
+        if background is not None:
+            # A continuum of the spectrum itself is in its live time
+            components.append(grid_rates(background, self.bg_coeffs, self.bg_seconds or self.time_seconds, edges))
+            names.append(BACKGROUND_COMPONENT)
+
+        model = MixtureModel(names, components, edges)
+        self.mixture_model = (key, background, model)
+        return model
+
+    def decompose(self):
+        model = self.get_mixture_model()
+        (x_min, x_max), _ = self.plot.getViewBox().viewRange()
+        if self.log_x:
+            x_min, x_max = 10 ** x_min, 10 ** x_max
+        rates = grid_rates(self.plot_data_points, self.coeffs, self.time_seconds, model.edges)
+        return model.fit(rates, x_min, x_max)
+
+    def show_decomposition(self):
+        if self.decomposition_window is None:
+            self.decomposition_window = DecompositionWindow(self)
+        self.decomposition_window.fit()
+        self.decomposition_window.show()
+        self.decomposition_window.raise_()
+
+    def export_data(self):
+        spectrum = self.current_spectrum()
+        settings = self.get_processing_settings()
+        if self.bg_source == "snip":
+            settings["background"] = "snip"
+        elif self.bg_loaded:
+            spectrum["bg_coeffs"] = self.bg_coeffs
+            spectrum["bg_data_points"] = self.bg_dps
+            spectrum["bg_seconds"] = self.bg_seconds
+            settings["background"] = "included"
+        else:
+            settings["background"] = "none"
+
+        suggested_name = f"{self.plot_title}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
+        save_dir = config.get("Paths", "last_save_directory")
+        if not save_dir:
+            save_dir = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DesktopLocation)
+        else:
+            save_dir = os.path.abspath(save_dir)
+
+        filters = {f"{export_format.upper()} Files (*{extension})": export_format
+                   for export_format, extension in FORMATS.items()}
+        save_name = os.path.join(save_dir, suggested_name)
+        save_dialog, selected_filter = QFileDialog.getSaveFileName(self, "Export Data", save_name, ";;".join(filters))
+        if save_dialog:
+            export_format = filters.get(selected_filter, "csv")
+            if not save_dialog.endswith(FORMATS[export_format]):
+                save_dialog = os.path.splitext(save_dialog)[0] + FORMATS[export_format]
+
+            try:
+                export_spectrum(save_dialog, export_format, spectrum, process_spectrum(spectrum, settings))
+            except (OSError, RuntimeError) as e:
+                msg_box = QMessageBox()
+                msg_box.setIcon(QMessageBox.Icon.Critical)
+                msg_box.setWindowTitle("Error")
+                msg_box.setText(f"Export failed.\n{e}")
+                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+                msg_box.exec()
+                return
+
+            new_save_dir = os.path.dirname(save_dialog)
+            config.set("Paths", "last_save_directory", new_save_dir)
+            with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+                config.write(f)
+
+    def batch_export(self):
+        xml_files, _ = QFileDialog.getOpenFileNames(self, "Select Spectra", config.get("Paths", "last_open_directory"),
+                                                    "XML Files (*.xml)")
+        if not xml_files:
+            return
+
+        output_dir = QFileDialog.getExistingDirectory(self, "Output Directory",
+                                                      config.get("Paths", "last_save_directory"))
+        if not output_dir:
+            return
+
+        export_format, ok = QInputDialog.getItem(self, "Batch Export", "Format:", list(FORMATS), 0, False)
+        if not ok:
+            return
+
+        progress = QProgressDialog("Exporting spectra...", "Cancel", 0, len(xml_files), self)
+        progress.setWindowTitle("Batch Export")
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+
+        errors = []
+        exports = export_files(xml_files, output_dir, export_format, self.get_processing_settings(),
+                               config.getboolean("Settings", "include_channel_1023"), load_overrides(config))
+        for i, (xml_file, _, error) in enumerate(exports):
+            if error:
+                errors.append(f"{os.path.basename(xml_file)}: {error}")
+            progress.setValue(i + 1)
+            QApplication.processEvents()
+            if progress.wasCanceled():
+                break
+        progress.close()
+
+        config.set("Paths", "last_save_directory", output_dir)
+        with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+            config.write(f)
+
+        if errors:
+            msg_box = QMessageBox()
+            msg_box.setIcon(QMessageBox.Icon.Warning)
+            msg_box.setWindowTitle("Warning")
+            msg_box.setText(f"{len(errors)} of {len(xml_files)} files could not be exported.\n\n"
+                            + "\n".join(errors[:20]))
+            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            msg_box.exec()
+
+    def batch_render(self):
+        xml_files, _ = QFileDialog.getOpenFileNames(self, "Select Spectra", config.get("Paths", "last_open_directory"),
+                                                    "XML Files (*.xml)")
+        if not xml_files:
+            return
+
+        output_dir = QFileDialog.getExistingDirectory(self, "Output Directory",
+                                                      config.get("Paths", "last_save_directory"))
+        if not output_dir:
+            return
+
+        render_format, ok = QInputDialog.getItem(self, "Batch Render", "Format:", list(RENDER_FORMATS), 0, False)
+        if not ok:
+            return
+
+        options = load_render_options(config, self.theme, self.black_on_white_plot_checkbox.isChecked(),
+                                      config.getint("Settings", "render_width"),
+                                      config.getint("Settings", "render_height"))
+        options["settings"] = self.get_processing_settings()
+
+        progress = QProgressDialog("Rendering spectra...", "Cancel", 0, len(xml_files), self)
+        progress.setWindowTitle("Batch Render")
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+
+        errors = []
+        renders = render_files(xml_files, output_dir, render_format, options)
+        for i, (xml_file, _, error) in enumerate(renders):
+            if error:
+                errors.append(f"{os.path.basename(xml_file)}: {error}")
+            progress.setValue(i + 1)
+            QApplication.processEvents()
+            if progress.wasCanceled():
+                renders.close()
+                break
+        progress.close()
+
+        config.set("Paths", "last_save_directory", output_dir)
+        with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+            config.write(f)
+
+        if errors:
+            msg_box = QMessageBox()
+            msg_box.setIcon(QMessageBox.Icon.Warning)
+            msg_box.setWindowTitle("Warning")
+            msg_box.setText(f"{len(errors)} of {len(xml_files)} files could not be rendered.\n\n"
+                            + "\n".join(errors[:20]))
+            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            msg_box.exec()
+
+    def sum_files(self):
+        xml_files, _ = QFileDialog.getOpenFileNames(self, "Select Spectra", config.get("Paths", "last_open_directory"),
+                                                    "XML Files (*.xml)")
+        if not xml_files:
+            return
+
+        progress = QProgressDialog("Summing spectra...", "Cancel", 0, len(xml_files), self)
+        progress.setWindowTitle("Sum Files")
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+
+        errors = []
+        total = SpectrumAccumulator()
+        sums = accumulate_files(total, xml_files, config.getboolean("Settings", "include_channel_1023"),
+                                load_overrides(config))
+        for i, (xml_file, error) in enumerate(sums):
+            if error:
+                errors.append(f"{os.path.basename(xml_file)}: {error}")
+            progress.setValue(i + 1)
+            QApplication.processEvents()
+            if progress.wasCanceled():
+                sums.close()
+                break
+        progress.close()
+
+        if not total.files:
+            msg_box = QMessageBox()
+            msg_box.setIcon(QMessageBox.Icon.Critical)
+            msg_box.setWindowTitle("Error")
+            msg_box.setText("None of the selected files could be read.\n\n" + "\n".join(errors[:20]))
+            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            msg_box.exec()
+            return
+
+        self.load_spectrum(total.result())
+
+        if errors or total.rebinned:
+            msg_box = QMessageBox()
+            msg_box.setIcon(QMessageBox.Icon.Information if not errors else QMessageBox.Icon.Warning)
+            msg_box.setWindowTitle("Information" if not errors else "Warning")
+            msg_box.setText(f"{total.files} spectra summed, {total.rebinned} of them with a different calibration "
+                            f"were rebinned.\n\n"
+                            + (f"{len(errors)} files could not be read.\n" + "\n".join(errors[:20]) if errors else ""))
+            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            msg_box.exec()
+
+    def session_state(self):
+        state = {
+            "parsed_data": {key: value for key, value in self.parsed_data.items() if key != "data_points"},
+            "coeffs": [float(c) for c in self.coeffs],
+            "bg_coeffs": [float(c) for c in self.bg_coeffs],
+            "intern_bg_coeffs": [float(c) for c in self.intern_bg_coeffs] if self.contains_bg_data else None,
+            "contains_bg_data": bool(self.contains_bg_data),
+            "bg_loaded": self.bg_loaded,
+            "bg_source": self.bg_source,
+            "bg_device": self.bg_device,
+            "bg_seconds": self.bg_seconds,
+            "intern_bg_seconds": self.intern_bg_seconds,
+            "rois": [[roi["low"], roi["high"]] for roi in self.rois],
+            "show_original_plot": self.show_original_plot,
+            "show_compensated_plot": self.show_compensated_plot,
+            "show_original_bg_plot": self.show_original_bg_plot,
+            "show_compensated_bg_plot": self.show_compensated_bg_plot,
+            "show_original_result_plot": self.show_original_result_plot,
+            "show_compensated_result_plot": self.show_compensated_result_plot,
+            "log_x": self.log_x_checkbox.isChecked(),
+            "log_y": self.log_y_checkbox.isChecked(),
+            "peak_detection": config.getboolean("Dynamic", "activate_peak_detection"),
+            "snip_peak_detection": self.snip_peak_detection_checkbox.isChecked(),
+            "show_significance": self.significance_checkbox.isChecked(),
+            "significant_peaks_only": self.significant_peaks_checkbox.isChecked(),
+            "smoothing_filter": self.smoothing_filter_combobox.currentData(),
+            "black_on_white": self.black_on_white_plot_checkbox.isChecked(),
+            "sliders": {
+                "low_smooth": self.low_smooth_slider.value(),
+                "high_smooth": self.high_smooth_slider.value(),
+                "min_height": self.min_height_slider.value(),
+                "prominence": self.prominence_slider.value(),
+                "distance": self.distance_slider.value(),
+            },
+            "series": {},
+        }
+
+        arrays = {"data_points": np.asarray(self.data_points, dtype=np.uint32)}
+        if len(self.bg_dps):
+            arrays["bg_dps"] = np.asarray(self.bg_dps)
+        if self.contains_bg_data:
+            arrays["intern_bg_dps"] = np.asarray(self.intern_bg_dps, dtype=np.uint32)
+        if self.result_dps is not None and len(self.result_dps):
+            arrays["result_dps"] = np.asarray(self.result_dps)
+
+        # The processed series are stored as well, a restored session is drawn without recalculating anything
+        for name, (params, value) in self.series_cache.items():
+            if isinstance(value, dict):
+                state["series"][name] = {"params": list(params), "keys": list(value)}
+                for key, column in value.items():
+                    arrays[f"series.{name}.{key}"] = np.asarray(column)
+            else:
+                state["series"][name] = {"params": list(params), "keys": None}
+                arrays[f"series.{name}"] = np.asarray(value)
+
+        return state, arrays
+
+    def save_session(self):
+        suggested_name = f"{self.plot_title}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}{SESSION_EXTENSION}"
+        save_dir = config.get("Paths", "last_save_directory")
+        if not save_dir:
+            save_dir = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DesktopLocation)
+        else:
+            save_dir = os.path.abspath(save_dir)
+
+        save_name = os.path.join(save_dir, suggested_name)
+        save_dialog, _ = QFileDialog.getSaveFileName(self, "Save Session", save_name,
+                                                     f"Sessions (*{SESSION_EXTENSION})")
+        if save_dialog:
+            if not save_dialog.endswith(SESSION_EXTENSION):
+                save_dialog += SESSION_EXTENSION
+
+            try:
+                write_session(save_dialog, *self.session_state())
+            except (OSError, ValueError) as e:
+                msg_box = QMessageBox()
+                msg_box.setIcon(QMessageBox.Icon.Critical)
+                msg_box.setWindowTitle("Error")
+                msg_box.setText(f"Session could not be saved.\n{e}")
+                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+                msg_box.exec()
+                return
+
+            config.set("Paths", "last_save_directory", os.path.dirname(save_dialog))
+            with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+                config.write(f)
+
+    def open_session(self):
+        open_dir = config.get("Paths", "last_save_directory")
+        if not open_dir:
+            open_dir = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DesktopLocation)
+
+        session_file, _ = QFileDialog.getOpenFileName(self, "Open Session", open_dir,
+                                                      f"Sessions (*{SESSION_EXTENSION})")
+        if not session_file:
+            return
+
+        try:
+            state, arrays = read_session(session_file)
+            self.restore_session(state, arrays)
+        except (OSError, ValueError, KeyError) as e:
+            msg_box = QMessageBox()
+            msg_box.setIcon(QMessageBox.Icon.Critical)
+            msg_box.setWindowTitle("Error")
+            msg_box.setText(f"Session could not be opened.\n{e}")
+            msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            msg_box.exec()
+
+    def restore_session(self, state, arrays):
+        # Widgets are set with blocked signals, every one of them would redraw the plot otherwise
+        widgets = [self.low_smooth_slider, self.high_smooth_slider, self.smoothing_filter_combobox,
+                   self.min_height_slider, self.prominence_slider, self.distance_slider, self.log_x_checkbox,
+                   self.log_y_checkbox, self.peak_detection_checkbox,
+                   self.snip_peak_detection_checkbox, self.significance_checkbox, self.significant_peaks_checkbox,
+                   self.black_on_white_plot_checkbox,
+                   self.original_plot_checkbox, self.compensated_plot_checkbox,
+                   self.original_bg_plot_checkbox, self.compensated_bg_plot_checkbox]
+        for widget in widgets:
+            widget.blockSignals(True)
+
+        sliders = state["sliders"]
+        self.low_smooth_slider.setValue(sliders["low_smooth"])
+        self.high_smooth_slider.setValue(sliders["high_smooth"])
+        # Not in sessions of older versions
+        smoothing_filter = state.get("smoothing_filter", "boxcar")
+        config.set("Dynamic", "smoothing_filter", smoothing_filter)
+        self.smoothing_filter_combobox.setCurrentIndex(
+            max(self.smoothing_filter_combobox.findData(smoothing_filter), 0))
+        self.min_height_slider.setValue(sliders["min_height"])
+        self.prominence_slider.setValue(sliders["prominence"])
+        self.distance_slider.setValue(sliders["distance"])
+
+        self.log_x = state["log_x"]
+        self.log_y = state["log_y"]
+        self.log_x_checkbox.setChecked(self.log_x)
+        self.log_y_checkbox.setChecked(self.log_y)
+        self.plot.setLogMode(x=self.log_x, y=self.log_y)
+
+        config.set("Dynamic", "activate_peak_detection", str(state["peak_detection"]))
+        config.set("Dynamic", "snip_peak_detection", str(state["snip_peak_detection"]))
+        config.set("Dynamic", "show_significance", str(state.get("show_significance", False)))
+        config.set("Dynamic", "significant_peaks_only", str(state.get("significant_peaks_only", False)))
+        config.set("Dynamic", "show_black_on_white_plot", str(state["black_on_white"]))
+        self.peak_detection_checkbox.setChecked(state["peak_detection"])
+        self.snip_peak_detection_checkbox.setChecked(state["snip_peak_detection"])
+        # Not in sessions of older versions
+        self.significance_checkbox.setChecked(state.get("show_significance", False))
+        self.significant_peaks_checkbox.setChecked(state.get("significant_peaks_only", False))
+        self.black_on_white_plot_checkbox.setChecked(state["black_on_white"])
+        self.set_plot_colors()
+
+        self.show_original_plot = state["show_original_plot"]
+        self.show_compensated_plot = state["show_compensated_plot"]
+        self.show_original_bg_plot = state["show_original_bg_plot"]
+        self.show_compensated_bg_plot = state["show_compensated_bg_plot"]
+        self.show_original_result_plot = state["show_original_result_plot"]
+        self.show_compensated_result_plot = state["show_compensated_result_plot"]
+        self.original_plot_checkbox.setChecked(self.show_original_plot)
+        self.compensated_plot_checkbox.setChecked(self.show_compensated_plot)
+        self.original_bg_plot_checkbox.setChecked(self.show_original_bg_plot)
+        self.compensated_bg_plot_checkbox.setChecked(self.show_compensated_bg_plot)
+
+        for widget in widgets:
+            widget.blockSignals(False)
+
+        self.contains_bg_data = state["contains_bg_data"]
+        self.show_included_bg_button.setVisible(self.contains_bg_data)
+        if self.contains_bg_data:
+            self.intern_bg_coeffs = state["intern_bg_coeffs"]
+            self.intern_bg_dps = arrays["intern_bg_dps"]
+            self.intern_bg_seconds = state.get("intern_bg_seconds")
+            self.intern_bg_energies = self.get_energies(self.intern_bg_coeffs, self.intern_bg_dps)
+
+        self.bg_loaded = state["bg_loaded"]
+        self.bg_source = state["bg_source"]
+        self.bg_device = state.get("bg_device", state["parsed_data"].get("device", ""))
+        self.bg_coeffs = state["bg_coeffs"]
+        self.bg_seconds = state.get("bg_seconds")
+        self.bg_dps = arrays.get("bg_dps", [])
+        self.plot_bg_dps = self.bg_dps
+        self.bg_energies = self.get_energies(self.bg_coeffs, self.bg_dps) if self.bg_loaded else []
+        self.original_bg_plot_checkbox.setDisabled(not self.bg_loaded)
+        self.compensated_bg_plot_checkbox.setDisabled(not self.bg_loaded)
+        self.subtract_bg_button.setDisabled(not self.bg_loaded)
+        self.result_dps = arrays.get("result_dps")
+        self.rois = [{"low": low, "high": high, "region": None, "label": None}
+                     for low, high in state.get("rois", [])]
+
+        self.series_cache = {}
+        for name, entry in state["series"].items():
+            if entry["keys"] is None:
+                value = arrays[f"series.{name}"]
+            else:
+                value = {key: arrays[f"series.{name}.{key}"] for key in entry["keys"]}
+            self.series_cache[name] = (tuple(entry["params"]), value)
+
+        self.file_loaded = True
+        self.peak_detection_checkbox.setDisabled(False)
+        self.snip_peak_detection_checkbox.setDisabled(False)
+        self.significance_checkbox.setDisabled(False)
+        self.significant_peaks_checkbox.setDisabled(False)
+        self.peak_table_button.setDisabled(False)
+        self.calibration_button.setDisabled(False)
+        self.efficiency_curve_button.setDisabled(False)
+        self.add_roi_button.setDisabled(False)
+        self.clear_rois_button.setDisabled(False)
+        self.similar_spectra_button.setDisabled(False)
+        self.decompose_button.setDisabled(False)
+        self.auto_tune_button.setDisabled(False)
+
+        self.parsed_data = dict(state["parsed_data"])
+        self.parsed_data["coeffs"] = state["coeffs"]
+        self.parsed_data["data_points"] = arrays["data_points"]
+        self.fill_data(self.parsed_data)
+
+        subtracted = self.show_original_result_plot or self.show_compensated_result_plot
+        if subtracted or self.subtract_bg_button.text() == "Back":
+            self.set_subtract_mode(subtracted)
+
     @staticmethod
     def about():
         msg_box = QMessageBox()
@@ -1301,27 +3053,7 @@ class MainWindow(QMainWindow):
         msg_box.exec()
 
     def toggle_theme(self):
-        current_theme = config.get("Dynamic", "theme")
-
-        if current_theme == "light":
-            self.apply_dark_stylesheet()
-            self.theme_setting_checkbox.setChecked(True)
-            config.set("Dynamic", "theme", "dark")
-
-            with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
-                config.write(f)
-
-            if self.file_loaded:
-                self.plot_data()
-
-        elif current_theme == "dark":
-            self.apply_light_stylesheet()
-            self.theme_setting_checkbox.setChecked(False)
-            config.set("Dynamic", "theme", "light")
-            with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
-                config.write(f)
-            if self.file_loaded:
-                self.plot_data()
+        self.apply_theme("dark" if self.theme_setting_checkbox.isChecked() else "light")
 
     def toggle_original_plot(self):
         if self.file_loaded:
@@ -1369,22 +3101,10 @@ class MainWindow(QMainWindow):
                 self.plot_data()
 
     def toggle_black_white_plot(self):
-        if self.file_loaded:
-            show_black_on_white_plot = config.getboolean("Dynamic", "show_black_on_white_plot")
-            if show_black_on_white_plot:
-                self.black_white_plot = False
-                self.black_on_white_plot_checkbox.setChecked(False)
-                config.set("Dynamic", "show_black_on_white_plot", "False")
-                with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
-                    config.write(f)
-                self.plot_data()
-            else:
-                self.black_white_plot = True
-                self.black_on_white_plot_checkbox.setChecked(True)
-                config.set("Dynamic", "show_black_on_white_plot", "True")
-                with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
-                    config.write(f)
-                self.plot_data()
+        # Saved when the viewer is closed
+        config.set("Dynamic", "show_black_on_white_plot", str(self.black_on_white_plot_checkbox.isChecked()))
+        self.set_plot_colors()
+        self.restyle_plot()
 
     def low_smooth_slider_changed(self):
         if self.file_loaded:
@@ -1394,6 +3114,13 @@ class MainWindow(QMainWindow):
         if self.file_loaded:
             self.plot_data()
 
+    def smoothing_filter_changed(self):
+        config.set("Dynamic", "smoothing_filter", self.smoothing_filter_combobox.currentData())
+        with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+            config.write(f)
+        if self.file_loaded:
+            self.plot_data()
+
     def toggle_peak_detection(self):
         if self.file_loaded:
             if self.plot is not None:
@@ -1409,6 +3136,30 @@ class MainWindow(QMainWindow):
                         config.write(f)
                     self.plot_data()
 
+    def toggle_snip_peak_detection(self):
+        if self.file_loaded:
+            if self.snip_peak_detection_checkbox.isChecked():
+                config.set("Dynamic", "snip_peak_detection", "True")
+            else:
+                config.set("Dynamic", "snip_peak_detection", "False")
+            with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+                config.write(f)
+            self.plot_data()
+
+    def toggle_significance(self):
+        config.set("Dynamic", "show_significance", str(self.significance_checkbox.isChecked()))
+        with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+            config.write(f)
+        if self.file_loaded:
+            self.plot_data()
+
+    def toggle_significant_peaks(self):
+        config.set("Dynamic", "significant_peaks_only", str(self.significant_peaks_checkbox.isChecked()))
+        with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
+            config.write(f)
+        if self.file_loaded:
+            self.plot_data()
+
     def peak_height_slider_changed(self):
         if self.file_loaded:
             self.peak_energy = self.detect_peaks(self.peak_dp_source,
@@ -1436,131 +3187,25 @@ class MainWindow(QMainWindow):
                                                  self.distance_slider.value())
             self.plot_data()
 
-    def apply_light_stylesheet(self):
-        self.theme = "light"
-        self.theme_setting_checkbox.setChecked(False)
-        config.set("Dynamic", "theme", "light")
+    def apply_theme(self, theme):
+        self.theme = theme
+        config.set("Dynamic", "theme", theme)
 
-        with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
-            config.write(f)
-
-        self.plot_bg_color = config.get("LightTheme", "plt_bg_color")
-        self.plot.setBackground(self.plot_bg_color)
-        self.plot_title_color = config.get("LightTheme", "plt_title_color")
-        self.plot_x_label_color = config.get("LightTheme", "plt_x_label_color")
-        self.plot_y_label_color = config.get("LightTheme", "plt_y_label_color")
-        self.compensated_plot_color = config.get("LightTheme", "plt_compensated_color")
-        self.original_plot_color = config.get("LightTheme", "plt_original_color")
-        self.original_bg_plot_color = config.get("LightTheme", "plt_original_bg_color")
-        self.compensated_bg_plot_color = config.get("LightTheme", "plt_compensated_bg_color")
-        self.original_result_plot_color = config.get("LightTheme", "plt_original_result_color")
-        self.compensated_result_plot_color = config.get("LightTheme", "plt_compensated_result_color")
-
-        colors = {
-            "{{app_bg_color}}": config.get("LightTheme", "app_bg_color"),
-            "{{label_color}}": config.get("LightTheme", "label_color"),
-            "{{label_value_color}}": config.get("LightTheme", "label_value_color"),
-            "{{section_line_color}}": config.get("LightTheme", "section_line_color"),
-            "{{button_text_color}}": config.get("LightTheme", "button_text_color"),
-            "{{button_bg_color}}": config.get("LightTheme", "button_bg_color"),
-            "{{button_border_color}}": config.get("LightTheme", "button_border_color"),
-            "{{button_text_color_disabled}}": config.get("LightTheme", "button_text_color_disabled"),
-            "{{button_bg_color_disabled}}": config.get("LightTheme", "button_bg_color_disabled"),
-            "{{button_border_color_disabled}}": config.get("LightTheme", "button_border_color_disabled"),
-            "{{button_text_color_hover}}": config.get("LightTheme", "button_text_color_hover"),
-            "{{button_bg_color_hover}}": config.get("LightTheme", "button_bg_color_hover"),
-            "{{button_border_color_hover}}": config.get("LightTheme", "button_border_color_hover"),
-            "{{button_text_color_pressed}}": config.get("LightTheme", "button_text_color_pressed"),
-            "{{button_bg_color_pressed}}": config.get("LightTheme", "button_bg_color_pressed"),
-            "{{button_border_color_pressed}}": config.get("LightTheme", "button_border_color_pressed"),
-            "{{checkbox_label_color}}": config.get("LightTheme", "checkbox_label_color"),
-            "{{checkbox_square_color}}": config.get("LightTheme", "checkbox_square_color"),
-            "{{checkbox_square_color_disabled}}": config.get("LightTheme", "checkbox_square_color_disabled"),
-            "{{checkbox_color}}": config.get("LightTheme", "checkbox_color"),
-            "{{slider_color}}": config.get("LightTheme", "slider_color"),
-            "{{slider_groove_color}}": config.get("LightTheme", "slider_groove_color"),
-            "{{slider_handle_color}}": config.get("LightTheme", "slider_handle_color"),
-            "{{original_plot_checkbox_color}}": config.get("LightTheme", "plt_original_color"),
-            "{{compensated_plot_checkbox_color}}": config.get("LightTheme", "plt_compensated_color"),
-            "{{original_bg_plot_checkbox_color}}": config.get("LightTheme", "plt_original_bg_color"),
-            "{{compensated_bg_plot_checkbox_color}}": config.get("LightTheme", "plt_compensated_bg_color"),
-            "{{section_label_color}}": config.get("LightTheme", "section_label_color"),
-            "{{peak_detection_checkbox_color}}": config.get("LightTheme", "peak_detection_checkbox_color"),
-        }
+        self.theme_setting_checkbox.blockSignals(True)
+        self.theme_setting_checkbox.setChecked(theme == "dark")
+        self.theme_setting_checkbox.blockSignals(False)
 
-        # Load the QSS file
-        with open("style.qss", "r", encoding="utf-8") as f:  # type: TextIO
-            qss = f.read()
+        self.setStyleSheet(compile_stylesheet(config, theme))
+        self.set_plot_colors()
+        self.restyle_plot()
 
+    def closeEvent(self, event):
+        self.stop_watch_folder()
+        self.save_library()
+        # Theme and black on white plot are toggled often, they are written once here
         with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
             config.write(f)
-
-        for placeholder, color in colors.items():
-            qss = qss.replace(placeholder, color)
-
-        self.setStyleSheet(qss)
-
-    def apply_dark_stylesheet(self):
-        self.theme = "dark"
-        self.theme_setting_checkbox.setChecked(True)
-        config.set("Dynamic", "theme", "dark")
-
-        with open("config.ini", "w", encoding="utf8") as f:  # type: SupportsWrite
-            config.write(f)
-
-        self.plot_bg_color = config.get("DarkTheme", "plt_bg_color")
-        self.plot.setBackground(self.plot_bg_color)
-        self.plot_title_color = config.get("DarkTheme", "plt_title_color")
-        self.plot_x_label_color = config.get("DarkTheme", "plt_x_label_color")
-        self.plot_y_label_color = config.get("DarkTheme", "plt_y_label_color")
-        self.original_plot_color = config.get("DarkTheme", "plt_original_color")
-        self.compensated_plot_color = config.get("DarkTheme", "plt_compensated_color")
-        self.original_bg_plot_color = config.get("DarkTheme", "plt_original_bg_color")
-        self.compensated_bg_plot_color = config.get("DarkTheme", "plt_compensated_bg_color")
-        self.original_result_plot_color = config.get("DarkTheme", "plt_original_result_color")
-        self.compensated_result_plot_color = config.get("DarkTheme", "plt_compensated_result_color")
-
-        colors = {
-            "{{app_bg_color}}": config.get("DarkTheme", "app_bg_color"),
-            "{{label_color}}": config.get("DarkTheme", "label_color"),
-            "{{label_value_color}}": config.get("DarkTheme", "label_value_color"),
-            "{{section_line_color}}": config.get("DarkTheme", "section_line_color"),
-            "{{section_label_color}}": config.get("DarkTheme", "section_label_color"),
-            "{{button_bg_color}}": config.get("DarkTheme", "button_bg_color"),
-            "{{button_text_color}}": config.get("DarkTheme", "button_text_color"),
-            "{{button_border_color}}": config.get("DarkTheme", "button_border_color"),
-            "{{button_text_color_disabled}}": config.get("DarkTheme", "button_text_color_disabled"),
-            "{{button_bg_color_disabled}}": config.get("DarkTheme", "button_bg_color_disabled"),
-            "{{button_border_color_disabled}}": config.get("DarkTheme", "button_border_color_disabled"),
-            "{{button_text_color_hover}}": config.get("DarkTheme", "button_text_color_hover"),
-            "{{button_bg_color_hover}}": config.get("DarkTheme", "button_bg_color_hover"),
-            "{{button_border_color_hover}}": config.get("DarkTheme", "button_border_color_hover"),
-            "{{button_text_color_pressed}}": config.get("DarkTheme", "button_text_color_pressed"),
-            "{{button_bg_color_pressed}}": config.get("DarkTheme", "button_bg_color_pressed"),
-            "{{button_border_color_pressed}}": config.get("DarkTheme", "button_border_color_pressed"),
-            "{{checkbox_label_color}}": config.get("DarkTheme", "checkbox_label_color"),
-            "{{checkbox_square_color}}": config.get("DarkTheme", "checkbox_square_color"),
-            "{{checkbox_square_color_disabled}}": config.get("DarkTheme", "checkbox_square_color_disabled"),
-            "{{checkbox_color}}": config.get("DarkTheme", "checkbox_color"),
-            "{{slider_color}}": config.get("DarkTheme", "slider_color"),
-            "{{slider_groove_color}}": config.get("DarkTheme", "slider_groove_color"),
-            "{{slider_handle_color}}": config.get("DarkTheme", "slider_handle_color"),
-            "{{original_plot_checkbox_color}}": config.get("DarkTheme", "plt_original_color"),
-            "{{original_bg_plot_checkbox_color}}": config.get("DarkTheme", "plt_original_bg_color"),
-            "{{compensated_bg_plot_checkbox_color}}": config.get("DarkTheme", "plt_compensated_bg_color"),
-            "{{compensated_plot_checkbox_color}}": config.get("DarkTheme", "plt_compensated_color"),
-            "{{peak_detection_checkbox_color}}": config.get("DarkTheme", "peak_detection_checkbox_color"),
-        }
-
-        # Load the QSS file
-        with open("style.qss", "r") as f:  # type: TextIO
-            qss = f.read()
-
-        for placeholder, color in colors.items():
-            qss = qss.replace(placeholder, color)
-
-        self.setStyleSheet(qss)
-
+        super().closeEvent(event)
 
 if __name__ == "__main__":
 
@@ -1570,13 +3215,8 @@ if __name__ == "__main__":
         app = QApplication.instance()
     theme = config.get("Dynamic", "theme")
 
-    if theme == "light":
-        window = MainWindow()
-        window.apply_light_stylesheet()
-        window.show()
-    elif theme == "dark":
-        window = MainWindow()
-        window.apply_dark_stylesheet()
-        window.show()
+    window = MainWindow()
+    window.apply_theme(theme)
+    window.show()
 
     sys.exit(app.exec())
@@ -0,0 +1,265 @@
+import argparse
+import csv
+import os
+import struct
+import sys
+from configparser import ConfigParser
+from datetime import datetime
+
+import numpy as np
+
+from rsv_calibration import load_overrides
+from rsv_parser import get_device, parse_spectrum
+from rsv_processing import energy_axis
+from rsv_store import as_counts
+
+ARCHIVE_EXTENSION = ".rsva"
+# The counts matrix is next to the metadata table, with the same name
+COUNTS_EXTENSION = ".rsvc"
+MAGIC = b"RSVARCH\x00"
+VERSION = 1
+# Magic, version, channels and the number of complete rows, padded to 64 bytes
+HEADER = struct.Struct("<8sIIQ40x")
+# One row per spectrum, sample names and serial numbers longer than the fields are cut
+METADATA_DTYPE = np.dtype([
+    ("sample_name", "S80"),
+    ("serial_number", "S24"),
+    ("coeffs", "<f8", (3,)),
+    ("start_time", "<M8[s]"),
+    ("end_time", "<M8[s]"),
+    ("seconds", "<f8"),
+])
+# Rows summed at a time by the ROI queries, a few MB of counts
+QUERY_ROWS = 4096
+
+
+def counts_path(path):
+    return os.path.splitext(path)[0] + COUNTS_EXTENSION
+
+
+def _text(value, size):
+    # Cut at a character boundary, the fields are bytes
+    return (value or "").encode("utf8")[:size].decode("utf8", "ignore").encode("utf8")
+
+
+def _time(text):
+    return np.datetime64(datetime.strptime(text, "%Y-%m-%d %H:%M:%S"), "s")
+
+
+class SpectrumArchive:
+    def __init__(self, path):
+        self.path = path
+        self.counts_path = counts_path(path)
+        with open(path, "rb") as f:
+            magic, version, n_channels, rows = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a spectrum archive.")
+        if version > VERSION:
+            raise ValueError(f"{path} was saved by a newer version of the viewer.")
+        self.n_channels = n_channels
+        self.rows = rows
+        self._map()
+
+    @classmethod
+    def create(cls, path, n_channels=1023):
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, n_channels, 0))
+        open(counts_path(path), "wb").close()
+        return cls(path)
+
+    def __len__(self):
+        return self.rows
+
+    def _map(self):
+        # Only complete rows are mapped, a cut off append after them is overwritten by the next one
+        if self.rows:
+            self.metadata = np.memmap(self.path, dtype=METADATA_DTYPE, mode="r", offset=HEADER.size,
+                                      shape=(self.rows,))
+            self.counts = np.memmap(self.counts_path, dtype=np.uint32, mode="r", shape=(self.rows, self.n_channels))
+        else:
+            self.metadata = np.zeros(0, dtype=METADATA_DTYPE)
+            self.counts = np.zeros((0, self.n_channels), dtype=np.uint32)
+
+    def append(self, spectra):
+        # Rows are written after the complete ones, the header only counts them once all are written
+        spectra = list(spectra)
+        for spectrum in spectra:
+            if len(spectrum["data_points"]) != self.n_channels:
+                raise ValueError(f"{spectrum['sample_name']} has {len(spectrum['data_points'])} channels, "
+                                 f"the archive has {self.n_channels}.")
+        if not spectra:
+            return 0
+
+        metadata = np.zeros(len(spectra), dtype=METADATA_DTYPE)
+        counts = np.empty((len(spectra), self.n_channels), dtype=np.uint32)
+        for i, spectrum in enumerate(spectra):
+            metadata[i] = (_text(spectrum["sample_name"], 80), _text(spectrum["serial_number"], 24),
+                           spectrum["file_coeffs"][:3], _time(spectrum["start_time"]), _time(spectrum["end_time"]),
+                           spectrum["seconds"])
+            counts[i] = as_counts(spectrum["data_points"])
+
+        # The maps have to be closed before the files change
+        self.metadata = self.counts = None
+        with open(self.counts_path, "r+b") as f:
+            f.truncate(self.rows * self.n_channels * counts.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(counts.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.path, "r+b") as f:
+            f.truncate(HEADER.size + self.rows * METADATA_DTYPE.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(metadata.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+            self.rows += len(spectra)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, self.n_channels, self.rows))
+        self._map()
+        return len(spectra)
+
+    def append_files(self, xml_files, include_channel_1023=False, batch_size=256):
+        # Generator over (file, error), so the GUI can show progress. Rows are appended in batches
+        batch = []
+        try:
+            for xml_file in xml_files:
+                try:
+                    spectrum = parse_spectrum(xml_file, include_channel_1023)
+                    if len(spectrum["data_points"]) != self.n_channels:
+                        raise ValueError(f"{xml_file} has {len(spectrum['data_points'])} channels, "
+                                         f"the archive has {self.n_channels}.")
+                    batch.append(spectrum)
+                    error = None
+                except (ValueError, OSError) as e:
+                    error = str(e)
+                if len(batch) >= batch_size:
+                    self.append(batch)
+                    batch = []
+                yield xml_file, error
+        finally:
+            # Also when the generator is closed early, the spectra parsed so far are kept
+            self.append(batch)
+
+    def calibrations(self, overrides=None):
+        # Coefficients of every row, a calibration override of a device holds for all of its spectra
+        coeffs = np.array(self.metadata["coeffs"])
+        if overrides:
+            serial_numbers = self.metadata["serial_number"]
+            for serial_number in np.unique(serial_numbers):
+                override = overrides.get(serial_number.decode("utf8").lower())
+                if override:
+                    coeffs[serial_numbers == serial_number] = override[:3]
+        return coeffs
+
+    def spectrum(self, row, overrides=None):
+        # Same layout as parse_spectrum, for the viewer and the processing
+        entry = self.metadata[row]
+        serial_number = entry["serial_number"].decode("utf8") or None
+        file_coeffs = [float(c) for c in entry["coeffs"]]
+        coeffs = list(overrides[serial_number.lower()]) if overrides and serial_number and \
+            serial_number.lower() in overrides else file_coeffs.copy()
+        start_time = entry["start_time"].item()
+        end_time = entry["end_time"].item()
+        return {
+            "sample_name": entry["sample_name"].decode("utf8"),
+            "serial_number": serial_number,
+            "device": get_device(serial_number),
+            "coeffs": coeffs,
+            "file_coeffs": file_coeffs,
+            # A copy, the map is replaced by the next append
+            "data_points": np.array(self.counts[row]),
+            "seconds": float(entry["seconds"]),
+            "duration": str(end_time - start_time),
+            "start_time": str(start_time),
+            "end_time": str(end_time),
+            "bg_coeffs": None,
+            "bg_data_points": None,
+            "bg_seconds": None,
+            "diagnostics": [],
+        }
+
+    def channel_windows(self, low_energy, high_energy, overrides=None):
+        # First and last channel of the energy window in every row, once per calibration
+        low_energy, high_energy = sorted((low_energy, high_energy))
+        coeffs = self.calibrations(overrides)
+        unique, inverse = np.unique(coeffs, axis=0, return_inverse=True)
+        first = np.empty(len(unique), dtype=np.int64)
+        last = np.empty(len(unique), dtype=np.int64)
+        for i, calibration in enumerate(unique):
+            energies = energy_axis(calibration, self.n_channels)
+            first[i] = np.searchsorted(energies, low_energy, side="left")
+            last[i] = np.searchsorted(energies, high_energy, side="right") - 1
+        inverse = inverse.reshape(-1)
+        return first[inverse], last[inverse]
+
+    def roi_counts(self, low_energy, high_energy, overrides=None):
+        # Counts in the energy window of every spectrum. Rows with the same channel window are summed together,
+        # only the channels of the window are read
+        first, last = self.channel_windows(low_energy, high_energy, overrides)
+        totals = np.zeros(self.rows, dtype=np.uint64)
+        for start in range(0, self.rows, QUERY_ROWS):
+            end = min(start + QUERY_ROWS, self.rows)
+            windows = np.stack((first[start:end], last[start:end]), axis=1)
+            unique, inverse = np.unique(windows, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            for i, (low, high) in enumerate(unique):
+                if high < low:
+                    continue
+                rows = np.flatnonzero(inverse == i) + start
+                block = self.counts[start:end, low:high + 1]
+                if rows.size == end - start:
+                    totals[start:end] = block.sum(axis=1, dtype=np.uint64)
+                else:
+                    totals[rows] = block[rows - start].sum(axis=1, dtype=np.uint64)
+        return totals
+
+    def roi_series(self, low_energy, high_energy, overrides=None):
+        # Counts per second in the energy window over time, sorted by the start time
+        order = np.argsort(self.metadata["start_time"], kind="stable")
+        seconds = np.asarray(self.metadata["seconds"])[order]
+        counts = self.roi_counts(low_energy, high_energy, overrides)[order]
+        rates = np.divide(counts, seconds, out=np.zeros(len(order)), where=seconds > 0)
+        return np.asarray(self.metadata["start_time"])[order], rates, order
+
+    def select(self, serial_number=None, start=None, end=None):
+        # Rows of one device and a time range, as indices into the archive
+        mask = np.ones(self.rows, dtype=bool)
+        if serial_number:
+            mask &= self.metadata["serial_number"] == _text(serial_number, 24)
+        if start is not None:
+            mask &= self.metadata["start_time"] >= np.datetime64(start, "s")
+        if end is not None:
+            mask &= self.metadata["start_time"] < np.datetime64(end, "s")
+        return np.flatnonzero(mask)
+
+
+def open_archive(path, n_channels=1023):
+    if os.path.exists(path):
+        return SpectrumArchive(path)
+    return SpectrumArchive.create(path, n_channels)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add RadiaCode spectra to a spectrum archive or query it.")
+    parser.add_argument("archive", help="archive file, made if it doesn't exist")
+    parser.add_argument("files", nargs="*", help="RadiaCode XML files to add")
+    parser.add_argument("-r", "--roi", help="low:high energy in keV, writes the counts per second of every "
+                                            "spectrum in this range as CSV")
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read("config.ini")
+    include_channel_1023 = config.getboolean("Settings", "include_channel_1023")
+
+    archive = open_archive(args.archive, 1024 if include_channel_1023 else 1023)
+    for source, error in archive.append_files(args.files, include_channel_1023):
+        if error:
+            print(f"{source}: {error}", file=sys.stderr)
+    print(f"{len(archive)} spectra in {args.archive}", file=sys.stderr)
+
+    if args.roi:
+        low, high = (float(value) for value in args.roi.split(":"))
+        times, cps, _ = archive.roi_series(low, high, load_overrides(config))
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["start_time", "cps"])
+        writer.writerows(zip(times.astype(str), cps.tolist()))
@@ -0,0 +1,104 @@
+import numpy as np
+
+OVERRIDE_SECTION = "CalibrationOverrides"
+
+# Strong, well separated lines of common check sources and natural background
+REFERENCE_LINES = {
+    "Am-241": [59.5],
+    "Ba-133": [81.0, 356.0],
+    "Ra-226": [186.2],
+    "Lu-176": [201.8, 306.8],
+    "Pb-212": [238.6],
+    "Pb-214": [295.2, 351.9],
+    "Annihilation": [511.0],
+    "Tl-208": [583.2, 2614.5],
+    "Bi-214": [609.3, 1120.3, 1764.5],
+    "Cs-137": [661.7],
+    "Ac-228": [911.2, 969.0],
+    "Co-60": [1173.2, 1332.5],
+    "Na-22": [1274.5],
+    "K-40": [1460.8],
+}
+
+
+def reference_energies():
+    lines = sorted((energy, name) for name, energies in REFERENCE_LINES.items() for energy in energies)
+    return np.array([line[0] for line in lines]), [line[1] for line in lines]
+
+
+def match_peaks(peak_energies, tolerance_kev):
+    peak_energies = np.asarray(peak_energies, dtype=float)
+    ref_energies, ref_names = reference_energies()
+    if peak_energies.size == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    # Miscalibrated spectra are mostly shifted, so first find the offset that lines up most peaks
+    differences = ref_energies[None, :] - peak_energies[:, None]
+    candidates = differences[np.abs(differences) <= tolerance_kev]
+    if candidates.size:
+        window = tolerance_kev / 4
+        hits = np.abs(differences[None, :, :] - candidates[:, None, None]) <= window
+        scores = hits.any(axis=2).sum(axis=1)
+        best = candidates[scores == scores.max()]
+        shift = best[np.argmin(np.abs(best))]
+    else:
+        shift = 0
+
+    distance = np.abs(peak_energies[:, None] + shift - ref_energies[None, :])
+    # Greedy one to one assignment, closest pairs first
+    peak_idx, ref_idx = [], []
+    used_peaks, used_refs = set(), set()
+    for flat in np.argsort(distance, axis=None):
+        p, r = np.unravel_index(flat, distance.shape)
+        if distance[p, r] > tolerance_kev:
+            break
+        if p in used_peaks or r in used_refs:
+            continue
+        used_peaks.add(p)
+        used_refs.add(r)
+        peak_idx.append(p)
+        ref_idx.append(r)
+
+    order = np.argsort(peak_idx)
+    return np.array(peak_idx, dtype=int)[order], np.array(ref_idx, dtype=int)[order]
+
+
+def fit_calibration(channels, energies, energy_errors, order=2):
+    channels = np.asarray(channels, dtype=float)
+    energies = np.asarray(energies, dtype=float)
+    if channels.size < order + 1:
+        raise ValueError(f"At least {order + 1} matched peaks are needed for a calibration of order {order}.")
+
+    weights = 1 / np.maximum(np.asarray(energy_errors, dtype=float), 0.05)
+    vander = np.vander(channels, order + 1, increasing=True)
+    coeffs, _, rank, _ = np.linalg.lstsq(vander * weights[:, None], energies * weights, rcond=None)
+    if rank < order + 1:
+        raise ValueError("The matched peaks don't determine the calibration, use peaks spread over the spectrum.")
+
+    residuals = energies - vander @ coeffs
+    return coeffs.tolist(), residuals
+
+
+def load_overrides(config):
+    if not config.has_section(OVERRIDE_SECTION):
+        return {}
+    return {serial: [float(c) for c in value.split(",")] for serial, value in config.items(OVERRIDE_SECTION)}
+
+
+def get_override(config, serial_number):
+    if not serial_number or not config.has_section(OVERRIDE_SECTION):
+        return None
+    if not config.has_option(OVERRIDE_SECTION, serial_number):
+        return None
+    return [float(c) for c in config.get(OVERRIDE_SECTION, serial_number).split(",")]
+
+
+def set_override(config, serial_number, coeffs):
+    if not config.has_section(OVERRIDE_SECTION):
+        config.add_section(OVERRIDE_SECTION)
+    config.set(OVERRIDE_SECTION, serial_number, ", ".join(repr(float(c)) for c in coeffs))
+
+
+def remove_override(config, serial_number):
+    if config.has_section(OVERRIDE_SECTION):
+        config.remove_option(OVERRIDE_SECTION, serial_number)
@@ -0,0 +1,101 @@
+import numpy as np
+from scipy.linalg import cho_factor, solve_triangular
+from scipy.optimize import nnls
+
+from rsv_sum import rebin_to_edges
+
+REFERENCE_SECTION = "ReferenceSpectra"
+BACKGROUND_COMPONENT = "Background"
+
+
+def load_references(config):
+    # Name of the isotope or source -> RadiaCode XML file of a measurement of it alone
+    if not config.has_section(REFERENCE_SECTION):
+        return {}
+    return {name: path for name, path in config.items(REFERENCE_SECTION) if path}
+
+
+def set_reference(config, name, path):
+    if not config.has_section(REFERENCE_SECTION):
+        config.add_section(REFERENCE_SECTION)
+    config.set(REFERENCE_SECTION, name, path)
+
+
+def remove_reference(config, name):
+    if config.has_section(REFERENCE_SECTION):
+        config.remove_option(REFERENCE_SECTION, name)
+
+
+def grid_rates(counts, coeffs, seconds, edges):
+    # Counts per second in every bin of the energy grid
+    if not seconds or seconds <= 0:
+        raise ValueError("The spectrum has no measurement time.")
+    return rebin_to_edges(counts, coeffs, edges) / seconds
+
+
+class MixtureModel:
+    def __init__(self, names, components, edges):
+        # components: counts per second of every reference on the grid, one row per reference
+        self.names = list(names)
+        self.edges = np.asarray(edges, dtype=float)
+        self.centers = (self.edges[:-1] + self.edges[1:]) / 2
+        self.design = np.asarray(components, dtype=float).T
+        if self.design.shape != (self.centers.size, len(self.names)):
+            raise ValueError("Every reference needs one value per bin of the energy grid.")
+
+        # Prefix sums of the outer products of the rows, the Gram matrix of any energy range is a difference
+        outer = self.design[:, :, None] * self.design[:, None, :]
+        self.gram_prefix = np.concatenate((np.zeros((1,) + outer.shape[1:]), np.cumsum(outer, axis=0)))
+        self.factors = {}
+
+    def bins(self, low_energy, high_energy):
+        first = int(np.searchsorted(self.centers, min(low_energy, high_energy), side="left"))
+        last = int(np.searchsorted(self.centers, max(low_energy, high_energy), side="right")) - 1
+        return max(first, 0), min(last, self.centers.size - 1)
+
+    def gram(self, first, last):
+        return self.gram_prefix[last + 1] - self.gram_prefix[first]
+
+    def factor(self, first, last):
+        # Cholesky factor of the Gram matrix, once per energy range. A tiny ridge keeps it defined
+        # for references without counts in the range
+        key = (first, last)
+        if key not in self.factors:
+            gram = self.gram(first, last)
+            ridge = 1e-12 * max(np.trace(gram), 1e-300)
+            self.factors[key] = np.tril(cho_factor(gram + ridge * np.eye(len(self.names)), lower=True)[0])
+        return self.factors[key]
+
+    def fit(self, rates, low_energy, high_energy):
+        first, last = self.bins(low_energy, high_energy)
+        if last - first + 1 <= len(self.names):
+            raise ValueError("The energy range has fewer bins than there are components.")
+        design = self.design[first:last + 1]
+        rates = np.asarray(rates, dtype=float)[first:last + 1]
+
+        # |A w - y|^2 = |L^T w - L^-1 A^T y|^2 + const with A^T A = L L^T, so the NNLS only sees
+        # k x k matrices and the bins are touched once, for A^T y
+        lower = self.factor(first, last)
+        weights, _ = nnls(lower.T, solve_triangular(lower, design.T @ rates, lower=True))
+
+        fitted = design @ weights
+        residual = rates - fitted
+        active = weights > 0
+        dof = max(rates.size - int(active.sum()), 1)
+        variance = float(residual @ residual) / dof
+        errors = np.zeros(len(self.names))
+        if active.any():
+            gram = self.gram(first, last)[np.ix_(active, active)]
+            errors[active] = np.sqrt(np.maximum(np.diag(np.linalg.pinv(gram)) * variance, 0))
+
+        total = rates.sum()
+        return {
+            "names": self.names,
+            "weights": weights,
+            "errors": errors,
+            # Share of the counts in the range explained by every component
+            "fractions": weights * design.sum(axis=0) / total if total > 0 else np.zeros(len(self.names)),
+            "low_energy": float(self.edges[first]),
+            "high_energy": float(self.edges[last + 1]),
+            "residual_fraction": float(np.abs(residual).sum() / total) if total > 0 else 0.0,
+        }
@@ -0,0 +1,41 @@
+ERROR = "error"
+WARNING = "warning"
+INFO = "info"
+
+
+def diagnostic(severity, code, message, part="spectrum"):
+    return {"severity": severity, "code": code, "message": message, "part": part}
+
+
+def errors(diagnostics):
+    return [d for d in diagnostics if d["severity"] == ERROR]
+
+
+def check_coeffs(coeffs, device, part="spectrum"):
+    # Problems of the energy calibration in a file, only errors make the spectrum unusable
+    if len(coeffs) < 3:
+        return [diagnostic(ERROR, "few_coefficients", f"The {part} has less than 3 coefficients.", part)]
+
+    diagnostics = []
+    if len(coeffs) > 3:
+        diagnostics.append(diagnostic(INFO, "extra_coefficients",
+                                      f"The {part} has more than 3 coefficients, only the first 3 are used.", part))
+    coeffs = coeffs[:3]
+    if any(coeff == 0 for coeff in coeffs):
+        diagnostics.append(diagnostic(ERROR, "zero_coefficient",
+                                      f"The {part} has one or more coefficients with a value of 0.", part))
+
+    if device == "RC-103G":
+        if coeffs[0] < 0:
+            diagnostics.append(diagnostic(WARNING, "negative_a0",
+                                          f"The {part} has a negative coefficient a0, no value a proper calibrated "
+                                          f"RC-103G would have. The results might be incorrect.", part))
+    elif coeffs[0] < -20:
+        diagnostics.append(diagnostic(WARNING, "low_a0",
+                                      f"The {part} has coefficient a0 < -20, no value a proper calibrated device "
+                                      f"would have. The results might be incorrect.", part))
+    if coeffs[0] > 30:
+        diagnostics.append(diagnostic(WARNING, "high_a0",
+                                      f"The {part} has coefficient a0 > 30, no value a proper calibrated device "
+                                      f"would have. The results might be incorrect.", part))
+    return diagnostics
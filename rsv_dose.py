@@ -0,0 +1,102 @@
+import argparse
+from configparser import ConfigParser
+from functools import lru_cache
+
+import numpy as np
+
+from rsv_calibration import load_overrides
+from rsv_efficiency import curve_version, read_curve
+from rsv_parser import parse_spectrum
+from rsv_processing import efficiency, energy_axis
+
+DOSE_SECTION = "DoseFunctions"
+# Fluence to dose of every device without a G(E) table, a rough estimate
+BUILTIN_MODEL = "builtin"
+
+# Ambient dose equivalent H*(10) per photon fluence in pSv cm^2, ICRP 74
+H10_ENERGIES = np.array([15, 20, 30, 40, 50, 60, 80, 100, 150, 200, 300, 400, 500, 600, 800, 1000, 1500, 2000,
+                         3000, 4000, 5000, 6000, 8000, 10000], dtype=float)
+H10_VALUES = np.array([0.83, 1.05, 0.81, 0.64, 0.55, 0.51, 0.53, 0.61, 0.89, 1.20, 1.80, 2.38, 2.93, 3.44, 4.38,
+                       5.20, 6.90, 8.60, 11.1, 13.4, 15.5, 17.6, 21.6, 25.6])
+
+
+def load_functions(config):
+    # Device type -> CSV file with energy in keV and dose rate in uSv/h per count per second
+    if not config.has_section(DOSE_SECTION):
+        return {}
+    return {device.upper(): path for device, path in config.items(DOSE_SECTION) if path}
+
+
+def model_for_device(functions, device):
+    return functions.get((device or "").upper(), BUILTIN_MODEL)
+
+
+def log_interp(energies, table_energies, table_values):
+    # Linear in log-log, outside of the table the first or last value is used
+    log_energies = np.log(np.clip(energies, table_energies[0], table_energies[-1]))
+    return np.exp(np.interp(log_energies, np.log(table_energies), np.log(table_values)))
+
+
+def builtin_function(energies, cps_per_usvh):
+    # Dose per fluence over the detection efficiency of the crystal, scaled so a count at 662 keV is
+    # 1 / cps_per_usvh uSv/h, the Cs-137 sensitivity of the device. Only a full G(E) table, measured or
+    # simulated for the device, gives an accurate dose rate
+    energies = np.asarray(energies, dtype=float)
+    shape = log_interp(energies, H10_ENERGIES, H10_VALUES) / efficiency(np.maximum(energies, H10_ENERGIES[0]))
+    reference = log_interp(662.0, H10_ENERGIES, H10_VALUES) / efficiency(np.array([662.0]))[0]
+    return shape / reference / cps_per_usvh
+
+
+@lru_cache(maxsize=64)
+def _dose_function(model, version, coeffs, n_channels, cps_per_usvh):
+    energies = energy_axis(coeffs, n_channels)
+    if model == BUILTIN_MODEL:
+        values = builtin_function(energies, cps_per_usvh)
+    else:
+        table_energies, table_values = read_curve(model)
+        values = log_interp(energies, table_energies, table_values)
+    # Channels below the lowest energy of the function are noise
+    lowest = H10_ENERGIES[0] if model == BUILTIN_MODEL else read_curve(model)[0][0]
+    values = np.where(energies >= lowest, values, 0.0)
+    values.setflags(write=False)
+    return values
+
+
+def dose_function(model, coeffs, n_channels, cps_per_usvh=30.0):
+    return _dose_function(model, curve_version(model), tuple(float(c) for c in coeffs), int(n_channels),
+                          float(cps_per_usvh))
+
+
+def dose_rate(counts, seconds, coeffs, model=BUILTIN_MODEL, cps_per_usvh=30.0):
+    # uSv/h, one dot product per spectrum. counts can also be one spectrum per row with the same calibration
+    counts = np.asarray(counts)
+    if not seconds:
+        return 0.0
+    return (counts @ dose_function(model, coeffs, counts.shape[-1], cps_per_usvh)) / np.asarray(seconds)
+
+
+def clear_cache():
+    _dose_function.cache_clear()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate the ambient dose rate of RadiaCode spectra.")
+    parser.add_argument("files", nargs="+", help="RadiaCode XML files")
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read("config.ini")
+    functions = load_functions(config)
+    cps_per_usvh = config.getfloat("Settings", "dose_cps_per_usvh")
+    include_channel_1023 = config.getboolean("Settings", "include_channel_1023")
+    overrides = load_overrides(config)
+
+    for xml_file in args.files:
+        try:
+            spectrum = parse_spectrum(xml_file, include_channel_1023, overrides)
+        except (ValueError, OSError) as e:
+            print(f"{xml_file}: {e}")
+            continue
+        rate = dose_rate(spectrum["data_points"], spectrum["seconds"], spectrum["coeffs"],
+                         model_for_device(functions, spectrum["device"]), cps_per_usvh)
+        print(f"{xml_file}: {rate:.3f} uSv/h")
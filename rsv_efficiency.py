@@ -0,0 +1,129 @@
+import csv
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from rsv_diagnostics import WARNING, diagnostic
+from rsv_processing import efficiency, energy_axis
+
+CURVE_SECTION = "EfficiencyCurves"
+# The crystal efficiency formula of the CsI(Tl) devices, used for every device without a usable curve
+BUILTIN_MODEL = "builtin"
+# Relative curve paths, like the curve shipped for the RC-103G, are next to the viewer
+CURVE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_curves(config):
+    # Device type (as detected from the serial number) -> CSV file with energy in keV and efficiency
+    if not config.has_section(CURVE_SECTION):
+        return {}
+    return {device.upper(): os.path.join(CURVE_DIR, path) for device, path in config.items(CURVE_SECTION) if path}
+
+
+def set_curve(config, device, path):
+    if not config.has_section(CURVE_SECTION):
+        config.add_section(CURVE_SECTION)
+    config.set(CURVE_SECTION, device, path)
+
+
+def curve_error(model):
+    # Why the curve file can't be used, None if it can
+    if model == BUILTIN_MODEL:
+        return None
+    try:
+        read_curve(model)
+    except (OSError, ValueError) as e:
+        return str(e)
+    return None
+
+
+def model_for_device(curves, device):
+    # A curve file that is missing or broken falls back to the formula, curve_diagnostics tells why
+    model = curves.get((device or "").upper(), BUILTIN_MODEL)
+    return BUILTIN_MODEL if curve_error(model) else model
+
+
+def curve_diagnostics(curves, device, part="spectrum"):
+    model = curves.get((device or "").upper(), BUILTIN_MODEL)
+    error = curve_error(model)
+    if error:
+        return [diagnostic(WARNING, "no_efficiency_curve",
+                           f"The efficiency curve of the {device} can't be used ({error.rstrip('.')}). "
+                           f"The compensation uses the curve of the CsI(Tl) devices.", part)]
+    if device == "RC-103G" and model == BUILTIN_MODEL:
+        return [diagnostic(WARNING, "no_efficiency_curve",
+                           "The RC-103G has a GAGG crystal, but there is no efficiency curve for it. The compensation "
+                           "uses the curve of the CsI(Tl) devices, set one with \"Efficiency Curve\".", part)]
+    return []
+
+
+def curve_version(model):
+    # Part of the cache keys, a curve file that is edited is read again
+    if model == BUILTIN_MODEL:
+        return None
+    return os.stat(model).st_mtime_ns
+
+
+def read_curve(path):
+    return _read_curve(path, curve_version(path))
+
+
+@lru_cache(maxsize=16)
+def _read_curve(path, version):
+    energies = []
+    values = []
+    with open(path, newline="", encoding="utf8") as f:
+        reader = csv.reader(f)
+        for row in reader:
+            if not row or row[0].lstrip().startswith("#"):
+                continue
+            try:
+                energy, value = float(row[0]), float(row[1])
+            except (ValueError, IndexError):
+                # A header is allowed in front of the table
+                if energies:
+                    raise ValueError(f"{path}: line {reader.line_num} is not an energy and an efficiency.")
+                continue
+            energies.append(energy)
+            values.append(value)
+
+    energies = np.array(energies)
+    values = np.array(values)
+    if energies.size < 2:
+        raise ValueError(f"{path}: an efficiency curve needs at least 2 points.")
+    if np.any(energies <= 0) or np.any(values <= 0):
+        raise ValueError(f"{path}: energies and efficiencies have to be positive.")
+    if np.any(np.diff(energies) <= 0):
+        raise ValueError(f"{path}: energies have to be increasing.")
+    energies.setflags(write=False)
+    values.setflags(write=False)
+    return energies, values
+
+
+@lru_cache(maxsize=64)
+def _efficiency_curve(model, version, coeffs, n_channels):
+    energies = energy_axis(coeffs, n_channels)
+    if model == BUILTIN_MODEL:
+        values = efficiency(energies)
+    else:
+        # Linear between the points in log-log, outside of the table the first or last value is used
+        table_energies, table_values = read_curve(model)
+        log_energies = np.log(np.maximum(energies, table_energies[0]))
+        values = np.exp(np.interp(log_energies, np.log(table_energies), np.log(table_values)))
+    values.setflags(write=False)
+    return values
+
+
+def efficiency_curve(model, coeffs, n_channels):
+    return _efficiency_curve(model, curve_version(model), tuple(float(c) for c in coeffs), int(n_channels))
+
+
+def compensate_counts(data_points, coeffs, model=BUILTIN_MODEL):
+    data_points = np.asarray(data_points, dtype=float)
+    return data_points / efficiency_curve(model, coeffs, data_points.size)
+
+
+def clear_cache():
+    _read_curve.cache_clear()
+    _efficiency_curve.cache_clear()
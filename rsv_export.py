@@ -0,0 +1,217 @@
+import argparse
+import csv
+import json
+import os.path
+import uuid
+from configparser import ConfigParser
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from rsv_calibration import load_overrides
+from rsv_parser import parse_spectrum
+from rsv_pipeline import load_settings, process_spectrum
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+FORMATS = {
+    "csv": ".csv",
+    "json": ".json",
+    "parquet": ".parquet",
+    "n42": ".n42",
+}
+
+SERIES = ("energy", "counts", "compensated", "smoothed", "normalized", "net", "net_compensated")
+PEAK_COLUMNS = ("energy", "energy_err", "fwhm", "channel", "channel_err", "fwhm_channels",
+                "net_counts", "net_counts_err", "cps", "reduced_chi2")
+METADATA_KEYS = ("sample_name", "serial_number", "device", "coeffs", "seconds", "start_time", "end_time")
+# Rows converted to text at a time, the text of a whole spectrum is never held in memory
+CHUNK_ROWS = 4096
+
+
+def metadata(spectrum, processed):
+    data = {key: spectrum.get(key) for key in METADATA_KEYS}
+    data["background"] = processed["background"]
+    data["dose_rate"] = processed.get("dose_rate")
+    return data
+
+
+def series_names(processed):
+    return [name for name in SERIES if name in processed["series"]]
+
+
+def peaks_path(path):
+    stem, extension = os.path.splitext(path)
+    return f"{stem}_peaks{extension}"
+
+
+def chunks(columns, n_rows):
+    # Rows of the columns, converted to Python numbers one chunk at a time
+    for start in range(0, n_rows, CHUNK_ROWS):
+        yield zip(*(column[start:start + CHUNK_ROWS].tolist() for column in columns))
+
+
+def write_rows(path, header, columns):
+    n_rows = len(columns[0]) if columns else 0
+    with open(path, "w", newline="", encoding="utf8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for rows in chunks(columns, n_rows):
+            writer.writerows(rows)
+
+
+def write_json_array(f, values):
+    f.write("[")
+    for start in range(0, len(values), CHUNK_ROWS):
+        if start:
+            f.write(", ")
+        f.write(json.dumps(values[start:start + CHUNK_ROWS].tolist())[1:-1])
+    f.write("]")
+
+
+def write_csv(path, spectrum, processed):
+    names = series_names(processed)
+    series = [processed["series"][name] for name in names]
+    write_rows(path, ["channel"] + names, [np.arange(len(series[0]))] + series)
+    write_rows(peaks_path(path), PEAK_COLUMNS, [processed["peaks"][key] for key in PEAK_COLUMNS])
+
+
+def write_json(path, spectrum, processed):
+    # Written in chunks of every column, the document is never held in memory as a whole
+    with open(path, "w", encoding="utf8") as f:
+        f.write('{"metadata": ' + json.dumps(metadata(spectrum, processed)) + ', "series": {')
+        for i, name in enumerate(series_names(processed)):
+            if i:
+                f.write(", ")
+            f.write(json.dumps(name) + ": ")
+            write_json_array(f, processed["series"][name])
+        f.write('}, "peaks": {')
+        for i, key in enumerate(PEAK_COLUMNS):
+            if i:
+                f.write(", ")
+            f.write(json.dumps(key) + ": ")
+            write_json_array(f, processed["peaks"][key])
+        f.write("}}\n")
+
+
+def write_parquet(path, spectrum, processed):
+    if pa is None:
+        raise RuntimeError("Parquet export needs the pyarrow package (pip install pyarrow).")
+
+    schema_metadata = {"radiacode": json.dumps(metadata(spectrum, processed))}
+    series = pa.table({name: processed["series"][name] for name in series_names(processed)})
+    pq.write_table(series.replace_schema_metadata(schema_metadata), path)
+    peaks = pa.table({key: processed["peaks"][key] for key in PEAK_COLUMNS})
+    pq.write_table(peaks.replace_schema_metadata(schema_metadata), peaks_path(path))
+
+
+def n42_spectrum(f, spectrum_id, coeffs_id, data_points, seconds):
+    f.write(f'  <Spectrum id="{spectrum_id}" radDetectorInformationReference="RadDetectorInformation-1" '
+            f'energyCalibrationReference="{coeffs_id}">\n')
+    f.write(f"   <LiveTimeDuration>PT{seconds:.0f}S</LiveTimeDuration>\n")
+    f.write('   <ChannelData compressionCode="None">')
+    f.write(" ".join(str(int(value)) for value in data_points))
+    f.write("</ChannelData>\n  </Spectrum>\n")
+
+
+def write_n42(path, spectrum, processed):
+    # ANSI N42.42-2011 holds the measured counts, the processed series can't be represented there
+    device = spectrum["device"]
+    # GAGG isn't in the detector kinds of the standard, it is Other with the crystal in the description
+    crystal = "Other" if device == "RC-103G" else "CsI"
+    start_time = spectrum["start_time"].replace(" ", "T") + "Z"
+
+    with open(path, "w", encoding="utf8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(f'<RadInstrumentData xmlns="http://physics.nist.gov/N42/2011/N42" n42DocUUID="{uuid.uuid4()}">\n')
+        f.write(' <RadInstrumentInformation id="RadInstrumentInformation-1">\n')
+        f.write("  <RadInstrumentManufacturerName>RadiaCode</RadInstrumentManufacturerName>\n")
+        f.write(f"  <RadInstrumentModelName>{escape(device)}</RadInstrumentModelName>\n")
+        f.write("  <RadInstrumentClassCode>Spectroscopic Personal Radiation Detector</RadInstrumentClassCode>\n")
+        if spectrum["serial_number"]:
+            f.write(f"  <RadInstrumentIdentifier>{escape(spectrum['serial_number'])}</RadInstrumentIdentifier>\n")
+        f.write(" </RadInstrumentInformation>\n")
+        f.write(' <RadDetectorInformation id="RadDetectorInformation-1">\n')
+        f.write("  <RadDetectorCategoryCode>Gamma</RadDetectorCategoryCode>\n")
+        f.write(f"  <RadDetectorKindCode>{crystal}</RadDetectorKindCode>\n")
+        if crystal == "Other":
+            f.write("  <RadDetectorDescription>GAGG(Ce) scintillator</RadDetectorDescription>\n")
+        f.write(" </RadDetectorInformation>\n")
+        f.write(' <EnergyCalibration id="EnergyCalibration-1">\n')
+        f.write("  <CoefficientValues>" + " ".join(repr(float(c)) for c in spectrum["coeffs"]) +
+                "</CoefficientValues>\n")
+        f.write(" </EnergyCalibration>\n")
+        if spectrum.get("bg_data_points") is not None:
+            f.write(' <EnergyCalibration id="EnergyCalibration-2">\n')
+            f.write("  <CoefficientValues>" + " ".join(repr(float(c)) for c in spectrum["bg_coeffs"]) +
+                    "</CoefficientValues>\n")
+            f.write(" </EnergyCalibration>\n")
+
+        f.write(' <RadMeasurement id="RadMeasurement-1">\n')
+        f.write("  <MeasurementClassCode>Foreground</MeasurementClassCode>\n")
+        f.write(f"  <StartDateTime>{start_time}</StartDateTime>\n")
+        f.write(f"  <RealTimeDuration>PT{spectrum['seconds']:.0f}S</RealTimeDuration>\n")
+        n42_spectrum(f, "Spectrum-1", "EnergyCalibration-1", spectrum["data_points"], spectrum["seconds"])
+        f.write(" </RadMeasurement>\n")
+
+        if spectrum.get("bg_data_points") is not None:
+            # Files without the live time of the background are assumed to have the time of the spectrum
+            bg_seconds = spectrum.get("bg_seconds") or spectrum["seconds"]
+            f.write(' <RadMeasurement id="RadMeasurement-2">\n')
+            f.write("  <MeasurementClassCode>Background</MeasurementClassCode>\n")
+            f.write(f"  <StartDateTime>{start_time}</StartDateTime>\n")
+            f.write(f"  <RealTimeDuration>PT{bg_seconds:.0f}S</RealTimeDuration>\n")
+            n42_spectrum(f, "Spectrum-2", "EnergyCalibration-2", spectrum["bg_data_points"], bg_seconds)
+            f.write(" </RadMeasurement>\n")
+        f.write("</RadInstrumentData>\n")
+
+
+WRITERS = {
+    "csv": write_csv,
+    "json": write_json,
+    "parquet": write_parquet,
+    "n42": write_n42,
+}
+
+
+def export_spectrum(path, export_format, spectrum, processed):
+    WRITERS[export_format](path, spectrum, processed)
+
+
+def export_files(xml_files, output_dir, export_format, settings, include_channel_1023=False, overrides=None):
+    # Generator, so the GUI can show progress and the memory stays at one spectrum at a time
+    for xml_file in xml_files:
+        try:
+            spectrum = parse_spectrum(xml_file, include_channel_1023, overrides)
+            processed = process_spectrum(spectrum, settings)
+            path = os.path.join(output_dir, spectrum["sample_name"] + FORMATS[export_format])
+            export_spectrum(path, export_format, spectrum, processed)
+        except (ValueError, OSError, RuntimeError) as e:
+            yield xml_file, None, str(e)
+        else:
+            yield xml_file, path, None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export RadiaCode spectra with the viewer's processing.")
+    parser.add_argument("files", nargs="+", help="RadiaCode XML files")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="csv")
+    parser.add_argument("-o", "--output", default=".", help="output directory")
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read("config.ini")
+    os.makedirs(args.output, exist_ok=True)
+
+    for source, target, error in export_files(args.files, args.output, args.format, load_settings(config),
+                                              config.getboolean("Settings", "include_channel_1023"),
+                                              load_overrides(config)):
+        if error:
+            print(f"{source}: {error}")
+        else:
+            print(f"{source} -> {target}")
@@ -0,0 +1,27 @@
+import numpy as np
+
+
+def in_view(x, x_range):
+    x = np.asarray(x, dtype=float)
+    return (x >= x_range[0]) & (x <= x_range[1])
+
+
+def declutter(x, y, widths, heights, priority):
+    # Greedy: labels are placed from the highest priority down, a label that would overlap an already
+    # placed one is dropped. Positions and sizes are in pixels, positions are the label centers
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    widths = np.asarray(widths, dtype=float)
+    heights = np.asarray(heights, dtype=float)
+    order = np.argsort(-np.asarray(priority, dtype=float), kind="stable")
+
+    kept = np.empty(order.size, dtype=int)
+    n_kept = 0
+    for i in order:
+        placed = kept[:n_kept]
+        overlap = ((np.abs(x[placed] - x[i]) * 2 < widths[placed] + widths[i]) &
+                   (np.abs(y[placed] - y[i]) * 2 < heights[placed] + heights[i]))
+        if not overlap.any():
+            kept[n_kept] = i
+            n_kept += 1
+    return kept[:n_kept]
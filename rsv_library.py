@@ -0,0 +1,200 @@
+import argparse
+import os
+from configparser import ConfigParser
+
+import numpy as np
+
+from rsv_calibration import load_overrides
+from rsv_efficiency import compensate_counts, load_curves, model_for_device
+from rsv_parser import parse_spectrum
+from rsv_processing import normalize
+from rsv_session import read_session, write_session
+from rsv_sum import rebin_to_edges
+
+LIBRARY_EXTENSION = ".rsvl"
+METRICS = {"cosine": "Cosine", "chi2": "Chi²"}
+# Rows are added into spare capacity, the matrix is only copied when it is full
+MIN_CAPACITY = 64
+
+
+def library_edges(min_energy, max_energy, bins):
+    return np.linspace(float(min_energy), float(max_energy), int(bins) + 1)
+
+
+def library_vector(spectrum, edges, efficiency_curves=None):
+    # Compensated and normalized like the compensated plot, on the energy grid of the library
+    coeffs = spectrum["coeffs"]
+    model = model_for_device(efficiency_curves or {}, spectrum.get("device"))
+    compensated = compensate_counts(spectrum["data_points"], coeffs, model)
+    binned = rebin_to_edges(compensated, coeffs, edges)
+    if binned.max() <= binned.min():
+        raise ValueError("The spectrum has no counts in the energy range of the library.")
+    return normalize(binned).astype(np.float32)
+
+
+def settings_from_config(config):
+    return {
+        "min_energy": config.getfloat("Settings", "library_min_energy"),
+        "max_energy": config.getfloat("Settings", "library_max_energy"),
+        "bins": config.getint("Settings", "library_bins"),
+    }
+
+
+class SpectrumLibrary:
+    def __init__(self, min_energy=30.0, max_energy=3000.0, bins=512, efficiency_curves=None):
+        self.min_energy = float(min_energy)
+        self.max_energy = float(max_energy)
+        self.bins = int(bins)
+        self.edges = library_edges(self.min_energy, self.max_energy, self.bins)
+        self.efficiency_curves = efficiency_curves or {}
+        self.entries = []
+        self.rows = {}
+        # Normalized vectors for the cosine, their square roots for the chi-square
+        self.vectors = np.zeros((0, self.bins), dtype=np.float32)
+        self.roots = np.zeros((0, self.bins), dtype=np.float32)
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.sums = np.zeros(0, dtype=np.float32)
+        self.modified = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _reserve(self, size):
+        capacity = len(self.vectors)
+        if size <= capacity:
+            return
+        capacity = max(capacity * 2, size, MIN_CAPACITY)
+        n = len(self.entries)
+        for name in ("vectors", "roots"):
+            grown = np.zeros((capacity, self.bins), dtype=np.float32)
+            grown[:n] = getattr(self, name)[:n]
+            setattr(self, name, grown)
+        for name in ("norms", "sums"):
+            grown = np.zeros(capacity, dtype=np.float32)
+            grown[:n] = getattr(self, name)[:n]
+            setattr(self, name, grown)
+
+    def vector(self, spectrum):
+        return library_vector(spectrum, self.edges, self.efficiency_curves)
+
+    def add(self, spectrum, path=""):
+        vector = self.vector(spectrum)
+        # A file that is added again replaces its row
+        row = self.rows.get(path) if path else None
+        if row is None:
+            row = len(self.entries)
+            self._reserve(row + 1)
+            self.entries.append(None)
+            if path:
+                self.rows[path] = row
+
+        self.vectors[row] = vector
+        self.roots[row] = np.sqrt(vector)
+        self.norms[row] = np.sqrt(np.dot(vector, vector))
+        self.sums[row] = vector.sum()
+        self.entries[row] = {
+            "path": path,
+            "sample_name": spectrum["sample_name"],
+            "device": spectrum.get("device") or "",
+            "serial_number": spectrum.get("serial_number") or "",
+            "start_time": spectrum.get("start_time") or "",
+            "seconds": float(spectrum.get("seconds") or 0),
+        }
+        self.modified = True
+        return row
+
+    def add_files(self, xml_files, include_channel_1023=False, overrides=None):
+        # Generator over (file, error), so the GUI can show progress
+        for xml_file in xml_files:
+            try:
+                self.add(parse_spectrum(xml_file, include_channel_1023, overrides), os.path.abspath(xml_file))
+                yield xml_file, None
+            except (ValueError, OSError) as e:
+                yield xml_file, str(e)
+
+    def query(self, spectrum, k=10, metric="cosine"):
+        # Every spectrum of the library is scored with one matrix vector product
+        n = len(self.entries)
+        if not n:
+            return []
+        vector = self.vector(spectrum)
+        if metric == "cosine":
+            norm = max(float(np.sqrt(np.dot(vector, vector))), 1e-12)
+            scores = (self.vectors[:n] @ vector) / np.maximum(self.norms[:n] * norm, 1e-12)
+            order = -scores
+        elif metric == "chi2":
+            # Sum of (a - b)^2 / (a + b) is close to 2 * sum of (sqrt(a) - sqrt(b))^2,
+            # which only needs the dot products of the square roots
+            scores = 2 * (vector.sum() + self.sums[:n] - 2 * (self.roots[:n] @ np.sqrt(vector)))
+            scores = np.maximum(scores, 0)
+            order = scores
+        else:
+            raise ValueError(f"Unknown metric {metric}.")
+
+        k = min(int(k), n)
+        best = np.argpartition(order, k - 1)[:k]
+        best = best[np.argsort(order[best], kind="stable")]
+        return [dict(self.entries[row], row=int(row), score=float(scores[row])) for row in best]
+
+    def save(self, path):
+        n = len(self.entries)
+        state = {
+            "library": {"min_energy": self.min_energy, "max_energy": self.max_energy, "bins": self.bins},
+            "entries": self.entries,
+        }
+        write_session(path, state, {"vectors": self.vectors[:n]})
+        self.modified = False
+
+    @classmethod
+    def load(cls, path, efficiency_curves=None):
+        # Read completely, the whole matrix is used by every query
+        state, arrays = read_session(path, memory_map=False)
+        if "library" not in state:
+            raise ValueError(f"{path} is not a spectrum library.")
+        library = cls(efficiency_curves=efficiency_curves, **state["library"])
+        vectors = arrays["vectors"]
+        if vectors.shape != (len(state["entries"]), library.bins):
+            raise ValueError(f"{path} is damaged.")
+
+        n = len(vectors)
+        library._reserve(n)
+        library.vectors[:n] = vectors
+        library.roots[:n] = np.sqrt(vectors)
+        library.norms[:n] = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))
+        library.sums[:n] = vectors.sum(axis=1)
+        library.entries = state["entries"]
+        library.rows = {entry["path"]: row for row, entry in enumerate(library.entries) if entry["path"]}
+        return library
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add RadiaCode spectra to a spectrum library or search it.")
+    parser.add_argument("library", help="library file, made if it doesn't exist")
+    parser.add_argument("files", nargs="*", help="RadiaCode XML files to add")
+    parser.add_argument("-q", "--query", help="RadiaCode XML file to find the most similar spectra of")
+    parser.add_argument("-k", type=int, default=10, help="number of results")
+    parser.add_argument("-m", "--metric", choices=METRICS, default="cosine")
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read("config.ini")
+    include_channel_1023 = config.getboolean("Settings", "include_channel_1023")
+    overrides = load_overrides(config)
+
+    if os.path.exists(args.library):
+        spectrum_library = SpectrumLibrary.load(args.library, load_curves(config))
+    else:
+        spectrum_library = SpectrumLibrary(efficiency_curves=load_curves(config), **settings_from_config(config))
+
+    for source, error in spectrum_library.add_files(args.files, include_channel_1023, overrides):
+        if error:
+            print(f"{source}: {error}")
+    if spectrum_library.modified:
+        spectrum_library.save(args.library)
+    print(f"{len(spectrum_library)} spectra in {args.library}")
+
+    if args.query:
+        results = spectrum_library.query(parse_spectrum(args.query, include_channel_1023, overrides), args.k,
+                                         args.metric)
+        for result in results:
+            print(f"{result['score']:10.4f}  {result['sample_name']}  {result['start_time']}  {result['path']}")
@@ -0,0 +1,111 @@
+import os.path
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+import numpy as np
+
+from rsv_diagnostics import check_coeffs, errors
+
+
+def get_device(serial_number):
+    if serial_number is not None and serial_number.startswith("RC"):
+        try:
+            if serial_number[6] == "G":
+                return "RC-103G"
+            return serial_number[:6]
+        except (Exception,):
+            return "Unknown"
+    return "Unknown"
+
+
+def parse_coeffs(element, device=None, part="spectrum", diagnostics=None):
+    # Warnings are collected in diagnostics, an error makes the spectrum unusable
+    try:
+        coeffs = [float(C.text) for C in element]
+    except (TypeError, ValueError):
+        raise ValueError(f"The {part} has no valid energy calibration.")
+    found = check_coeffs(coeffs, device, part)
+    if errors(found):
+        raise ValueError(errors(found)[0]["message"])
+    if diagnostics is not None:
+        diagnostics.extend(found)
+    return coeffs[:3]
+
+
+def read_counts(element, include_channel_1023=False, part="spectrum"):
+    # 4 bytes per channel instead of a list of python ints
+    try:
+        data_points = list(element) if include_channel_1023 else list(element)[:-1]
+        return np.fromiter((int(DP.text) for DP in data_points), dtype=np.uint32, count=len(data_points))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"The {part} has no valid channel data.")
+
+
+def parse_spectrum(xml_file, include_channel_1023=False, overrides=None, sample_name=None):
+    # xml_file can also be a file object, then sample_name names the spectrum
+    if sample_name is None:
+        sample_name = os.path.splitext(os.path.basename(xml_file))[0]
+    source = xml_file if isinstance(xml_file, (str, os.PathLike)) else sample_name
+    try:
+        root = ET.parse(xml_file).getroot()
+        result_data = root.find("ResultDataList/ResultData")
+        spectrum = result_data.find("EnergySpectrum")
+    except (Exception,):
+        raise ValueError(f"{source} is not a valid RadiaCode XML file.")
+    if spectrum is None:
+        raise ValueError(f"{source} is not a valid RadiaCode XML file, it has no energy spectrum.")
+
+    try:
+        serial_number = spectrum.find("SerialNumber").text
+    except (Exception,):
+        serial_number = None
+    device = get_device(serial_number)
+
+    diagnostics = []
+    coeffs = parse_coeffs(spectrum.find("EnergyCalibration/Coefficients"), device, "spectrum", diagnostics)
+    file_coeffs = coeffs.copy()
+    if overrides and serial_number and serial_number.lower() in overrides:
+        coeffs = list(overrides[serial_number.lower()])
+
+    data_points = read_counts(spectrum.find("Spectrum"), include_channel_1023)
+
+    bg_coeffs = None
+    bg_data_points = None
+    bg_seconds = None
+    background = result_data.find("BackgroundEnergySpectrum")
+    if background is not None:
+        bg_coeffs = parse_coeffs(background.find("EnergyCalibration/Coefficients"), device, "background",
+                                 diagnostics)
+        # A calibration override of the device also holds for its internal background
+        if coeffs != file_coeffs:
+            bg_coeffs = coeffs.copy()
+        bg_data_points = read_counts(background.find("Spectrum"), include_channel_1023, "background")
+        try:
+            bg_seconds = float(background.find("MeasurementTime").text)
+        except (Exception,):
+            bg_seconds = None
+
+    try:
+        start_time = result_data.find("StartTime").text[:19]
+        end_time = result_data.find("EndTime").text[:19]
+        duration = datetime.strptime(end_time, "%Y-%m-%dT%H:%M:%S") - \
+            datetime.strptime(start_time, "%Y-%m-%dT%H:%M:%S")
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError(f"{source} is not a valid RadiaCode XML file, it has no valid start and end time.")
+
+    return {
+        "sample_name": sample_name,
+        "serial_number": serial_number,
+        "device": device,
+        "coeffs": coeffs,
+        "file_coeffs": file_coeffs,
+        "data_points": data_points,
+        "seconds": duration.total_seconds(),
+        "duration": str(duration),
+        "start_time": start_time.replace("T", " "),
+        "end_time": end_time.replace("T", " "),
+        "bg_coeffs": bg_coeffs,
+        "bg_data_points": bg_data_points,
+        "bg_seconds": bg_seconds,
+        "diagnostics": diagnostics,
+    }
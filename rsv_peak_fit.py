@@ -0,0 +1,208 @@
+import numpy as np
+from numpy.linalg import LinAlgError
+
+from rsv_processing import channel_to_energy, kev_per_channel
+
+FWHM_FACTOR = 2 * np.sqrt(2 * np.log(2))
+SQRT_2PI = np.sqrt(2 * np.pi)
+
+RESULT_KEYS = ("channel", "channel_err", "energy", "energy_err", "fwhm", "fwhm_channels",
+               "net_counts", "net_counts_err", "cps", "reduced_chi2")
+
+
+def empty_result():
+    return {key: np.zeros(0) for key in RESULT_KEYS}
+
+
+def group_regions(centers, sigmas, n_channels, roi_sigmas=3.0, min_half_width=4, max_group_peaks=5):
+    half_widths = np.maximum(roi_sigmas * sigmas, min_half_width)
+    lows = np.clip(np.floor(centers - half_widths), 0, n_channels - 1).astype(int)
+    highs = np.clip(np.ceil(centers + half_widths), 0, n_channels - 1).astype(int)
+
+    # Peaks whose regions overlap end up in the same group and are fitted jointly,
+    # long chains of overlapping peaks are split so one linear baseline still fits
+    groups = []
+    for i in np.argsort(centers):
+        if groups and lows[i] <= groups[-1]["high"] and len(groups[-1]["peaks"]) < max_group_peaks:
+            groups[-1]["peaks"].append(i)
+            groups[-1]["high"] = max(groups[-1]["high"], highs[i])
+        else:
+            groups.append({"low": lows[i], "high": highs[i], "peaks": [i]})
+    return groups
+
+
+def _model(params, x, x0, peak_mask):
+    amp = params[:, 2::3]
+    mu = params[:, 3::3]
+    sigma = params[:, 4::3]
+    dx = x[:, None, :] - mu[:, :, None]
+    gauss = np.exp(-0.5 * (dx / sigma[:, :, None]) ** 2) * peak_mask[:, :, None]
+    baseline = params[:, [0]] + params[:, [1]] * (x - x0[:, None])
+    return baseline + np.einsum("gk,gkm->gm", amp, gauss), dx, gauss
+
+
+def _jacobian(params, x, x0, dx, gauss):
+    n_groups, n_points = x.shape
+    amp = params[:, 2::3, None]
+    sigma = params[:, 4::3, None]
+    jac = np.empty((n_groups, n_points, params.shape[1]))
+    jac[:, :, 0] = 1
+    jac[:, :, 1] = x - x0[:, None]
+    jac[:, :, 2::3] = gauss.transpose(0, 2, 1)
+    jac[:, :, 3::3] = (amp * gauss * dx / sigma ** 2).transpose(0, 2, 1)
+    jac[:, :, 4::3] = (amp * gauss * dx ** 2 / sigma ** 3).transpose(0, 2, 1)
+    return jac
+
+
+def _normal_equations(jac, weights, residuals, free):
+    weighted = jac * weights[:, :, None]
+    jtj = weighted.transpose(0, 2, 1) @ jac
+    jtr = np.einsum("gmp,gm->gp", weighted, residuals)
+    # Padding parameters of groups with fewer peaks have empty columns
+    idx = np.arange(jtj.shape[1])
+    jtj[:, idx, idx] = np.where(free, jtj[:, idx, idx], 1)
+    return jtj, jtr
+
+
+def _solve(matrix, vector):
+    try:
+        return np.linalg.solve(matrix, vector[..., None])[..., 0]
+    except LinAlgError:
+        return np.einsum("gpq,gq->gp", np.linalg.pinv(matrix), vector)
+
+
+def fit_peaks(counts, peak_channels, fwhm_channels, coeffs, time_seconds=0,
+              roi_sigmas=3.0, max_iterations=50, tolerance=1e-5):
+    counts = np.asarray(counts, dtype=float)
+    centers = np.asarray(peak_channels, dtype=float)
+    if centers.size == 0 or counts.size == 0:
+        return empty_result()
+
+    sigmas = np.maximum(np.asarray(fwhm_channels, dtype=float) / FWHM_FACTOR, 1.0)
+    groups = group_regions(centers, sigmas, counts.size, roi_sigmas)
+
+    n_groups = len(groups)
+    max_peaks = max(len(g["peaks"]) for g in groups)
+    n_points = max(g["high"] - g["low"] + 1 for g in groups)
+    n_params = 2 + 3 * max_peaks
+
+    x = np.zeros((n_groups, n_points))
+    y = np.zeros((n_groups, n_points))
+    weights = np.zeros((n_groups, n_points))
+    x0 = np.zeros(n_groups)
+    low = np.zeros(n_groups)
+    high = np.zeros(n_groups)
+    params = np.zeros((n_groups, n_params))
+    peak_mask = np.zeros((n_groups, max_peaks), dtype=bool)
+    peak_index = np.full((n_groups, max_peaks), -1)
+
+    for gi, group in enumerate(groups):
+        channels = np.arange(group["low"], group["high"] + 1)
+        m = channels.size
+        x[gi, :m] = channels
+        x[gi, m:] = channels[-1]
+        y[gi, :m] = counts[channels]
+        # Poisson weights, padded points don't contribute
+        weights[gi, :m] = 1 / np.maximum(counts[channels], 1)
+        x0[gi] = (group["low"] + group["high"]) / 2
+        low[gi] = group["low"]
+        high[gi] = group["high"]
+
+        left = counts[group["low"]]
+        right = counts[group["high"]]
+        slope = (right - left) / max(group["high"] - group["low"], 1)
+        params[gi, 0] = (left + right) / 2
+        params[gi, 1] = slope
+        for k, i in enumerate(group["peaks"]):
+            base = params[gi, 0] + slope * (centers[i] - x0[gi])
+            amp = max(counts[int(round(centers[i]))] - base, 1)
+            params[gi, 2 + 3 * k:5 + 3 * k] = amp, centers[i], sigmas[i]
+            peak_mask[gi, k] = True
+            peak_index[gi, k] = i
+        params[gi, 2 + 3 * len(group["peaks"])::3] = 0
+        params[gi, 3 + 3 * len(group["peaks"])::3] = x0[gi]
+        params[gi, 4 + 3 * len(group["peaks"])::3] = 1
+
+    free = np.ones((n_groups, n_params), dtype=bool)
+    free[:, 2:] = np.repeat(peak_mask, 3, axis=1)
+
+    model, dx, gauss = _model(params, x, x0, peak_mask)
+    chi2 = np.sum(weights * (y - model) ** 2, axis=1)
+    damping = np.full(n_groups, 1e-3)
+    active = np.ones(n_groups, dtype=bool)
+
+    # Levenberg-Marquardt on all groups at once, every group keeps its own damping
+    for _ in range(max_iterations):
+        jac = _jacobian(params, x, x0, dx, gauss)
+        jtj, jtr = _normal_equations(jac, weights, y - model, free)
+        diagonal = np.einsum("gpp->gp", jtj)
+        damped = jtj + damping[:, None, None] * np.einsum("gp,pq->gpq", np.maximum(diagonal, 1e-12),
+                                                          np.eye(n_params))
+        step = _solve(damped, jtr)
+        step[~active] = 0
+        step[~free] = 0
+
+        trial = params + step
+        trial[:, 2::3] = np.maximum(trial[:, 2::3], 0)
+        trial[:, 3::3] = np.clip(trial[:, 3::3], low[:, None], high[:, None])
+        trial[:, 4::3] = np.clip(trial[:, 4::3], 0.5, np.maximum(high - low, 1)[:, None])
+
+        trial_model, trial_dx, trial_gauss = _model(trial, x, x0, peak_mask)
+        trial_chi2 = np.sum(weights * (y - trial_model) ** 2, axis=1)
+
+        improved = active & (trial_chi2 < chi2)
+        change = (chi2 - trial_chi2) / np.maximum(chi2, 1e-12)
+        params[improved] = trial[improved]
+        model[improved] = trial_model[improved]
+        dx[improved] = trial_dx[improved]
+        gauss[improved] = trial_gauss[improved]
+        chi2[improved] = trial_chi2[improved]
+
+        damping = np.where(improved, np.maximum(damping / 10, 1e-10), damping * 10)
+        active &= ~((improved & (change < tolerance)) | (damping > 1e6))
+        if not active.any():
+            break
+
+    jac = _jacobian(params, x, x0, dx, gauss)
+    jtj, _ = _normal_equations(jac, weights, y - model, free)
+    try:
+        covariance = np.linalg.inv(jtj)
+    except LinAlgError:
+        covariance = np.linalg.pinv(jtj)
+
+    dof = np.maximum(np.sum(weights > 0, axis=1) - np.sum(free, axis=1), 1)
+    reduced_chi2 = chi2 / dof
+    covariance *= np.maximum(reduced_chi2, 1)[:, None, None]
+
+    amp = params[:, 2::3][peak_mask]
+    mu = params[:, 3::3][peak_mask]
+    sigma = params[:, 4::3][peak_mask]
+    variances = np.einsum("gpp->gp", covariance)
+    amp_var = variances[:, 2::3][peak_mask]
+    mu_var = variances[:, 3::3][peak_mask]
+    sigma_var = variances[:, 4::3][peak_mask]
+    amp_sigma_cov = covariance[:, 2::3, 4::3].diagonal(axis1=1, axis2=2)[peak_mask]
+
+    net_counts = amp * sigma * SQRT_2PI
+    net_counts_var = 2 * np.pi * (sigma ** 2 * amp_var + amp ** 2 * sigma_var + 2 * amp * sigma * amp_sigma_cov)
+    net_counts_err = np.sqrt(np.maximum(net_counts_var, 0))
+
+    slope = kev_per_channel(mu, coeffs)
+    energy = channel_to_energy(mu, coeffs)
+    mu_err = np.sqrt(np.maximum(mu_var, 0))
+    fwhm_channels = FWHM_FACTOR * sigma
+
+    order = np.argsort(peak_index[peak_mask])
+    result = {
+        "channel": mu,
+        "channel_err": mu_err,
+        "energy": energy,
+        "energy_err": np.abs(slope) * mu_err,
+        "fwhm": np.abs(slope) * fwhm_channels,
+        "fwhm_channels": fwhm_channels,
+        "net_counts": net_counts,
+        "net_counts_err": net_counts_err,
+        "cps": net_counts / time_seconds if time_seconds else np.zeros_like(net_counts),
+        "reduced_chi2": np.broadcast_to(reduced_chi2[:, None], peak_mask.shape)[peak_mask],
+    }
+    return {key: value[order] for key, value in result.items()}
@@ -0,0 +1,111 @@
+import numpy as np
+from scipy.signal import find_peaks, peak_widths
+
+from rsv_dose import dose_rate, load_functions as load_dose_functions, model_for_device as dose_model_for_device
+from rsv_efficiency import compensate_counts, curve_diagnostics, load_curves, model_for_device
+from rsv_peak_fit import fit_peaks
+from rsv_processing import energy_axis, normalize, parse_fwhm_model, smooth, snip_continuum
+
+
+def load_settings(config):
+    return {
+        "low_smooth": config.getint("Settings", "low_smooth_slider_default"),
+        "high_smooth": config.getint("Settings", "high_smooth_slider_default"),
+        "smoothing_filter": config.get("Dynamic", "smoothing_filter"),
+        "smoothing_fwhm_model": parse_fwhm_model(config.get("Settings", "smoothing_fwhm_model")),
+        "min_height": config.getint("Settings", "height_slider_default"),
+        "prominence": config.getint("Settings", "prominence_slider_default"),
+        "distance": config.getint("Settings", "distance_slider_default"),
+        "background": config.get("Settings", "batch_background"),
+        "snip_peak_detection": config.getboolean("Dynamic", "snip_peak_detection"),
+        "snip_iterations": config.getint("Settings", "snip_iterations"),
+        "snip_fwhm_662_percent": config.getfloat("Settings", "snip_fwhm_662_percent"),
+        "efficiency_curves": load_curves(config),
+        "dose_functions": load_dose_functions(config),
+        "dose_cps_per_usvh": config.getfloat("Settings", "dose_cps_per_usvh"),
+    }
+
+
+def detect_peak_indices(data, min_height, prominence, distance):
+    peaks, _ = find_peaks(data, height=min_height / 100, prominence=prominence / 100, distance=int(distance))
+    return peaks
+
+
+def background_peak_flags(peak_energies, bg_peak_energies, fwhm_662_percent):
+    # A peak is a background line if a background peak lies within half the detector FWHM at its energy
+    peak_energies = np.asarray(peak_energies, dtype=float)
+    bg_peak_energies = np.sort(np.asarray(bg_peak_energies, dtype=float))
+    if not peak_energies.size or not bg_peak_energies.size:
+        return np.zeros(peak_energies.size, dtype=bool)
+
+    # Nearest background peak on either side of every peak
+    right = np.clip(np.searchsorted(bg_peak_energies, peak_energies), 0, bg_peak_energies.size - 1)
+    left = np.maximum(right - 1, 0)
+    distance = np.minimum(np.abs(bg_peak_energies[left] - peak_energies),
+                          np.abs(bg_peak_energies[right] - peak_energies))
+    tolerance = 0.5 * fwhm_662_percent / 100 * np.sqrt(662 * np.maximum(peak_energies, 1))
+    return distance <= tolerance
+
+
+def process_spectrum(spectrum, settings):
+    counts = np.asarray(spectrum["data_points"], dtype=float)
+    coeffs = spectrum["coeffs"]
+    energies = energy_axis(coeffs, counts.size)
+    model = model_for_device(settings["efficiency_curves"], spectrum.get("device"))
+
+    def smoothed_of(values):
+        return smooth(energies, values, settings["low_smooth"], settings["high_smooth"], settings["smoothing_filter"],
+                      coeffs, settings["smoothing_fwhm_model"])
+
+    compensated = compensate_counts(counts, coeffs, model)
+    smoothed = smoothed_of(compensated)
+    normalized = normalize(smoothed)
+    series = {
+        "energy": energies,
+        "counts": counts,
+        "compensated": compensated,
+        "smoothed": smoothed,
+        "normalized": normalized,
+    }
+
+    bg_data_points = spectrum.get("bg_data_points")
+    background = settings["background"]
+    if background == "auto":
+        background = "included" if bg_data_points is not None else "none"
+    if background == "included" and (bg_data_points is None or len(bg_data_points) != counts.size):
+        background = "none"
+
+    net = None
+    if background == "snip":
+        continuum = snip_continuum(counts, coeffs, settings["snip_iterations"], settings["snip_fwhm_662_percent"])
+        net = np.maximum(counts - continuum, 0)
+    elif background == "included":
+        # Same as the background subtraction in the viewer, both spectra are normalized first
+        net = np.maximum(normalize(counts) - normalize(bg_data_points), 0)
+
+    if net is not None and net.max() > 0:
+        net = net / net.max()
+        series["net"] = net
+        series["net_compensated"] = normalize(smoothed_of(compensate_counts(net, coeffs, model)))
+    else:
+        background = "none"
+
+    peak_source = normalized
+    if settings["snip_peak_detection"]:
+        continuum = snip_continuum(counts, coeffs, settings["snip_iterations"], settings["snip_fwhm_662_percent"])
+        net_counts = np.maximum(counts - continuum, 0)
+        peak_source = normalize(smoothed_of(compensate_counts(net_counts, coeffs, model)))
+
+    peaks = detect_peak_indices(peak_source, settings["min_height"], settings["prominence"], settings["distance"])
+    widths = peak_widths(peak_source, peaks, rel_height=0.5)[0] if peaks.size else []
+
+    return {
+        "series": series,
+        "peak_indices": peaks,
+        "peaks": fit_peaks(counts, peaks, widths, coeffs, spectrum["seconds"]),
+        "background": background,
+        "dose_rate": float(dose_rate(counts, spectrum["seconds"], coeffs,
+                                     dose_model_for_device(settings["dose_functions"], spectrum.get("device")),
+                                     settings["dose_cps_per_usvh"])),
+        "diagnostics": curve_diagnostics(settings["efficiency_curves"], spectrum.get("device")),
+    }
@@ -0,0 +1,216 @@
+from functools import lru_cache
+
+import numpy as np
+
+SMOOTHING_FILTERS = {"boxcar": "Boxcar", "gaussian": "Gaussian", "savgol": "Savitzky-Golay"}
+# FWHM in keV = sqrt(c0 + c1 * E + c2 * E^2), about 8 % at 662 keV
+DEFAULT_FWHM_MODEL = (0.0, 4.24, 0.0)
+
+@lru_cache(maxsize=64)
+def _energy_axis(coeffs, n_channels):
+    energies = np.polynomial.polynomial.polyval(np.arange(n_channels, dtype=float), coeffs)
+    energies.setflags(write=False)
+    return energies
+
+
+def energy_axis(coeffs, n_channels):
+    return _energy_axis(tuple(float(c) for c in coeffs), int(n_channels))
+
+
+def channel_to_energy(channels, coeffs):
+    return np.polynomial.polynomial.polyval(channels, coeffs)
+
+
+def nearest_channel(energies, energy):
+    # Energies are increasing, binary search for the channel closest to the energy
+    right = min(int(np.searchsorted(energies, energy)), len(energies) - 1)
+    if right > 0 and energy - energies[right - 1] < energies[right] - energy:
+        return right - 1
+    return right
+
+
+def kev_per_channel(channels, coeffs):
+    return np.polynomial.polynomial.polyval(channels, np.polynomial.polynomial.polyder(coeffs))
+
+
+def efficiency(energies):
+    energies = np.asarray(energies, dtype=float)
+    if energies[0] <= 0:
+        energies = energies + abs(energies[0]) + 0.1
+    log_e = np.log(energies / 1000)
+    return np.exp(-4.09527
+                  - 2.34638 * log_e
+                  + 0.228436 * log_e ** 2
+                  + 0.31551 * log_e ** 3
+                  + 0.0383176 * log_e ** 4)
+
+
+def compensate(energies, data_points):
+    return np.asarray(data_points, dtype=float) / efficiency(energies)
+
+
+def smoothing_half_windows(energies, low_smooth, high_smooth):
+    # The window grows linearly with the energy, from the low to the high smoothing slider
+    energies = np.asarray(energies, dtype=float)
+    normalized_energy = (energies - energies.min()) / (energies.max() - energies.min())
+    return (low_smooth + (high_smooth - low_smooth) * normalized_energy).astype(int) // 2
+
+
+def window_sums(data, half_windows):
+    # Sum over every channel plus and minus its half window, from prefix sums
+    data = np.asarray(data, dtype=float)
+    n = data.size
+    channels = np.arange(n)
+    start = np.maximum(channels - half_windows, 0)
+    end = np.minimum(channels + half_windows + 1, n)
+    cumulative = np.concatenate(([0.0], np.cumsum(data)))
+    return cumulative[end] - cumulative[start], end - start
+
+
+def parse_fwhm_model(text):
+    try:
+        model = tuple(float(c) for c in text.split(","))
+    except ValueError:
+        raise ValueError(f"FWHM model {text} is not a list of numbers.")
+    if len(model) != 3:
+        raise ValueError(f"FWHM model {text} needs 3 coefficients.")
+    return model
+
+
+def model_fwhm(energies, fwhm_model):
+    energies = np.asarray(energies, dtype=float)
+    return np.sqrt(np.maximum(np.polynomial.polynomial.polyval(energies, fwhm_model), 0))
+
+
+@lru_cache(maxsize=16)
+def _gaussian_operator(coeffs, n_channels, low_smooth, high_smooth, fwhm_model):
+    # Only imported here, the sum workers import this module and start faster without it
+    from scipy.sparse import csr_matrix
+
+    # Kernel FWHM in channels follows the detector resolution, the high smoothing slider is the FWHM at
+    # the widest point of the spectrum and the low one the smallest FWHM
+    channels = np.arange(n_channels)
+    shape = model_fwhm(energy_axis(coeffs, n_channels), fwhm_model)
+    shape = shape / np.maximum(np.abs(kev_per_channel(channels, coeffs)), 1e-6)
+    fwhm = np.maximum(high_smooth * shape / max(shape.max(), 1e-12), low_smooth)
+    sigma = fwhm / (2 * np.sqrt(2 * np.log(2)))
+
+    # Banded, every row reaches 3 sigma and is normalized, so rows cut at the spectrum edges keep the level
+    reach = np.ceil(3 * sigma).astype(int)
+    offsets = np.arange(-reach.max(), reach.max() + 1)
+    columns = channels[:, None] + offsets
+    inside = (np.abs(offsets) <= reach[:, None]) & (columns >= 0) & (columns < n_channels)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = np.exp(-0.5 * (offsets / sigma[:, None]) ** 2)
+    weights = np.where(sigma[:, None] > 0, weights, offsets == 0)
+    weights = np.where(inside, weights, 0)
+    weights /= weights.sum(axis=1, keepdims=True)
+    rows = np.broadcast_to(channels[:, None], columns.shape)
+    return csr_matrix((weights[inside], (rows[inside], columns[inside])), shape=(n_channels, n_channels))
+
+
+def gaussian_operator(coeffs, n_channels, low_smooth, high_smooth, fwhm_model=DEFAULT_FWHM_MODEL):
+    return _gaussian_operator(tuple(float(c) for c in coeffs), int(n_channels), float(low_smooth),
+                              float(high_smooth), tuple(float(c) for c in fwhm_model))
+
+
+def savgol(data, half_windows):
+    # Quadratic Savitzky-Golay with its own window per channel, from prefix sums of the data and of its
+    # first and second moments. Windows are made symmetric at the spectrum edges
+    data = np.asarray(data, dtype=float)
+    n = data.size
+    channels = np.arange(n)
+    m = np.minimum(half_windows, np.minimum(channels, n - 1 - channels))
+    start = channels - m
+    end = channels + m + 1
+
+    # Positions around the middle of the spectrum keep the moments small
+    position = (channels - n // 2).astype(float)
+    sums = []
+    for moment in (data, position * data, position ** 2 * data):
+        cumulative = np.concatenate(([0.0], np.cumsum(moment)))
+        sums.append(cumulative[end] - cumulative[start])
+    center = channels - n // 2
+    # Sum of k^2 * y with k the distance to the channel
+    s0, s2 = sums[0], sums[2] - 2 * center * sums[1] + center ** 2 * sums[0]
+    m = m.astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fitted = (3 * (3 * m ** 2 + 3 * m - 1) * s0 - 15 * s2) / ((4 * m ** 2 - 1) * (2 * m + 3))
+    return np.where(m > 0, fitted, data)
+
+
+def smooth(energies, data, low_smooth, high_smooth, method="boxcar", coeffs=None, fwhm_model=DEFAULT_FWHM_MODEL):
+    if method == "gaussian":
+        if coeffs is None:
+            raise ValueError("Gaussian smoothing needs the calibration coefficients.")
+        data = np.asarray(data, dtype=float)
+        return gaussian_operator(coeffs, data.size, low_smooth, high_smooth, fwhm_model) @ data
+    half_windows = smoothing_half_windows(energies, low_smooth, high_smooth)
+    if method == "savgol":
+        return savgol(data, half_windows)
+    if method != "boxcar":
+        raise ValueError(f"Unknown smoothing filter {method}.")
+    # Moving average whose window grows linearly with the energy
+    sums, widths = window_sums(data, half_windows)
+    return sums / widths
+
+
+def normalize(data):
+    data = np.asarray(data, dtype=float)
+    min_data = data.min()
+    return (data - min_data) / (data.max() - min_data)
+
+
+def fwhm_channels(coeffs, n_channels, fwhm_662_percent):
+    energies = energy_axis(coeffs, n_channels)
+    # Scintillator resolution scales roughly with the square root of the energy
+    fwhm_kev = fwhm_662_percent / 100 * np.sqrt(662 * np.maximum(energies, 1))
+    return fwhm_kev / np.maximum(np.abs(kev_per_channel(np.arange(n_channels), coeffs)), 1e-6)
+
+
+@lru_cache(maxsize=32)
+def _snip_continuum(counts_bytes, coeffs, iterations, fwhm_662_percent):
+    counts = np.frombuffer(counts_bytes, dtype=float)
+    n = counts.size
+    channels = np.arange(n)
+
+    # Log-log-sqrt transform, the clipping works on a compressed dynamic range
+    v = np.log(np.log(np.sqrt(np.maximum(counts, 0) + 1) + 1) + 1)
+
+    windows = np.clip(np.rint(fwhm_channels(coeffs, n, fwhm_662_percent)), 1, iterations).astype(int)
+    windows = np.minimum(windows, np.minimum(channels, n - 1 - channels))
+
+    for p in range(1, iterations + 1):
+        k = np.minimum(windows, p)
+        mean = (v[channels - k] + v[channels + k]) / 2
+        v = np.minimum(v, mean)
+
+    continuum = (np.exp(np.exp(v) - 1) - 1) ** 2 - 1
+    continuum = np.minimum(np.maximum(continuum, 0), np.maximum(counts, 0))
+    continuum.setflags(write=False)
+    return continuum
+
+
+def snip_continuum(counts, coeffs, iterations, fwhm_662_percent=8.0):
+    counts = np.ascontiguousarray(counts, dtype=float)
+    return _snip_continuum(counts.tobytes(), tuple(float(c) for c in coeffs), int(iterations),
+                           float(fwhm_662_percent))
+
+
+def currie_limits(counts, background, half_windows, background_ratio=0.0, k=1.645):
+    # Currie critical level and detection limit of the net counts in a window around every channel.
+    # background is expected in the live time of counts, background_ratio is the live time of counts
+    # over the one of the background, 0 for a background estimated from the spectrum itself
+    gross, _ = window_sums(counts, half_windows)
+    blank, _ = window_sums(background, half_windows)
+    net = gross - blank
+    critical = k * np.sqrt(np.maximum(blank, 0) * (1 + background_ratio))
+    return {
+        "gross": gross,
+        "background": blank,
+        "net": net,
+        "critical": critical,
+        "detection": k ** 2 + 2 * critical,
+        # Net counts in standard deviations of the net counts
+        "significance": net / np.sqrt(np.maximum(gross + background_ratio * blank, 1)),
+    }
@@ -0,0 +1,171 @@
+import argparse
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from configparser import ConfigParser
+
+from rsv_calibration import load_overrides
+from rsv_parser import parse_spectrum
+from rsv_pipeline import load_settings, process_spectrum
+from rsv_processing import normalize
+from rsv_theme import plot_palette
+
+RENDER_FORMATS = {
+    "png": ".png",
+    "svg": ".svg",
+}
+# Renders submitted per worker ahead of the one that is shown, a cancel only waits for these
+IN_FLIGHT_PER_WORKER = 2
+
+_app = None
+
+
+def _init_worker():
+    # Every worker renders without a display, the platform has to be set before the QApplication exists
+    global _app
+    os.environ["QT_QPA_PLATFORM"] = "offscreen"
+    from PySide6.QtWidgets import QApplication
+    _app = QApplication.instance() or QApplication([])
+
+
+def load_render_options(config, theme, black_on_white, width, height):
+    return {
+        "palette": plot_palette(config, theme, black_on_white),
+        "settings": load_settings(config),
+        "overrides": load_overrides(config),
+        "include_channel_1023": config.getboolean("Settings", "include_channel_1023"),
+        "show_original_plot": config.getboolean("Settings", "show_original_plot"),
+        "show_compensated_plot": config.getboolean("Settings", "show_compensated_plot"),
+        "peak_detection": config.getboolean("Dynamic", "activate_peak_detection"),
+        "line_width": config.getint("Settings", "plt_line_width"),
+        "annotation_line_width": config.getint("Settings", "plt_annotation_line_width"),
+        "max_title_length": config.getint("Settings", "max_plot_title_length"),
+        "width": width,
+        "height": height,
+    }
+
+
+def render_spectrum(xml_file, output_dir, render_format, options):
+    import pyqtgraph as pg
+    import pyqtgraph.exporters
+    from PySide6.QtCore import Qt
+
+    spectrum = parse_spectrum(xml_file, options["include_channel_1023"], options["overrides"])
+    processed = process_spectrum(spectrum, options["settings"])
+    series = processed["series"]
+    energies = series["energy"]
+    palette = options["palette"]
+
+    plot = pg.PlotWidget()
+    plot.resize(options["width"], options["height"])
+    plot.setBackground(palette["bg"])
+    plot.setTitle(spectrum["sample_name"][:options["max_title_length"]], color=palette["title"])
+    plot.setLabel("left", "Normalized Data", color=palette["y_label"])
+    plot.setLabel("bottom", "Energy (keV)", color=palette["x_label"])
+    plot.showGrid(x=True, y=True, alpha=0.4)
+
+    original_normalized = normalize(series["counts"])
+    if options["show_original_plot"]:
+        plot.plot(energies, original_normalized, pen=pg.mkPen(color=palette["original"], width=options["line_width"]))
+    if options["show_compensated_plot"]:
+        plot.plot(energies, series["normalized"],
+                  pen=pg.mkPen(color=palette["compensated"], width=options["line_width"]))
+
+    if options["peak_detection"]:
+        peak_values = series["normalized"] if options["show_compensated_plot"] else original_normalized
+        for index in processed["peak_indices"]:
+            peak_energy = round(float(energies[index]), 1)
+            line = pg.PlotDataItem([peak_energy, peak_energy], [peak_values[index], 1.1],
+                                   pen=pg.mkPen(color=palette["annotation_line"],
+                                                width=options["annotation_line_width"]))
+            plot.addItem(line)
+            text = pg.TextItem(f"{peak_energy}", anchor=(0.5, 0.5), color=palette["annotation_text"],
+                               fill=palette["annotation_bg"], border=palette["annotation_text"])
+            text.setPos(peak_energy, 1.1)
+            plot.addItem(text)
+
+    # Laid out like a shown widget, otherwise the scene keeps the default size and text bounds
+    plot.setAttribute(Qt.WidgetAttribute.WA_DontShowOnScreen)
+    plot.show()
+    _app.processEvents()
+
+    path = os.path.join(output_dir, spectrum["sample_name"] + RENDER_FORMATS[render_format])
+    if render_format == "svg":
+        # pyqtgraph's SVGExporter can't parse the path data of current Qt versions, Qt writes the SVG itself
+        from PySide6.QtCore import QRect, QSize
+        from PySide6.QtGui import QPainter
+        from PySide6.QtSvg import QSvgGenerator
+
+        generator = QSvgGenerator()
+        generator.setFileName(path)
+        generator.setSize(QSize(options["width"], options["height"]))
+        generator.setViewBox(QRect(0, 0, options["width"], options["height"]))
+        generator.setTitle(spectrum["sample_name"])
+        painter = QPainter(generator)
+        plot.render(painter)
+        painter.end()
+    else:
+        exporter = pg.exporters.ImageExporter(plot.plotItem)
+        exporter.parameters()["width"] = options["width"]
+        exporter.export(path)
+    plot.close()
+    plot.deleteLater()
+    return path
+
+
+def _render_task(task):
+    xml_file, output_dir, render_format, options = task
+    try:
+        return xml_file, render_spectrum(xml_file, output_dir, render_format, options), None
+    except (ValueError, OSError) as e:
+        return xml_file, None, str(e)
+    except Exception as e:
+        # Reported like an unreadable file, the other files of the batch are still rendered
+        return xml_file, None, f"{type(e).__name__}: {e}"
+
+
+def render_files(xml_files, output_dir, render_format, options, workers=None):
+    # Generator over (file, image, error) in the order of the files. Tasks are submitted as the results are
+    # taken, so closing the generator early doesn't render the rest of the files first
+    workers = workers or os.cpu_count() or 1
+    # Spawned workers, forking a process that already has a QApplication is not safe
+    context = multiprocessing.get_context("spawn")
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker)
+    pending = deque()
+    try:
+        for xml_file in xml_files:
+            pending.append(executor.submit(_render_task, (xml_file, output_dir, render_format, options)))
+            if len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render RadiaCode spectra to image files without a display.")
+    parser.add_argument("files", nargs="+", help="RadiaCode XML files")
+    parser.add_argument("-f", "--format", choices=RENDER_FORMATS, default="png")
+    parser.add_argument("-o", "--output", default=".", help="output directory")
+    parser.add_argument("-W", "--width", type=int, default=1600)
+    parser.add_argument("-H", "--height", type=int, default=900)
+    parser.add_argument("-t", "--theme", choices=["light", "dark"], default=None)
+    parser.add_argument("-b", "--black-on-white", action="store_true")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read("config.ini")
+    os.makedirs(args.output, exist_ok=True)
+
+    theme = args.theme or config.get("Dynamic", "theme")
+    black_on_white = args.black_on_white or config.getboolean("Dynamic", "show_black_on_white_plot")
+    render_options = load_render_options(config, theme, black_on_white, args.width, args.height)
+
+    for source, target, error in render_files(args.files, args.output, args.format, render_options, args.workers):
+        if error:
+            print(f"{source}: {error}")
+        else:
+            print(f"{source} -> {target}")
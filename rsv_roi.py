@@ -0,0 +1,64 @@
+import numpy as np
+
+
+def prefix_sums(values):
+    # With a leading 0, the sum over the channels first..last is prefix[last + 1] - prefix[first]
+    prefix = np.concatenate(([0.0], np.cumsum(np.asarray(values, dtype=float))))
+    prefix.setflags(write=False)
+    return prefix
+
+
+class RoiIndex:
+    def __init__(self, energies, counts, seconds, background=None, bg_seconds=None, edge_channels=3):
+        # Built once per spectrum and background, every ROI after that is a few lookups, whatever its width
+        self.energies = np.asarray(energies, dtype=float)
+        self.counts = prefix_sums(counts)
+        self.seconds = seconds
+        self.edge_channels = max(int(edge_channels), 1)
+        self.background = None
+        if background is not None and len(background) == len(counts):
+            # In the live time of the spectrum, a continuum of the spectrum itself has no live time of its own
+            scale = seconds / bg_seconds if bg_seconds else 1.0
+            self.background = prefix_sums(np.asarray(background, dtype=float) * scale)
+
+    def channels(self, low_energy, high_energy):
+        # First and last channel with the energy in the window
+        n = self.energies.size
+        low_energy, high_energy = sorted((low_energy, high_energy))
+        first = min(int(np.searchsorted(self.energies, low_energy, side="left")), n - 1)
+        last = min(max(int(np.searchsorted(self.energies, high_energy, side="right")) - 1, first), n - 1)
+        return first, last
+
+    def integrate(self, low_energy, high_energy):
+        first, last = self.channels(low_energy, high_energy)
+        n_channels = last - first + 1
+
+        def window(prefix, start, end):
+            return float(prefix[end + 1] - prefix[start])
+
+        gross = window(self.counts, first, last)
+        # Linear continuum under the peak, from the mean counts of a few channels at both ends of the window
+        edge = max(min(self.edge_channels, n_channels // 2), 1)
+        left = window(self.counts, first, first + edge - 1) / edge
+        right = window(self.counts, last - edge + 1, last) / edge
+        net = gross - n_channels * (left + right) / 2
+
+        background = None if self.background is None else window(self.background, first, last)
+        subtracted = None if background is None else gross - background
+
+        def rate(counts):
+            return None if counts is None or not self.seconds else counts / self.seconds
+
+        return {
+            "first_channel": first,
+            "last_channel": last,
+            "low_energy": float(self.energies[first]),
+            "high_energy": float(self.energies[last]),
+            "gross": gross,
+            "net": net,
+            "background": background,
+            "subtracted": subtracted,
+            "gross_cps": rate(gross),
+            "net_cps": rate(net),
+            "subtracted_cps": rate(subtracted),
+        }
@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import signal
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from configparser import ConfigParser
+from urllib.parse import parse_qsl, urlsplit
+
+from rsv_calibration import load_overrides
+from rsv_export import METADATA_KEYS, PEAK_COLUMNS, metadata, series_names
+from rsv_parser import parse_spectrum
+from rsv_pipeline import load_settings, process_spectrum
+
+# Settings a request can change, with the query string or the "settings" of a JSON body
+REQUEST_SETTINGS = ("low_smooth", "high_smooth", "smoothing_filter", "min_height", "prominence", "distance",
+                    "background", "snip_peak_detection")
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 64 * 1024 * 1024
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _parse_task(source, sample_name, include_channel_1023, overrides):
+    # Uploads come as bytes, everything else is a path
+    if isinstance(source, bytes):
+        return parse_spectrum(io.BytesIO(source), include_channel_1023, overrides, sample_name)
+    return parse_spectrum(source, include_channel_1023, overrides)
+
+
+def _process_task(spectrum, settings, names):
+    # The JSON is made in the worker too, for big spectra it takes longer than the processing
+    processed = process_spectrum(spectrum, settings)
+    names = [name for name in series_names(processed) if names is None or name in names]
+    document = {
+        "metadata": metadata(spectrum, processed),
+        "diagnostics": spectrum.get("diagnostics", []) + processed["diagnostics"],
+        "series": {name: processed["series"][name].tolist() for name in names},
+        "peaks": {key: processed["peaks"][key].tolist() for key in PEAK_COLUMNS},
+    }
+    return json.dumps(document).encode("utf8")
+
+
+def setting_value(default, value):
+    # Query string values are text, JSON values already have a type
+    if isinstance(default, bool):
+        if isinstance(value, str):
+            return value.lower() in ("1", "true", "yes", "on")
+        return bool(value)
+    try:
+        return type(default)(value)
+    except (TypeError, ValueError):
+        raise RequestError(400, f"Invalid value {value!r} of a setting.")
+
+
+class AnalysisService:
+    def __init__(self, config, workers=None, cache_size=64):
+        self.settings = load_settings(config)
+        self.include_channel_1023 = config.getboolean("Settings", "include_channel_1023")
+        self.overrides = load_overrides(config)
+        self.cache_size = max(int(cache_size), 1)
+        # Parsed spectra, the least recently used one is dropped first. A spectrum that is still being parsed
+        # is in the cache as well, so requests for the same file at the same time parse it once
+        self.spectra = OrderedDict()
+        # Spawned workers, forking a process that already has a QApplication is not safe
+        context = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(max_workers=workers or None, mp_context=context)
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def spectrum_key(self, path=None, data=None):
+        if data is not None:
+            return hashlib.sha1(data).hexdigest()
+        # A file that is changed gets a new key
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            raise RequestError(404, str(e))
+        return hashlib.sha1(f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}".encode("utf8")).hexdigest()
+
+    async def spectrum(self, path=None, data=None, sample_name="upload", key=None):
+        if key is not None:
+            if key not in self.spectra:
+                raise RequestError(404, f"No spectrum with key {key}.")
+        else:
+            key = self.spectrum_key(path, data)
+
+        if key not in self.spectra:
+            loop = asyncio.get_running_loop()
+            self.spectra[key] = loop.run_in_executor(self.executor, _parse_task, path if data is None else data,
+                                                     sample_name, self.include_channel_1023, self.overrides)
+            while len(self.spectra) > self.cache_size:
+                self.spectra.popitem(last=False)
+        self.spectra.move_to_end(key)
+
+        future = self.spectra[key]
+        try:
+            return key, await asyncio.shield(future)
+        except Exception as e:
+            # Not cached, the file might be fixed
+            if self.spectra.get(key) is future:
+                del self.spectra[key]
+            if isinstance(e, (ValueError, OSError)):
+                raise RequestError(400, str(e))
+            raise
+
+    def request_settings(self, values):
+        settings = dict(self.settings)
+        for name, value in values.items():
+            if name in REQUEST_SETTINGS:
+                settings[name] = setting_value(self.settings[name], value)
+        return settings
+
+    async def source(self, request):
+        # A RadiaCode XML file as the body, or JSON with the path of one or the key of a cached spectrum
+        query = request["query"]
+        if request["content_type"] == "application/json":
+            try:
+                body = json.loads(request["body"] or b"{}")
+            except ValueError:
+                raise RequestError(400, "The body is no valid JSON.")
+            if not isinstance(body, dict):
+                raise RequestError(400, "The body has to be a JSON object.")
+            if not isinstance(body.get("settings", {}), dict):
+                raise RequestError(400, "The settings have to be a JSON object.")
+            query = dict(query, **body.get("settings", {}))
+            if "series" in body:
+                query["series"] = body["series"]
+            if "key" in body:
+                key, spectrum = await self.spectrum(key=str(body["key"]))
+            elif "path" in body:
+                key, spectrum = await self.spectrum(path=str(body["path"]))
+            else:
+                raise RequestError(400, "The JSON body needs a path or a key.")
+        elif request["body"]:
+            key, spectrum = await self.spectrum(data=request["body"], sample_name=query.get("name", "upload"))
+        elif "path" in query:
+            key, spectrum = await self.spectrum(path=query["path"])
+        elif "key" in query:
+            key, spectrum = await self.spectrum(key=query["key"])
+        else:
+            raise RequestError(400, "No spectrum in the request.")
+        return key, spectrum, query
+
+    async def handle(self, request):
+        method, path = request["method"], request["path"]
+        if path == "/health":
+            return {"status": "ok", "cached_spectra": len(self.spectra)}
+        if path not in ("/spectra", "/process"):
+            raise RequestError(404, f"Unknown path {path}.")
+        if method != "POST":
+            raise RequestError(405, f"{path} only takes POST requests.")
+
+        key, spectrum, query = await self.source(request)
+        if path == "/spectra":
+            data = {name: spectrum.get(name) for name in METADATA_KEYS}
+            return {"key": key, "metadata": data, "diagnostics": spectrum.get("diagnostics", [])}
+
+        names = query.get("series")
+        if isinstance(names, str):
+            names = names.split(",")
+        loop = asyncio.get_running_loop()
+        try:
+            body = await loop.run_in_executor(self.executor, _process_task, spectrum,
+                                              self.request_settings(query), names)
+        except (ValueError, OSError, RuntimeError) as e:
+            raise RequestError(400, str(e))
+        # Already JSON, with the key of the spectrum put in front
+        return b'{"key": ' + json.dumps(key).encode("utf8") + b", " + body[1:]
+
+    async def serve_client(self, reader, writer):
+        # Keep-alive connection, requests are answered one after the other
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except RequestError as e:
+                    await write_response(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                try:
+                    status, body = 200, await self.handle(request)
+                except RequestError as e:
+                    status, body = e.status, {"error": str(e)}
+                except Exception as e:
+                    status, body = 500, {"error": f"{type(e).__name__}: {e}"}
+                await write_response(writer, status, body, request["keep_alive"])
+                if not request["keep_alive"]:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Cancelled when the service stops, with clients still connected
+            pass
+        finally:
+            writer.close()
+
+
+async def read_request(reader):
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise RequestError(400, "Incomplete request.")
+        return None
+    except asyncio.LimitOverrunError:
+        raise RequestError(413, "The request header is too long.")
+
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise RequestError(400, "Invalid request line.")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+    if headers.get("transfer-encoding", "identity").lower() != "identity":
+        raise RequestError(400, "Only requests with a Content-Length are supported.")
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise RequestError(400, "Invalid Content-Length.")
+    if length > MAX_BODY_BYTES:
+        raise RequestError(413, "The request body is too large.")
+    body = await reader.readexactly(length) if length > 0 else b""
+
+    connection = headers.get("connection", "").lower()
+    url = urlsplit(target)
+    return {
+        "method": method.upper(),
+        "path": url.path.rstrip("/") or "/",
+        "query": dict(parse_qsl(url.query)),
+        "content_type": headers.get("content-type", "").split(";")[0].strip().lower(),
+        "body": body,
+        "keep_alive": connection != "close" if version == "HTTP/1.1" else connection == "keep-alive",
+    }
+
+
+async def write_response(writer, status, body, keep_alive=True):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode("utf8")
+    head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode("latin-1") + body)
+    await writer.drain()
+
+
+async def serve(service, host, port):
+    server = await asyncio.start_server(service.serve_client, host, port, limit=MAX_HEADER_BYTES)
+    print(f"Listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def stop(signum, frame):
+    # SIGTERM ends the service like Ctrl+C, the worker processes are only stopped by close()
+    raise KeyboardInterrupt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local HTTP/JSON service with the viewer's processing.")
+    parser.add_argument("--host", default="127.0.0.1", help="only local clients by default")
+    parser.add_argument("-p", "--port", type=int, default=None)
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read("config.ini")
+
+    signal.signal(signal.SIGTERM, stop)
+    analysis_service = AnalysisService(config, args.workers or config.getint("Settings", "service_workers"),
+                                       config.getint("Settings", "service_cache_spectra"))
+    try:
+        asyncio.run(serve(analysis_service, args.host, args.port or config.getint("Settings", "service_port")))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        analysis_service.close()
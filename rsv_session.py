@@ -0,0 +1,67 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+SESSION_EXTENSION = ".rsvs"
+MAGIC = b"RSVSESS\x00"
+VERSION = 1
+# Every array starts on a 64 byte boundary, so it can be mapped and used without a copy
+ALIGNMENT = 64
+HEADER = struct.Struct("<8sII")
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_session(path, state, arrays):
+    table = {}
+    offset = 0
+    contiguous = {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        if array.dtype.hasobject:
+            raise ValueError(f"{name} can't be stored in a session.")
+        contiguous[name] = array
+        table[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _align(offset + array.nbytes)
+
+    header = json.dumps({"state": state, "arrays": table}).encode("utf8")
+    data_start = _align(HEADER.size + len(header))
+
+    # Written next to the target first, a failed save never destroys the previous session
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for name, array in contiguous.items():
+            f.seek(data_start + table[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(temp_path, path)
+
+
+def read_session(path, memory_map=True):
+    with open(path, "rb") as f:
+        magic, version, header_length = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a session file.")
+        if version > VERSION:
+            raise ValueError(f"{path} was saved by a newer version of the viewer.")
+        header = json.loads(f.read(header_length).decode("utf8"))
+
+    data_start = _align(HEADER.size + header_length)
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        offset = data_start + entry["offset"]
+        if not int(np.prod(shape)):
+            arrays[name] = np.empty(shape, dtype=dtype)
+        elif memory_map:
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+        else:
+            arrays[name] = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+    return header["state"], arrays
@@ -0,0 +1,203 @@
+import argparse
+from collections import OrderedDict
+from configparser import ConfigParser
+
+import numpy as np
+
+from rsv_calibration import load_overrides
+from rsv_efficiency import compensate_counts, curve_version, load_curves, model_for_device
+from rsv_parser import parse_spectrum
+from rsv_processing import DEFAULT_FWHM_MODEL, energy_axis, normalize, smooth
+
+# Per value in a python list: the pointer in the list plus the boxed int or float
+LIST_INT_BYTES = 8 + 28
+LIST_FLOAT_BYTES = 8 + 24
+
+
+def as_counts(data_points):
+    counts = np.asarray(data_points)
+    if counts.size and (counts.min() < 0 or counts.max() > np.iinfo(np.uint32).max):
+        raise ValueError("Counts don't fit into 32 bit unsigned integers.")
+    counts = counts.astype(np.uint32)
+    counts.setflags(write=False)
+    return counts
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+class SpectrumStore:
+    def __init__(self, max_derived_bytes=64 * 1024 * 1024, efficiency_curves=None):
+        self.spectra = {}
+        self.efficiency_curves = efficiency_curves or {}
+        self.next_key = 0
+        # Energy axes shared by every spectrum with the same calibration and channel count
+        self.axes = {}
+        self.axis_users = {}
+        # Derived series are calculated on demand, the least recently used ones are dropped first
+        self.derived = OrderedDict()
+        self.derived_bytes = 0
+        self.max_derived_bytes = max_derived_bytes
+
+    def __len__(self):
+        return len(self.spectra)
+
+    def __contains__(self, key):
+        return key in self.spectra
+
+    def keys(self):
+        return list(self.spectra)
+
+    def _acquire_axis(self, coeffs, n_channels):
+        axis_key = (tuple(float(c) for c in coeffs), n_channels)
+        if axis_key not in self.axes:
+            axis = energy_axis(axis_key[0], n_channels).astype(np.float32)
+            axis.setflags(write=False)
+            self.axes[axis_key] = axis
+            self.axis_users[axis_key] = 0
+        self.axis_users[axis_key] += 1
+        return axis_key
+
+    def _release_axis(self, axis_key):
+        self.axis_users[axis_key] -= 1
+        if not self.axis_users[axis_key]:
+            del self.axes[axis_key]
+            del self.axis_users[axis_key]
+
+    def add(self, spectrum):
+        counts = as_counts(spectrum["data_points"])
+        entry = {key: value for key, value in spectrum.items() if key not in ("data_points", "bg_data_points")}
+        entry["counts"] = counts
+        entry["axis"] = self._acquire_axis(spectrum["coeffs"], counts.size)
+        entry["bg_counts"] = None
+        entry["bg_axis"] = None
+        if spectrum.get("bg_data_points") is not None:
+            entry["bg_counts"] = as_counts(spectrum["bg_data_points"])
+            entry["bg_axis"] = self._acquire_axis(spectrum["bg_coeffs"], entry["bg_counts"].size)
+
+        key = self.next_key
+        self.next_key += 1
+        self.spectra[key] = entry
+        return key
+
+    def remove(self, key):
+        entry = self.spectra.pop(key)
+        self._release_axis(entry["axis"])
+        if entry["bg_axis"] is not None:
+            self._release_axis(entry["bg_axis"])
+        for derived_key in [k for k in self.derived if k[0] == key]:
+            self.derived_bytes -= self.derived.pop(derived_key).nbytes
+
+    def set_efficiency_curves(self, efficiency_curves):
+        # Compensated series of the old curves are stale
+        self.efficiency_curves = efficiency_curves or {}
+        self.derived.clear()
+        self.derived_bytes = 0
+
+    def metadata(self, key):
+        entry = self.spectra[key]
+        return {k: v for k, v in entry.items() if k not in ("counts", "bg_counts", "axis", "bg_axis")}
+
+    def counts(self, key, background=False):
+        entry = self.spectra[key]
+        return entry["bg_counts"] if background else entry["counts"]
+
+    def energies(self, key, background=False):
+        entry = self.spectra[key]
+        axis_key = entry["bg_axis"] if background else entry["axis"]
+        return None if axis_key is None else self.axes[axis_key]
+
+    def spectrum(self, key):
+        # Same layout as parse_spectrum, for the processing and export functions
+        entry = self.spectra[key]
+        spectrum = self.metadata(key)
+        spectrum["data_points"] = entry["counts"]
+        spectrum["bg_data_points"] = entry["bg_counts"]
+        return spectrum
+
+    def series(self, key, name, low_smooth=0, high_smooth=0, smoothing_filter="boxcar",
+               fwhm_model=DEFAULT_FWHM_MODEL):
+        entry = self.spectra[key]
+        model = model_for_device(self.efficiency_curves, entry["device"])
+        # A curve file that is edited gives new compensated series
+        derived_key = (key, name, low_smooth, high_smooth, smoothing_filter, tuple(fwhm_model), curve_version(model))
+        if derived_key in self.derived:
+            self.derived.move_to_end(derived_key)
+            return self.derived[derived_key]
+
+        background = name.endswith("_bg")
+        counts = self.counts(key, background)
+        if counts is None:
+            return None
+        coeffs = entry["bg_coeffs"] if background else entry["coeffs"]
+        if name in ("normalized", "normalized_bg"):
+            values = normalize(counts)
+        elif name in ("compensated", "compensated_bg"):
+            energies = energy_axis(tuple(coeffs), counts.size)
+            values = normalize(smooth(energies, compensate_counts(counts, coeffs, model), low_smooth, high_smooth,
+                                      smoothing_filter, coeffs, fwhm_model))
+        else:
+            raise ValueError(f"Unknown series {name}.")
+
+        values = values.astype(np.float32)
+        values.setflags(write=False)
+        self.derived[derived_key] = values
+        self.derived_bytes += values.nbytes
+        while self.derived_bytes > self.max_derived_bytes and len(self.derived) > 1:
+            self.derived_bytes -= self.derived.popitem(last=False)[1].nbytes
+        return values
+
+    def memory_usage(self):
+        counts_bytes = 0
+        values = 0
+        for entry in self.spectra.values():
+            for counts in (entry["counts"], entry["bg_counts"]):
+                if counts is not None:
+                    counts_bytes += counts.nbytes
+                    values += counts.size
+        axes_bytes = sum(axis.nbytes for axis in self.axes.values())
+
+        return {
+            "spectra": len(self.spectra),
+            "energy_axes": len(self.axes),
+            "counts_bytes": counts_bytes,
+            "axes_bytes": axes_bytes,
+            "derived_series": len(self.derived),
+            "derived_bytes": self.derived_bytes,
+            "total_bytes": counts_bytes + axes_bytes + self.derived_bytes,
+            # The same counts and one energy list per spectrum, held as python lists
+            "python_lists_bytes": values * (LIST_INT_BYTES + LIST_FLOAT_BYTES),
+        }
+
+    def memory_report(self):
+        usage = self.memory_usage()
+        return (f"{usage['spectra']} spectra, {usage['energy_axes']} energy axes\n"
+                f"Counts: {format_bytes(usage['counts_bytes'])}\n"
+                f"Energy axes: {format_bytes(usage['axes_bytes'])}\n"
+                f"Derived series: {usage['derived_series']}, {format_bytes(usage['derived_bytes'])}\n"
+                f"Total: {format_bytes(usage['total_bytes'])} "
+                f"(as python lists: {format_bytes(usage['python_lists_bytes'])})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load RadiaCode spectra into memory and show the memory used.")
+    parser.add_argument("files", nargs="+", help="RadiaCode XML files")
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read("config.ini")
+    overrides = load_overrides(config)
+    include_channel_1023 = config.getboolean("Settings", "include_channel_1023")
+
+    store = SpectrumStore(efficiency_curves=load_curves(config))
+    for xml_file in args.files:
+        try:
+            store.add(parse_spectrum(xml_file, include_channel_1023, overrides))
+        except ValueError as e:
+            print(f"{xml_file}: {e}")
+    print(store.memory_report())
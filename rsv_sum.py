@@ -0,0 +1,191 @@
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from configparser import ConfigParser
+from datetime import timedelta
+
+import numpy as np
+
+from rsv_calibration import load_overrides
+from rsv_parser import parse_spectrum
+from rsv_processing import channel_to_energy
+
+# Every worker sums a chunk of files and only sends back its partial sum
+CHUNK_SIZE = 100
+# Parsing a file takes a few milliseconds and starting a worker process about a second,
+# smaller selections are faster without the pool
+PARALLEL_MIN_FILES = 1000
+
+
+def same_calibration(coeffs, other_coeffs, n_channels, other_n_channels):
+    return n_channels == other_n_channels and np.allclose(coeffs, other_coeffs, rtol=1e-9, atol=0)
+
+
+def rebin_to_edges(counts, source_coeffs, target_edges):
+    # Counts are spread evenly over each channel, the cumulative counts at the target edges are
+    # interpolated from the ones at the channel edges of the source, so no count is lost or created
+    counts = np.asarray(counts, dtype=float)
+    source_edges = channel_to_energy(np.arange(counts.size + 1) - 0.5, source_coeffs)
+    cumulative = np.concatenate(([0.0], np.cumsum(counts)))
+    return np.diff(np.interp(target_edges, source_edges, cumulative))
+
+
+def rebin(counts, source_coeffs, target_coeffs, n_channels):
+    return rebin_to_edges(counts, source_coeffs, channel_to_energy(np.arange(n_channels + 1) - 0.5, target_coeffs))
+
+
+class SpectrumAccumulator:
+    def __init__(self, coeffs=None, n_channels=None):
+        # The calibration of the sum is the one of the first spectrum, unless it is given
+        self.coeffs = None if coeffs is None else [float(c) for c in coeffs]
+        self.n_channels = n_channels
+        self.counts = None
+        self.seconds = 0.0
+        self.files = 0
+        self.rebinned = 0
+        self.start_time = None
+        self.end_time = None
+        self.serial_numbers = set()
+        self.devices = set()
+
+    def add(self, spectrum):
+        counts = np.asarray(spectrum["data_points"])
+        if self.coeffs is None:
+            self.coeffs = [float(c) for c in spectrum["coeffs"]]
+        if self.n_channels is None:
+            self.n_channels = counts.size
+        if self.counts is None:
+            self.counts = np.zeros(self.n_channels, dtype=float)
+
+        if same_calibration(spectrum["coeffs"], self.coeffs, counts.size, self.n_channels):
+            self.counts += counts
+        else:
+            self.counts += rebin(counts, spectrum["coeffs"], self.coeffs, self.n_channels)
+            self.rebinned += 1
+
+        self.seconds += spectrum["seconds"]
+        self.files += 1
+        self.start_time = min(filter(None, (self.start_time, spectrum["start_time"])))
+        self.end_time = max(filter(None, (self.end_time, spectrum["end_time"])))
+        self.serial_numbers.add(spectrum["serial_number"])
+        self.devices.add(spectrum["device"])
+
+    def result(self, sample_name=None):
+        if not self.files:
+            raise ValueError("No spectra were added.")
+
+        # Same layout as parse_spectrum, rebinned counts are rounded to whole counts
+        serial_number = next(iter(self.serial_numbers)) if len(self.serial_numbers) == 1 else ""
+        device = next(iter(self.devices)) if len(self.devices) == 1 else "Mixed"
+        return {
+            "sample_name": sample_name or f"Sum of {self.files} spectra",
+            "serial_number": serial_number or "",
+            "device": device,
+            "coeffs": list(self.coeffs),
+            "file_coeffs": list(self.coeffs),
+            "data_points": np.rint(self.counts).astype(np.uint32),
+            "seconds": self.seconds,
+            "duration": str(timedelta(seconds=round(self.seconds))),
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "bg_coeffs": None,
+            "bg_data_points": None,
+            "bg_seconds": None,
+        }
+
+    def merge(self, other):
+        if not other.files:
+            return
+        if self.counts is None:
+            self.coeffs, self.n_channels = other.coeffs, other.n_channels
+            self.counts = np.zeros(self.n_channels, dtype=float)
+        self.counts += other.counts
+        self.seconds += other.seconds
+        self.files += other.files
+        self.rebinned += other.rebinned
+        self.start_time = min(filter(None, (self.start_time, other.start_time)))
+        self.end_time = max(filter(None, (self.end_time, other.end_time)))
+        self.serial_numbers |= other.serial_numbers
+        self.devices |= other.devices
+
+
+def _sum_task(task):
+    xml_files, coeffs, n_channels, include_channel_1023, overrides = task
+    partial = SpectrumAccumulator(coeffs, n_channels)
+    errors = []
+    for xml_file in xml_files:
+        try:
+            partial.add(parse_spectrum(xml_file, include_channel_1023, overrides))
+            errors.append(None)
+        except (ValueError, OSError) as e:
+            errors.append(str(e))
+    return partial, errors
+
+
+def accumulate_files(accumulator, xml_files, include_channel_1023=False, overrides=None, workers=None):
+    # Generator over (file, error), so the GUI can show progress. Memory stays the same for any number of files
+    xml_files = list(xml_files)
+    while accumulator.coeffs is None and xml_files:
+        # The first readable spectrum sets the calibration all others are rebinned to
+        xml_file = xml_files.pop(0)
+        partial, errors = _sum_task(([xml_file], None, None, include_channel_1023, overrides))
+        accumulator.merge(partial)
+        yield xml_file, errors[0]
+
+    chunks = [xml_files[i:i + CHUNK_SIZE] for i in range(0, len(xml_files), CHUNK_SIZE)]
+    tasks = [(chunk, accumulator.coeffs, accumulator.n_channels, include_channel_1023, overrides)
+             for chunk in chunks]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if workers <= 1 or len(xml_files) < PARALLEL_MIN_FILES:
+        results = map(_sum_task, tasks)
+        for chunk, (partial, errors) in zip(chunks, results):
+            accumulator.merge(partial)
+            yield from zip(chunk, errors)
+        return
+
+    # Spawned workers, forking a process that already has a QApplication is not safe
+    context = multiprocessing.get_context("spawn")
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    try:
+        futures = {}
+        for chunk, task in zip(chunks, tasks):
+            futures[executor.submit(_sum_task, task)] = chunk
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                partial, errors = future.result()
+                accumulator.merge(partial)
+                yield from zip(futures.pop(future), errors)
+    finally:
+        # Closed early by a cancel, only the chunks in progress are waited for
+        executor.shutdown(cancel_futures=True)
+
+
+if __name__ == "__main__":
+    # Only needed here, the worker processes import this module and start faster without them
+    from rsv_export import FORMATS, export_spectrum
+    from rsv_pipeline import load_settings, process_spectrum
+
+    parser = argparse.ArgumentParser(description="Sum RadiaCode spectra and export the sum.")
+    parser.add_argument("files", nargs="+", help="RadiaCode XML files")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="n42")
+    parser.add_argument("-o", "--output", default="sum", help="output file without extension")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read("config.ini")
+
+    total = SpectrumAccumulator()
+    for source, error in accumulate_files(total, args.files, config.getboolean("Settings", "include_channel_1023"),
+                                          load_overrides(config), args.workers):
+        if error:
+            print(f"{source}: {error}")
+
+    summed = total.result(os.path.basename(args.output))
+    settings = load_settings(config)
+    settings["background"] = "none"
+    path = args.output + FORMATS[args.format]
+    export_spectrum(path, args.format, summed, process_spectrum(summed, settings))
+    print(f"{total.files} spectra ({total.rebinned} rebinned), {summed['duration']} -> {path}")
@@ -0,0 +1,133 @@
+import argparse
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from scipy.special import ndtr
+
+from rsv_processing import channel_to_energy
+
+# Detected counts per second in the full energy peak of every line
+DEFAULT_LINES = ((661.7, 20.0),)
+# Natural background of the internal background spectrum: K-40, Bi-214 and Tl-208
+BACKGROUND_LINES = ((1460.8, 0.3), (609.3, 0.2), (2614.5, 0.05))
+DEFAULT_COEFFS = (-6.0, 2.4, 0.0004)
+# Spectra sampled with one call, the expected counts are the same for all of them
+CHUNK_SIZE = 256
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def parse_lines(text):
+    # "661.7:20, 1460.8:2" -> ((661.7, 20.0), (1460.8, 2.0)), energy in keV and counts per second
+    lines = []
+    for line in text.split(","):
+        if not line.strip():
+            continue
+        try:
+            energy, cps = line.split(":")
+            lines.append((float(energy), float(cps)))
+        except ValueError:
+            raise ValueError(f"Line {line.strip()} is not energy:cps.")
+    return tuple(lines)
+
+
+def expected_rates(coeffs, n_channels, lines=DEFAULT_LINES, continuum_cps=100.0, continuum_kev=150.0,
+                   fwhm_662_percent=8.0):
+    # Counts per second in every channel. Gaussian lines with the scintillator resolution and an exponential
+    # continuum, both integrated over the energy range of every channel
+    edges = channel_to_energy(np.arange(n_channels + 1) - 0.5, coeffs)
+    low, high = np.minimum(edges[:-1], edges[1:]), np.maximum(edges[:-1], edges[1:])
+
+    rates = continuum_cps * (np.exp(-np.maximum(low, 0) / continuum_kev) -
+                             np.exp(-np.maximum(high, 0) / continuum_kev))
+    for energy, cps in lines:
+        sigma = fwhm_662_percent / 100 * np.sqrt(662 * energy) / (2 * np.sqrt(2 * np.log(2)))
+        rates += cps * (ndtr((high - energy) / sigma) - ndtr((low - energy) / sigma))
+    return rates
+
+
+def sample_counts(rates, seconds, n_spectra, rng):
+    # One spectrum per row, all drawn with one call
+    return rng.poisson(rates * seconds, size=(n_spectra, rates.size)).astype(np.uint32)
+
+
+def spectrum_element(tag, serial_number, coeffs, seconds, counts):
+    coefficients = "".join(f"<Coefficient>{float(c)!r}</Coefficient>" for c in coeffs)
+    data_points = "</DataPoint><DataPoint>".join(map(str, counts.tolist()))
+    return (f"<{tag}><SerialNumber>{serial_number}</SerialNumber><EnergyCalibration><PolynomialOrder>{len(coeffs) - 1}"
+            f"</PolynomialOrder><Coefficients>{coefficients}</Coefficients></EnergyCalibration>"
+            f"<MeasurementTime>{seconds:.0f}</MeasurementTime><Spectrum><DataPoint>{data_points}</DataPoint>"
+            f"</Spectrum></{tag}>")
+
+
+def spectrum_xml(counts, coeffs, serial_number, start_time, seconds, bg_counts=None, bg_seconds=None):
+    # The parts of the files of the RadiaCode app the viewer reads
+    end_time = start_time + timedelta(seconds=seconds)
+    background = ""
+    if bg_counts is not None:
+        background = spectrum_element("BackgroundEnergySpectrum", serial_number, coeffs, bg_seconds or seconds,
+                                      bg_counts)
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            "<ResultDataFile><ResultDataList><ResultData>"
+            f"<StartTime>{start_time.strftime(TIME_FORMAT)}</StartTime><EndTime>{end_time.strftime(TIME_FORMAT)}"
+            f"</EndTime>{spectrum_element('EnergySpectrum', serial_number, coeffs, seconds, counts)}{background}"
+            "</ResultData></ResultDataList></ResultDataFile>\n")
+
+
+def generate_files(output_dir, n_spectra, lines=DEFAULT_LINES, continuum_cps=100.0, continuum_kev=150.0,
+                   coeffs=DEFAULT_COEFFS, n_channels=1024, seconds=600.0, fwhm_662_percent=8.0,
+                   serial_number="RC-102-000001", start_time=datetime(2025, 1, 1), background=False,
+                   bg_seconds=3600.0, seed=None):
+    # Generator over the written files, one measurement after the other like a monitoring series.
+    # The same seed gives the same files
+    rng = np.random.default_rng(seed)
+    rates = expected_rates(coeffs, n_channels, lines, continuum_cps, continuum_kev, fwhm_662_percent)
+    bg_rates = None
+    if background:
+        bg_rates = expected_rates(coeffs, n_channels, BACKGROUND_LINES, continuum_cps / 10, continuum_kev,
+                                  fwhm_662_percent)
+    digits = len(str(max(n_spectra - 1, 0)))
+
+    for first in range(0, n_spectra, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, n_spectra - first)
+        counts = sample_counts(rates, seconds, size, rng)
+        bg_counts = sample_counts(bg_rates, bg_seconds, size, rng) if background else [None] * size
+        for i in range(size):
+            index = first + i
+            path = os.path.join(output_dir, f"synthetic_{index:0{digits}d}.xml")
+            xml = spectrum_xml(counts[i], coeffs, serial_number, start_time + timedelta(seconds=index * seconds),
+                               seconds, bg_counts[i], bg_seconds)
+            with open(path, "w", encoding="utf8") as f:
+                f.write(xml)
+            yield path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic RadiaCode XML spectra.")
+    parser.add_argument("-n", "--number", type=int, default=1, help="number of spectra")
+    parser.add_argument("-o", "--output", default=".", help="output directory")
+    parser.add_argument("-l", "--lines", default="661.7:20", help="energy:cps of every line, comma separated")
+    parser.add_argument("--continuum", type=float, default=100.0, help="cps of the exponential continuum")
+    parser.add_argument("--continuum-kev", type=float, default=150.0, help="decay energy of the continuum")
+    parser.add_argument("-c", "--coeffs", default=", ".join(str(c) for c in DEFAULT_COEFFS),
+                        help="energy calibration a0, a1, a2")
+    parser.add_argument("--channels", type=int, default=1024)
+    parser.add_argument("-t", "--seconds", type=float, default=600.0, help="measurement time of every spectrum")
+    parser.add_argument("--fwhm", type=float, default=8.0, help="FWHM at 662 keV in percent")
+    parser.add_argument("--serial", default="RC-102-000001", help="serial number, sets the device type")
+    parser.add_argument("-b", "--background", action="store_true", help="add a BackgroundEnergySpectrum")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    try:
+        spectrum_lines = parse_lines(args.lines)
+        calibration = tuple(float(c) for c in args.coeffs.split(","))
+    except ValueError as e:
+        parser.error(str(e))
+
+    os.makedirs(args.output, exist_ok=True)
+    files = generate_files(args.output, args.number, spectrum_lines, args.continuum, args.continuum_kev, calibration,
+                           args.channels, args.seconds, args.fwhm, args.serial, background=args.background,
+                           seed=args.seed)
+    written = sum(1 for _ in files)
+    print(f"{written} spectra -> {args.output}")
@@ -0,0 +1,75 @@
+import re
+from functools import lru_cache
+
+PLOT_COLOR_KEYS = {
+    "bg": "plt_bg_color",
+    "title": "plt_title_color",
+    "x_label": "plt_x_label_color",
+    "y_label": "plt_y_label_color",
+    "original": "plt_original_color",
+    "compensated": "plt_compensated_color",
+    "original_bg": "plt_original_bg_color",
+    "compensated_bg": "plt_compensated_bg_color",
+    "original_result": "plt_original_result_color",
+    "compensated_result": "plt_compensated_result_color",
+    "significance": "plt_significance_color",
+    "roi": "plt_roi_color",
+    "annotation_line": "plt_annotation_line_color",
+    "annotation_text": "plt_annotation_text_color",
+    "annotation_bg": "app_bg_color",
+}
+
+# Placeholders in style.qss that are named differently in the theme sections
+QSS_ALIASES = {
+    "original_plot_checkbox_color": "plt_original_color",
+    "compensated_plot_checkbox_color": "plt_compensated_color",
+    "original_bg_plot_checkbox_color": "plt_original_bg_color",
+    "compensated_bg_plot_checkbox_color": "plt_compensated_bg_color",
+}
+
+PLACEHOLDER = re.compile(r"\{\{(\w+)}}")
+
+
+@lru_cache(maxsize=None)
+def _read_qss(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+_stylesheets = {}
+_palettes = {}
+
+
+def compile_stylesheet(config, theme, path="style.qss"):
+    key = (id(config), theme, path)
+    if key not in _stylesheets:
+        colors = dict(config.items(f"{theme.title()}Theme"))
+        for placeholder, option in QSS_ALIASES.items():
+            colors.setdefault(placeholder, colors.get(option))
+
+        # One pass over the template, unknown placeholders are left as they are
+        def substitute(match):
+            return colors.get(match.group(1)) or match.group(0)
+
+        _stylesheets[key] = PLACEHOLDER.sub(substitute, _read_qss(path))
+    return _stylesheets[key]
+
+
+def plot_palette(config, theme, black_on_white=False):
+    key = (id(config), theme, bool(black_on_white))
+    if key not in _palettes:
+        if black_on_white:
+            palette = {color: "black" for color in PLOT_COLOR_KEYS}
+            palette["bg"] = "white"
+            palette["annotation_bg"] = "white"
+        else:
+            section = f"{theme.title()}Theme"
+            palette = {color: config.get(section, option) for color, option in PLOT_COLOR_KEYS.items()}
+        _palettes[key] = palette
+    return _palettes[key]
+
+
+def clear_cache():
+    _read_qss.cache_clear()
+    _stylesheets.clear()
+    _palettes.clear()
@@ -0,0 +1,239 @@
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from configparser import ConfigParser
+from itertools import product
+
+import numpy as np
+
+from rsv_calibration import REFERENCE_LINES, load_overrides, reference_energies
+from rsv_efficiency import BUILTIN_MODEL, compensate_counts, load_curves, model_for_device
+from rsv_parser import parse_spectrum
+from rsv_pipeline import detect_peak_indices
+from rsv_processing import DEFAULT_FWHM_MODEL, energy_axis, model_fwhm, normalize, parse_fwhm_model, smooth, \
+    snip_continuum
+
+SMOOTHING_PARAMETERS = ("low_smooth", "high_smooth")
+PEAK_PARAMETERS = ("min_height", "prominence", "distance")
+# Channels times spectra times smoothing settings of a round. Below that the search is done before
+# the worker processes would have started
+PARALLEL_MIN_WORK = 100_000
+# A noise peak has to cost at least what a line earns, otherwise the noisiest settings win
+MIN_FALSE_PEAK_PENALTY = 1.0
+
+
+def slider_ranges(config):
+    return {
+        "low_smooth": (config.getint("Settings", "low_smooth_slider_min"),
+                       config.getint("Settings", "low_smooth_slider_max")),
+        "high_smooth": (config.getint("Settings", "high_smooth_slider_min"),
+                        config.getint("Settings", "high_smooth_slider_max")),
+        "min_height": (0, 100),
+        "prominence": (config.getint("Settings", "prominence_slider_min"),
+                       config.getint("Settings", "prominence_slider_max")),
+        "distance": (config.getint("Settings", "distance_slider_min"),
+                     config.getint("Settings", "distance_slider_max")),
+    }
+
+
+def grid_values(low, high, steps):
+    return [int(v) for v in np.unique(np.rint(np.linspace(low, high, max(int(steps), 2))))]
+
+
+def declared_lines(text):
+    # "Cs-137, K-40" -> the energies of their lines. Without nuclides all known lines are used
+    names = [name.strip() for name in text.split(",") if name.strip()]
+    if not names:
+        return reference_energies()[0]
+    known = {name.lower(): name for name in REFERENCE_LINES}
+    energies = []
+    for name in names:
+        if name.lower() not in known:
+            raise ValueError(f"Unknown nuclide {name}, known are {', '.join(REFERENCE_LINES)}.")
+        energies.extend(REFERENCE_LINES[known[name.lower()]])
+    return np.unique(energies)
+
+
+def split_counts(counts, parts, seed=0):
+    # Every count goes to one of the parts at random, like repeated measurements of 1 / parts of the time each
+    counts = np.clip(np.rint(np.asarray(counts, dtype=float)), 0, None).astype(np.int64)
+    return np.random.default_rng(seed).multinomial(counts, np.full(parts, 1 / parts)).T
+
+
+def detection_source(counts, coeffs, model=BUILTIN_MODEL, snip=False, snip_iterations=30, snip_fwhm_662_percent=8.0):
+    # The compensated counts the peaks are found in, only the smoothing changes during the search
+    counts = np.asarray(counts, dtype=float)
+    if snip:
+        counts = np.maximum(counts - snip_continuum(counts, coeffs, snip_iterations, snip_fwhm_662_percent), 0)
+    return list(coeffs), compensate_counts(counts, coeffs, model)
+
+
+def matched_lines(peak_energies, lines, tolerances):
+    # The lines with a peak within their tolerance, one peak per line, closest pairs first. No shift is searched,
+    # with a free shift most noise peaks would line up with one of the lines
+    matched = np.zeros(lines.size, dtype=bool)
+    if peak_energies.size == 0 or lines.size == 0:
+        return matched
+    distance = np.abs(peak_energies[:, None] - lines[None, :])
+    used = np.zeros(peak_energies.size, dtype=bool)
+    for flat in np.argsort(distance, axis=None):
+        p, line = np.unravel_index(flat, distance.shape)
+        if distance[p, line] <= tolerances[line] and not used[p] and not matched[line]:
+            used[p] = matched[line] = True
+    return matched
+
+
+def line_score(found, n_peaks, false_peak_penalty):
+    # found has a row of matched lines per spectrum. A line only counts when every repeat finds it,
+    # every other peak of the tuned spectra costs
+    stable = np.logical_and.reduce(found, axis=0).sum()
+    return float(stable - false_peak_penalty * (np.mean(n_peaks) - stable))
+
+
+def rank(result):
+    # Equal scores, the settings with fewer peaks win
+    return result["score"], -result["peaks"]
+
+
+def _smoothing_task(task):
+    # All peak settings of one smoothing setting, the smoothed spectra are calculated once
+    sources, repeats, low_smooth, high_smooth, smoothing_filter, fwhm_model, peak_grid, lines, tolerances, \
+        false_peak_penalty = task
+    smoothed = []
+    for coeffs, compensated in sources + repeats:
+        energies = energy_axis(coeffs, compensated.size)
+        smoothed.append((energies, normalize(smooth(energies, compensated, low_smooth, high_smooth, smoothing_filter,
+                                                      coeffs, fwhm_model))))
+
+    best = None
+    # Many settings find the same peaks, their lines are only matched once
+    found_lines = {}
+    for min_height, prominence, distance in product(*peak_grid):
+        found = []
+        n_peaks = []
+        for i, (energies, data) in enumerate(smoothed):
+            peaks = detect_peak_indices(data, min_height, prominence, distance)
+            key = (i, peaks.tobytes())
+            if key not in found_lines:
+                found_lines[key] = matched_lines(energies[peaks], lines, tolerances)
+            found.append(found_lines[key])
+            if i < len(sources):
+                n_peaks.append(peaks.size)
+        result = {"score": line_score(found, n_peaks, false_peak_penalty), "peaks": float(np.mean(n_peaks)),
+                  "low_smooth": low_smooth, "high_smooth": high_smooth, "min_height": min_height,
+                  "prominence": prominence, "distance": distance}
+        if best is None or rank(result) > rank(best):
+            best = result
+    return best
+
+
+def tune(sources, ranges, smoothing_filter="boxcar", fwhm_model=DEFAULT_FWHM_MODEL, steps=5, rounds=3,
+         lines=None, match_fwhm=0.5, false_peak_penalty=1.0, repeats=(), workers=None):
+    # Generator over (round, done, total, best), so the GUI can show progress. Every round is a grid over
+    # the ranges, the next one a finer grid around the best settings so far. sources are the tuned spectra,
+    # repeats more measurements of the same sample, a line only counts when all of them find it
+    ranges = dict(ranges)
+    best = None
+    lines = reference_energies()[0] if lines is None else np.asarray(lines, dtype=float)
+    # A peak matches a line within a part of the detector resolution at its energy
+    tolerances = match_fwhm * model_fwhm(lines, fwhm_model)
+    false_peak_penalty = max(false_peak_penalty, MIN_FALSE_PEAK_PENALTY)
+    sources, repeats = list(sources), list(repeats)
+    work = sum(compensated.size for _, compensated in sources + repeats) * max(int(steps), 2) ** 2
+    workers = min(workers or os.cpu_count() or 1, max(int(steps), 2) ** 2)
+    executor = None
+    if workers > 1 and work >= PARALLEL_MIN_WORK:
+        # Spawned workers, forking a process that already has a QApplication is not safe
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    try:
+        for search_round in range(max(int(rounds), 1)):
+            grids = {name: grid_values(*ranges[name], steps) for name in ranges}
+            peak_grid = [grids[name] for name in PEAK_PARAMETERS]
+            smoothing_grid = product(*(grids[name] for name in SMOOTHING_PARAMETERS))
+            tasks = [(sources, repeats, low_smooth, high_smooth, smoothing_filter, fwhm_model, peak_grid, lines,
+                      tolerances, false_peak_penalty) for low_smooth, high_smooth in smoothing_grid]
+            if executor is None:
+                results = enumerate(map(_smoothing_task, tasks))
+            else:
+                futures = {executor.submit(_smoothing_task, task): i for i, task in enumerate(tasks)}
+                results = ((futures[future], future.result()) for future in _completed(futures))
+
+            # The first of equal results in grid order, whatever order the workers finish in
+            round_best = None
+            for done, (i, result) in enumerate(results, 1):
+                if round_best is None or (*rank(result), -i) > (*rank(round_best[1]), -round_best[0]):
+                    round_best = i, result
+                if best is None or rank(round_best[1]) > rank(best):
+                    best = round_best[1]
+                yield search_round, done, len(tasks), best
+
+            # Around the best value, one step of the last grid to both sides
+            finished = True
+            for name, values in grids.items():
+                step = max(np.diff(values).max(), 1) if len(values) > 1 else 1
+                finished &= step <= 1
+                ranges[name] = (max(best[name] - step, ranges[name][0]), min(best[name] + step, ranges[name][1]))
+            if finished:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def _completed(futures):
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        yield from done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find peak detection settings that find the known lines of "
+                                                 "RadiaCode spectra.")
+    parser.add_argument("files", nargs="+", help="RadiaCode XML files, repeated spectra of one sample")
+    parser.add_argument("-n", "--nuclides", default=None, help="nuclides in the sample, comma separated")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read("config.ini")
+    include_channel_1023 = config.getboolean("Settings", "include_channel_1023")
+    overrides = load_overrides(config)
+    curves = load_curves(config)
+    try:
+        sample_lines = declared_lines(args.nuclides if args.nuclides is not None
+                                      else config.get("Settings", "tuning_nuclides"))
+    except ValueError as e:
+        parser.error(str(e))
+
+    spectrum_sources = []
+    spectrum_repeats = []
+    for xml_file in args.files:
+        try:
+            spectrum = parse_spectrum(xml_file, include_channel_1023, overrides)
+        except (ValueError, OSError) as e:
+            print(f"{xml_file}: {e}")
+            continue
+        source_options = (spectrum["coeffs"], model_for_device(curves, spectrum["device"]),
+                          config.getboolean("Dynamic", "snip_peak_detection"),
+                          config.getint("Settings", "snip_iterations"),
+                          config.getfloat("Settings", "snip_fwhm_662_percent"))
+        spectrum_sources.append(detection_source(spectrum["data_points"], *source_options))
+        if len(args.files) == 1 and config.getint("Settings", "tuning_repeats") > 1:
+            # One spectrum, its counts split into parts are the repeats
+            spectrum_repeats = [detection_source(part, *source_options) for part in
+                                split_counts(spectrum["data_points"], config.getint("Settings", "tuning_repeats"))]
+
+    if spectrum_sources:
+        result = None
+        search = tune(spectrum_sources, slider_ranges(config), config.get("Dynamic", "smoothing_filter"),
+                      parse_fwhm_model(config.get("Settings", "smoothing_fwhm_model")),
+                      config.getint("Settings", "tuning_steps"), config.getint("Settings", "tuning_rounds"),
+                      sample_lines, config.getfloat("Settings", "tuning_match_fwhm"),
+                      config.getfloat("Settings", "tuning_false_peak_penalty"), spectrum_repeats, args.workers)
+        for _, _, _, result in search:
+            pass
+        print(", ".join(f"{name} = {result[name]}" for name in SMOOTHING_PARAMETERS + PEAK_PARAMETERS))
+        print(f"score {result['score']:.2f}, {result['peaks']:.1f} peaks")
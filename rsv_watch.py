@@ -0,0 +1,59 @@
+import os
+
+
+def file_signature(entry):
+    stat = entry.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FolderScanner:
+    def __init__(self, folder, extension=".xml"):
+        self.folder = folder
+        self.extension = extension
+        # Signature of every file that was handed out, and of changed files waiting to be written completely
+        self.seen = {}
+        self.pending = {}
+
+    def _entries(self):
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(self.extension) and entry.is_file():
+                    yield entry
+
+    def prime(self):
+        # Files that are already there when the watch starts are not ingested
+        for entry in self._entries():
+            self.seen[entry.path] = file_signature(entry)
+
+    def scan(self):
+        # A changed file is only ready once two scans in a row see the same size and modification time,
+        # so a file that is still being written is never parsed half finished
+        ready = []
+        current = set()
+        for entry in self._entries():
+            path = entry.path
+            current.add(path)
+            try:
+                signature = file_signature(entry)
+            except OSError:
+                continue
+            if self.seen.get(path) == signature:
+                continue
+            if self.pending.get(path) == signature:
+                del self.pending[path]
+                self.seen[path] = signature
+                ready.append((signature[0], path))
+            else:
+                self.pending[path] = signature
+
+        for path in list(self.seen):
+            if path not in current:
+                del self.seen[path]
+        for path in list(self.pending):
+            if path not in current:
+                del self.pending[path]
+
+        return [path for _, path in sorted(ready)]
+
+    def has_pending(self):
+        return bool(self.pending)